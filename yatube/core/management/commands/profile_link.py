@@ -0,0 +1,28 @@
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from core import profiling
+from yatube.settings import PROFILER_TOKEN_MAX_AGE
+
+
+class Command(BaseCommand):
+    help = (
+        'Выдает ссылку, по которой запрос сотрудника к странице '
+        'выполняется под профилировщиком.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='Путь страницы, можно с параметрами.')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        query = QueryDict(url.query, mutable=True)
+        token = profiling.make_token(url.path)
+        query[profiling.PARAMETER] = token
+        self.stdout.write(f'{url.path}?{query.urlencode()}')
+        self.stdout.write(
+            f'или заголовок X-Profile: {token}; '
+            f'действует {PROFILER_TOKEN_MAX_AGE} с.'
+        )
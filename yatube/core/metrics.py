@@ -0,0 +1,289 @@
+"""Метрики сайта для Prometheus, общие для всех процессов WSGI.
+
+Каждый процесс пишет свои значения в собственный файл в METRICS_ROOT,
+отображенный в память (mmap): массив float64, где у каждой метрики свое
+место. Раскладку мест все процессы строят одинаково — из имен адресов
+METRICS_URLCONFS и границ LATENCY_BUCKETS, — и ее хеш входит в имя
+файла, так что файлы от другой версии кода не читаются. Страница
+/metrics складывает файлы всех процессов.
+
+Файл умершего процесса, как в mark_process_dead у prometheus_client,
+сливается в общий архив: счетчики прибавляются к архивным, глубина
+очереди миниатюр отбрасывается, сам файл удаляется. Сливает страница
+/metrics, хук сервера (mark_process_dead) и процесс, который получил
+pid умершего и нашел его файл. Слияние и чтение идут под блокировкой
+файла (fcntl.flock), поэтому метрики работают только в Unix.
+"""
+import contextlib
+import fcntl
+import glob
+import mmap
+import os
+import struct
+import threading
+import zlib
+from array import array
+from importlib import import_module
+
+from django.conf import settings
+
+from yatube.settings import LATENCY_BUCKETS, METRICS_URLCONFS
+
+
+# Запросы к адресам вне METRICS_URLCONFS и к несуществующим страницам.
+OTHER_VIEW = 'other'
+
+_SLOT = struct.calcsize('d')
+_ARCHIVE = 'archive'
+_GAUGES = ('thumbnail_queue_depth',)
+
+
+def view_names():
+    names = []
+    for urlconf in METRICS_URLCONFS:
+        module = import_module(urlconf)
+        names += [
+            f'{module.app_name}:{pattern.name}'
+            for pattern in module.urlpatterns
+        ]
+    return names + [OTHER_VIEW]
+
+
+def _layout():
+    keys = []
+    for view in view_names():
+        keys += [('bucket', view, bound) for bound in LATENCY_BUCKETS]
+        keys += [
+            ('bucket', view, float('inf')),
+            ('sum', view), ('count', view), ('queries', view),
+        ]
+    keys += [('cache', 'hit'), ('cache', 'miss')]
+    keys += [('gauge', name) for name in _GAUGES]
+    return keys
+
+
+class _Store:
+    """Файл значений текущего процесса и чтение файлов всех процессов."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._path = None
+        self._map = None
+        self._keys = None
+
+    def _load_layout(self):
+        # Не при импорте: раскладке нужны загруженные адреса.
+        if self._keys is None:
+            keys = _layout()
+            self._index = {key: number for number, key in enumerate(keys)}
+            self._prefix = format(zlib.crc32(repr(keys).encode()), '08x')
+            self._keys = keys
+
+    @property
+    def keys(self):
+        self._load_layout()
+        return self._keys
+
+    @property
+    def index(self):
+        self._load_layout()
+        return self._index
+
+    def _file(self):
+        # После fork у ребенка свой pid и свой файл: отображение
+        # родителя общее, писать в него нельзя. METRICS_ROOT читается
+        # при каждой записи: тесты подменяют его через настройки.
+        self._load_layout()
+        root = settings.METRICS_ROOT
+        path = os.path.join(root, f'{self._prefix}-{os.getpid()}.db')
+        if self._path != path:
+            with self._merging(root):
+                # Файл с нашим pid остался от умершего процесса.
+                if os.path.exists(path):
+                    self._archive(root, path)
+                with open(path, 'wb') as file:
+                    file.truncate(len(self.keys) * _SLOT)
+            if self._map is not None:
+                self._map.close()
+            with open(path, 'r+b') as file:
+                self._map = mmap.mmap(file.fileno(), 0)
+            self._path = path
+        return self._map
+
+    @contextlib.contextmanager
+    def _merging(self, root):
+        os.makedirs(root, exist_ok=True)
+        lock = os.path.join(root, f'{self._prefix}.lock')
+        with open(lock, 'a') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            yield
+
+    def _read(self, path):
+        values = array('d')
+        with open(path, 'rb') as file:
+            values.frombytes(file.read(len(self.keys) * _SLOT))
+        return values
+
+    def _archive(self, root, path):
+        """Прибавляет счетчики файла процесса к архиву и удаляет файл.
+        Зовется под блокировкой _merging."""
+        archive = os.path.join(root, f'{self._prefix}-{_ARCHIVE}.db')
+        if os.path.exists(archive):
+            totals = self._read(archive)
+        else:
+            totals = array('d', bytes(len(self.keys) * _SLOT))
+        for number, value in enumerate(self._read(path)):
+            if self.keys[number][0] != 'gauge':
+                totals[number] += value
+        # Архив заменяется целиком: оборванная запись его не испортит.
+        temporary = f'{archive}.tmp'
+        with open(temporary, 'wb') as file:
+            totals.tofile(file)
+        os.replace(temporary, archive)
+        os.unlink(path)
+
+    def _process_files(self, root):
+        """Пары (pid, путь) файлов процессов, без архива."""
+        for path in glob.glob(os.path.join(root, f'{self._prefix}-*.db')):
+            name = path.rsplit('-', 1)[1][:-3]
+            if name != _ARCHIVE:
+                yield int(name), path
+
+    def add(self, values):
+        """Прибавляет значения по ключам раскладки."""
+        index = self.index
+        with self._lock:
+            data = self._file()
+            for key, value in values:
+                offset = index[key] * _SLOT
+                current, = struct.unpack_from('d', data, offset)
+                struct.pack_into('d', data, offset, current + value)
+
+    def set(self, key, value):
+        offset = self.index[key] * _SLOT
+        with self._lock:
+            struct.pack_into('d', self._file(), offset, value)
+
+    def mark_dead(self, pid):
+        self._load_layout()
+        root = settings.METRICS_ROOT
+        with self._merging(root):
+            for number, path in self._process_files(root):
+                if number == pid:
+                    self._archive(root, path)
+
+    def totals(self):
+        """Сумма архива и значений живых процессов по ключам раскладки.
+        Файлы умерших процессов по пути сливаются в архив."""
+        keys = self.keys
+        totals = [0.0] * len(keys)
+        root = settings.METRICS_ROOT
+        with self._merging(root):
+            for pid, path in list(self._process_files(root)):
+                if not _alive(pid):
+                    self._archive(root, path)
+            for path in glob.glob(
+                os.path.join(root, f'{self._prefix}-*.db')
+            ):
+                for number, value in enumerate(self._read(path)):
+                    totals[number] += value
+        return dict(zip(keys, totals))
+
+
+def _alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+_store = _Store()
+
+
+def observe_request(view, seconds, queries, cache_hits, cache_misses):
+    """Учитывает завершенный запрос к представлению view."""
+    if ('count', view) not in _store.index:
+        view = OTHER_VIEW
+    bucket = next(
+        (bound for bound in LATENCY_BUCKETS if seconds <= bound),
+        float('inf'),
+    )
+    _store.add([
+        (('bucket', view, bucket), 1),
+        (('sum', view), seconds),
+        (('count', view), 1),
+        (('queries', view), queries),
+        (('cache', 'hit'), cache_hits),
+        (('cache', 'miss'), cache_misses),
+    ])
+
+
+def set_gauge(name, value):
+    _store.set(('gauge', name), value)
+
+
+def mark_process_dead(pid):
+    """Сливает файл завершенного процесса в архив сразу, не дожидаясь
+    /metrics: для хука сервера вроде child_exit у gunicorn."""
+    _store.mark_dead(pid)
+
+
+def _number(value):
+    return repr(int(value)) if value == int(value) else repr(value)
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus."""
+    totals = _store.totals()
+    lines = [
+        '# HELP yatube_request_duration_seconds Время ответа представления.',
+        '# TYPE yatube_request_duration_seconds histogram',
+    ]
+    views = [key[1] for key in _store.keys if key[0] == 'count']
+    for view in views:
+        cumulative = 0
+        for bound in LATENCY_BUCKETS + (float('inf'),):
+            cumulative += totals[('bucket', view, bound)]
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(
+                f'yatube_request_duration_seconds_bucket'
+                f'{{view="{view}",le="{le}"}} {_number(cumulative)}'
+            )
+        lines.append(
+            f'yatube_request_duration_seconds_sum{{view="{view}"}} '
+            f'{_number(totals[("sum", view)])}'
+        )
+        lines.append(
+            f'yatube_request_duration_seconds_count{{view="{view}"}} '
+            f'{_number(totals[("count", view)])}'
+        )
+    lines += [
+        '# HELP yatube_db_queries_total Запросы к базе из представления.',
+        '# TYPE yatube_db_queries_total counter',
+    ]
+    lines += [
+        f'yatube_db_queries_total{{view="{view}"}} '
+        f'{_number(totals[("queries", view)])}'
+        for view in views
+    ]
+    hits, misses = totals[('cache', 'hit')], totals[('cache', 'miss')]
+    lines += [
+        '# HELP yatube_cache_requests_total Чтения из кеша.',
+        '# TYPE yatube_cache_requests_total counter',
+        f'yatube_cache_requests_total{{result="hit"}} {_number(hits)}',
+        f'yatube_cache_requests_total{{result="miss"}} {_number(misses)}',
+        '# HELP yatube_cache_hit_ratio Доля чтений из кеша с попаданием.',
+        '# TYPE yatube_cache_hit_ratio gauge',
+        f'yatube_cache_hit_ratio '
+        f'{_number(hits / (hits + misses)) if hits + misses else 0}',
+        '# HELP yatube_thumbnail_queue_depth Миниатюры в очереди пула.',
+        '# TYPE yatube_thumbnail_queue_depth gauge',
+        f'yatube_thumbnail_queue_depth '
+        f'{_number(totals[("gauge", "thumbnail_queue_depth")])}',
+    ]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,127 @@
+import cProfile
+import logging
+import threading
+from contextlib import ExitStack
+
+from django.db import connections
+
+from yatube.settings import SERVER_TIMING_HEADER
+
+from . import metrics, profiling, timing
+from .network import internal_request
+
+
+logger = logging.getLogger('core.timing')
+
+# Имена метрик в Server-Timing и в строке лога.
+METRICS = (
+    ('db', 'db'),
+    ('template', 'tpl'),
+    ('cache', 'cache'),
+    ('thumbnail', 'thumb'),
+)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class RequestTimingMiddleware:
+    """Время запросов к базе, шаблонов, кеша и миниатюр в заголовке
+    Server-Timing и в строке лога core.timing с именем представления;
+    оно же идет в метрики (core.metrics).
+
+    Заголовок по умолчанию получают только сотрудники и адреса
+    INTERNAL_IPS (см. SERVER_TIMING_HEADER): остальным незачем знать,
+    сколько запросов к базе стоит страница.
+
+    Стоит первой в MIDDLEWARE, чтобы total покрывал весь запрос.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with timing.collect() as timings, ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(
+                    connection.execute_wrapper(timing.count_queries)
+                )
+            response = self.get_response(request)
+        total = timings.elapsed()
+        if self.shows_server_timing(request):
+            response['Server-Timing'] = self.server_timing(timings, total)
+        match = getattr(request, 'resolver_match', None)
+        record = {
+            'view': match.view_name if match else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': _ms(total),
+        }
+        for kind, name in METRICS:
+            record[f'{name}_ms'] = _ms(timings.durations.get(kind, 0))
+            record[f'{name}_count'] = timings.counts.get(kind, 0)
+        record['cache_hits'] = timings.cache_hits
+        record['cache_misses'] = timings.cache_misses
+        logger.info(
+            ' '.join(f'{key}={value}' for key, value in record.items()),
+            extra={'timing': record},
+        )
+        metrics.observe_request(
+            record['view'], total, record['db_count'],
+            timings.cache_hits, timings.cache_misses,
+        )
+        return response
+
+    def shows_server_timing(self, request):
+        if SERVER_TIMING_HEADER != 'internal':
+            return bool(SERVER_TIMING_HEADER)
+        if internal_request(request):
+            return True
+        user = getattr(request, 'user', None)
+        return user is not None and user.is_staff
+
+    def server_timing(self, timings, total):
+        metrics = []
+        for kind, name in METRICS:
+            count = timings.counts.get(kind, 0)
+            if not count:
+                continue
+            if kind == 'cache':
+                description = (
+                    f'{timings.cache_hits} hit, {timings.cache_misses} miss'
+                )
+            else:
+                description = str(count)
+            metrics.append(
+                f'{name};dur={_ms(timings.durations[kind])};'
+                f'desc="{description}"'
+            )
+        metrics.append(f'total;dur={_ms(total)}')
+        return ', '.join(metrics)
+
+
+class ProfilerMiddleware:
+    """Профилирование запроса по токену сотрудника или выборочно
+    (см. core.profiling).
+
+    Стоит после AuthenticationMiddleware: токен действует только для
+    сотрудников.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if profiling.triggered(request):
+            profiler = cProfile.Profile()
+            response = profiler.runcall(self.get_response, request)
+            response['X-Profile'] = profiling.save_profile(profiler, request)
+            return response
+        if profiling.sampled():
+            with profiling.Sampler(threading.get_ident()) as sampler:
+                response = self.get_response(request)
+            profiling.save_stacks(sampler, request)
+            return response
+        return self.get_response(request)
@@ -0,0 +1,36 @@
+"""Запросы из внутренней сети: им доступны /metrics и Server-Timing."""
+import ipaddress
+
+from yatube.settings import INTERNAL_IPS
+
+
+def internal_address(address):
+    """Входит ли адрес в INTERNAL_IPS (там могут быть и подсети)."""
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(
+        address in ipaddress.ip_network(network, strict=False)
+        for network in INTERNAL_IPS
+    )
+
+
+def internal_request(request):
+    """Запрос из внутренней сети: внутренний и REMOTE_ADDR, и каждый
+    адрес в X-Forwarded-For, если заголовок есть.
+
+    За обратным прокси на той же машине REMOTE_ADDR у всех запросов
+    127.0.0.1, а адрес клиента прокси дописывает в X-Forwarded-For.
+    Подделать заголовок клиент может, но только дописав адреса перед
+    своим настоящим, а тот все равно окажется внешним.
+    """
+    if not internal_address(request.META.get('REMOTE_ADDR', '')):
+        return False
+    forwarded = request.META.get('HTTP_X_FORWARDED_FOR')
+    if not forwarded:
+        return True
+    return all(
+        internal_address(address.strip())
+        for address in forwarded.split(',')
+    )
@@ -0,0 +1,127 @@
+"""Профилирование отдельных запросов в работающем сайте.
+
+Два режима:
+
+* по запросу сотрудника — запрос с подписанным токеном в параметре
+  ``?profile=`` или заголовке ``X-Profile`` выполняется под cProfile,
+  результат пишется в PROFILER_ROOT файлом .prof (pstats; его читают
+  snakeviz, flameprof, gprof2dot), имя файла приходит в заголовке
+  ответа X-Profile. Токен подписан SECRET_KEY, привязан к пути и живет
+  PROFILER_TOKEN_MAX_AGE секунд; выдает его команда profile_link.
+  Без входа под сотрудником токен ничего не делает.
+* выборочно — доля PROFILER_SAMPLE_RATE всех запросов идет с
+  сэмплером: отдельный поток раз в PROFILER_SAMPLE_INTERVAL секунд
+  снимает стек потока запроса. Сам запрос при этом не замедляется, а
+  стеки пишутся файлом .folded, из которого flamegraph.pl и speedscope
+  строят flame graph.
+
+Учитывается только то, что делает представление; тело потокового
+ответа отдается уже после замера.
+"""
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.core import signing
+
+from yatube.settings import (PROFILER_ROOT, PROFILER_SAMPLE_INTERVAL,
+                             PROFILER_SAMPLE_RATE, PROFILER_TOKEN_MAX_AGE)
+
+
+SALT = 'core.profiling'
+PARAMETER = 'profile'
+HEADER = 'HTTP_X_PROFILE'
+
+
+def make_token(path):
+    """Токен, который включает профилирование запросов к path."""
+    return signing.dumps(path, salt=SALT)
+
+
+def triggered(request):
+    """Просит ли сотрудник профилировать этот запрос."""
+    token = request.GET.get(PARAMETER) or request.META.get(HEADER)
+    if not token:
+        return False
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        return False
+    try:
+        path = signing.loads(token, salt=SALT, max_age=PROFILER_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return path == request.path
+
+
+def sampled():
+    return PROFILER_SAMPLE_RATE > 0 and random.random() < PROFILER_SAMPLE_RATE
+
+
+def _frame_name(frame):
+    return f'{frame.f_globals.get("__name__", "?")}.{frame.f_code.co_name}'
+
+
+class Sampler:
+    """Снимает стеки потока thread_id, пока открыт блок with."""
+
+    def __init__(self, thread_id, interval=PROFILER_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+
+def output_name(request, extension):
+    """Имя файла результата: время и представление, а чтобы запросы
+    одной секунды не затирали друг друга — случайный хвост."""
+    match = getattr(request, 'resolver_match', None)
+    view = match.view_name.replace(':', '.') if match else 'unresolved'
+    moment = time.strftime('%Y%m%d-%H%M%S')
+    return f'{moment}-{view}-{uuid.uuid4().hex[:8]}.{extension}'
+
+
+def _output_path(name):
+    os.makedirs(PROFILER_ROOT, exist_ok=True)
+    return os.path.join(PROFILER_ROOT, name)
+
+
+def save_profile(profiler, request):
+    """Пишет статистику cProfile и отдает имя файла."""
+    name = output_name(request, 'prof')
+    profiler.dump_stats(_output_path(name))
+    return name
+
+
+def save_stacks(sampler, request):
+    """Пишет стеки сэмплера в формате flamegraph.pl и отдает имя файла.
+    Запрос, который закончился раньше первого замера, не пишется."""
+    if not sampler.stacks:
+        return None
+    name = output_name(request, 'folded')
+    with open(_output_path(name), 'w', encoding='utf-8') as file:
+        for stack, count in sorted(sampler.stacks.items()):
+            file.write(f'{stack} {count}\n')
+    return name
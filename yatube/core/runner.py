@@ -0,0 +1,53 @@
+import copy
+import logging
+import os
+import tempfile
+
+from django.conf import settings
+from django.db import connections
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """Тесты пишут общий кеш и файлы метрик во временный каталог, а не
+    туда, где их читает запущенный сайт.
+
+    Там же лежит тестовая база SQLite: файл, а не общая память, где
+    конкурентная запись сразу падает с блокировкой таблицы вместо того,
+    чтобы ждать busy timeout (нагрузочный тест пишет из нескольких
+    потоков).
+
+    Строки лога core.timing на каждый запрос в выводе тестов не нужны;
+    assertLogs их по-прежнему ловит.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._directory = tempfile.TemporaryDirectory(prefix='yatube-test-')
+        caches = copy.deepcopy(settings.CACHES)
+        caches['shared']['LOCATION'] = os.path.join(
+            self._directory.name, 'cache'
+        )
+        self._settings = override_settings(
+            CACHES=caches,
+            METRICS_ROOT=os.path.join(self._directory.name, 'metrics'),
+        )
+        self._settings.enable()
+        self._timing_logger = logging.getLogger('core.timing')
+        self._timing_level = self._timing_logger.level
+        self._timing_logger.setLevel(logging.WARNING)
+
+    def setup_databases(self, **kwargs):
+        for connection in connections.all():
+            if connection.vendor == 'sqlite':
+                connection.settings_dict['TEST']['NAME'] = os.path.join(
+                    self._directory.name, f'{connection.alias}.sqlite3'
+                )
+        return super().setup_databases(**kwargs)
+
+    def teardown_test_environment(self, **kwargs):
+        self._timing_logger.setLevel(self._timing_level)
+        self._settings.disable()
+        self._directory.cleanup()
+        super().teardown_test_environment(**kwargs)
@@ -1,4 +1,24 @@
-from django.test import TestCase
+import os
+import pstats
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, RequestFactory, TestCase
+from django.urls import reverse
+
+from posts.models import Post
+
+from . import middleware, metrics, profiling, timing
+
+
+User = get_user_model()
 
 
 class ViewTestClass(TestCase):
@@ -6,3 +26,263 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertTemplateUsed(response, 'core/404.html')
         self.assertEqual(response.status_code, 404)
+
+
+class RequestTimingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing_header(self):
+        """Запросы к базе, шаблоны и кеш попадают в Server-Timing."""
+        author = User.objects.create_user(username='author')
+        Post.objects.create(author=author, text='Пост')
+        with self.assertLogs('core.timing', 'INFO') as logs:
+            response = self.client.get(reverse('posts:index'))
+        header = response['Server-Timing']
+        for metric in ('db;dur=', 'tpl;dur=', 'cache;dur=', 'total;dur='):
+            self.assertIn(metric, header)
+        self.assertRegex(
+            header, r'cache;dur=[\d.]+;desc="\d+ hit, [1-9]\d* miss"'
+        )
+        record = logs.records[0].timing
+        self.assertEqual(
+            (record['view'], record['status']), ('posts:index', 200)
+        )
+        self.assertGreater(record['db_count'], 0)
+        self.assertEqual(record['tpl_count'], 1)
+        self.assertIn('view=posts:index ', logs.output[0])
+
+    def test_server_timing_only_for_staff_and_internal_ips(self):
+        """По умолчанию заголовок получают только сотрудники и адреса
+        INTERNAL_IPS."""
+        outside = {'REMOTE_ADDR': '203.0.113.5'}
+        url = reverse('about:author')
+        self.assertIn('Server-Timing', self.client.get(url))
+        self.assertNotIn('Server-Timing', self.client.get(url, **outside))
+        staff = User.objects.create_user(username='staff', is_staff=True)
+        self.client.force_login(staff)
+        self.assertIn('Server-Timing', self.client.get(url, **outside))
+        self.client.logout()
+        with mock.patch.object(middleware, 'SERVER_TIMING_HEADER', True):
+            self.assertIn('Server-Timing', self.client.get(url, **outside))
+        with mock.patch.object(middleware, 'SERVER_TIMING_HEADER', False):
+            self.assertNotIn('Server-Timing', self.client.get(url))
+
+    def test_nested_measurements_counted_once(self):
+        with timing.collect() as timings:
+            with timing.track('cache'):
+                with timing.track('cache'):
+                    pass
+            cache.set_many({'a': 1, 'b': 2})
+            self.assertEqual(
+                cache.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2}
+            )
+            self.assertIsNone(cache.get('c'))
+        self.assertEqual(timings.counts['cache'], 4)
+        self.assertEqual((timings.cache_hits, timings.cache_misses), (2, 2))
+        with timing.track('cache') as outside:
+            self.assertIsNone(outside)
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(
+            profiling, 'PROFILER_ROOT', directory.name
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.root = directory.name
+        self.staff = Client()
+        self.staff.force_login(
+            User.objects.create_user(username='admin', is_staff=True)
+        )
+
+    def test_staff_token_profiles_request(self):
+        """Подписанный токен сотрудника пишет профиль запроса."""
+        path = reverse('about:author')
+        out = StringIO()
+        call_command('profile_link', path, stdout=out)
+        link = out.getvalue().splitlines()[0]
+        response = self.staff.get(link)
+        name = response['X-Profile']
+        self.assertIn('about.author', name)
+        stats = pstats.Stats(os.path.join(self.root, name))
+        self.assertGreater(stats.total_calls, 0)
+        token = profiling.make_token(path)
+        self.assertNotIn(
+            'X-Profile', self.client.get(path, HTTP_X_PROFILE=token)
+        )
+        self.assertNotIn(
+            'X-Profile', self.staff.get(
+                reverse('about:tech'), {'profile': token}
+            )
+        )
+        self.assertNotIn(
+            'X-Profile', self.staff.get(path, {'profile': token + 'x'})
+        )
+        self.assertEqual(os.listdir(self.root), [name])
+
+    def test_sampler_collects_folded_stacks(self):
+        with profiling.Sampler(threading.get_ident(), 0.001) as sampler:
+            time.sleep(0.05)
+        stack, count = sampler.stacks.most_common(1)[0]
+        self.assertTrue(
+            stack.endswith('test_sampler_collects_folded_stacks'), stack
+        )
+        request = RequestFactory().get('/')
+        name = profiling.save_stacks(sampler, request)
+        with open(os.path.join(self.root, name), encoding='utf-8') as file:
+            self.assertIn(f'{stack} {count}\n', file.read())
+
+    def test_sample_rate(self):
+        with mock.patch.object(profiling, 'PROFILER_SAMPLE_RATE', 0):
+            self.assertFalse(profiling.sampled())
+        with mock.patch.object(profiling, 'PROFILER_SAMPLE_RATE', 1), \
+                mock.patch.object(profiling, 'Sampler') as sampler:
+            self.client.get(reverse('about:author'))
+        sampler.assert_called_once()
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        root = self.settings(METRICS_ROOT=directory.name)
+        root.enable()
+        self.addCleanup(root.disable)
+        patcher = mock.patch.object(metrics, '_store', metrics._Store())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape(self, **extra):
+        return self.client.get(reverse('metrics'), **extra)
+
+    def test_metrics_only_for_internal_ips(self):
+        self.assertEqual(self.scrape().status_code, 200)
+        self.assertEqual(
+            self.scrape(REMOTE_ADDR='203.0.113.5').status_code, 404
+        )
+        with mock.patch('core.network.INTERNAL_IPS', ['10.0.0.0/8']):
+            self.assertEqual(
+                self.scrape(REMOTE_ADDR='10.1.2.3').status_code, 200
+            )
+
+    def test_metrics_behind_proxy_check_forwarded_addresses(self):
+        """За прокси на той же машине внешний клиент виден только в
+        X-Forwarded-For."""
+        self.assertEqual(
+            self.scrape(HTTP_X_FORWARDED_FOR='203.0.113.5').status_code, 404
+        )
+        self.assertEqual(
+            self.scrape(
+                HTTP_X_FORWARDED_FOR='127.0.0.1, 203.0.113.5'
+            ).status_code,
+            404,
+        )
+        self.assertEqual(
+            self.scrape(HTTP_X_FORWARDED_FOR='::1, 127.0.0.1').status_code,
+            200,
+        )
+
+    def test_request_histograms(self):
+        """Запросы попадают в гистограмму своего представления."""
+        self.client.get(reverse('about:author'))
+        self.client.get(reverse('about:author'))
+        self.client.get('/nonexist-page/')
+        response = self.scrape()
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn(
+            'yatube_request_duration_seconds_count{view="about:author"} 2',
+            text,
+        )
+        self.assertIn(
+            'yatube_request_duration_seconds_bucket'
+            '{view="about:author",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn(
+            'yatube_request_duration_seconds_count{view="posts:index"} 0',
+            text,
+        )
+        self.assertRegex(
+            text,
+            r'yatube_request_duration_seconds_count\{view="other"\} [1-9]',
+        )
+        self.assertIn('# TYPE yatube_cache_hit_ratio gauge', text)
+
+    def test_values_summed_across_processes(self):
+        """Счетчики умершего процесса остаются, его очередь — нет."""
+        metrics.observe_request('posts:index', 0.02, 3, 1, 1)
+        metrics.set_gauge('thumbnail_queue_depth', 2)
+        pid = os.fork()
+        if pid == 0:
+            try:
+                metrics.observe_request('posts:index', 0.2, 5, 2, 0)
+                metrics.set_gauge('thumbnail_queue_depth', 7)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        text = metrics.render()
+        for line in (
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="0.025"} 1',
+            'yatube_request_duration_seconds_bucket'
+            '{view="posts:index",le="0.25"} 2',
+            'yatube_request_duration_seconds_count{view="posts:index"} 2',
+            'yatube_db_queries_total{view="posts:index"} 8',
+            'yatube_cache_requests_total{result="hit"} 3',
+            'yatube_cache_hit_ratio 0.75',
+            'yatube_thumbnail_queue_depth 2',
+        ):
+            self.assertIn(line + '\n', text)
+        self.assertEqual(metrics.render(), text)
+        self.assertEqual(self.metric_files(), [str(os.getpid()), 'archive'])
+
+    def metric_files(self):
+        return sorted(
+            name.rsplit('-', 1)[1][:-3]
+            for name in os.listdir(settings.METRICS_ROOT)
+            if name.endswith('.db')
+        )
+
+    def fork(self, *requests):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for request in requests:
+                    metrics.observe_request(*request)
+                metrics.set_gauge('thumbnail_queue_depth', 7)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        return pid
+
+    def test_mark_process_dead_archives_counters(self):
+        """Хук сервера сливает файл процесса в архив; сумма счетчиков
+        не меняется, а его очередь миниатюр пропадает."""
+        pid = self.fork(('posts:index', 0.2, 5, 2, 0))
+        metrics.mark_process_dead(pid)
+        self.assertEqual(self.metric_files(), ['archive'])
+        pid = self.fork(('posts:index', 0.2, 5, 2, 0))
+        metrics.mark_process_dead(pid)
+        text = metrics.render()
+        for line in (
+            'yatube_request_duration_seconds_count{view="posts:index"} 2',
+            'yatube_db_queries_total{view="posts:index"} 10',
+            'yatube_thumbnail_queue_depth 0',
+        ):
+            self.assertIn(line + '\n', text)
+
+    def test_reused_pid_keeps_stale_counters(self):
+        """Процесс, которому достался pid умершего, не затирает его
+        файл, а сливает в архив."""
+        metrics.observe_request('posts:index', 0.02, 3, 1, 1)
+        with mock.patch.object(metrics, '_store', metrics._Store()):
+            metrics.observe_request('posts:index', 0.02, 4, 0, 1)
+            text = metrics.render()
+        self.assertIn(
+            'yatube_db_queries_total{view="posts:index"} 7\n', text
+        )
@@ -0,0 +1,156 @@
+"""Учет того, на что уходит время запроса.
+
+RequestTimingMiddleware (core.middleware) заводит на время запроса
+RequestTimings, а замеры пишут в него через track():
+
+* запросы к базе — обертка connection.execute_wrapper;
+* шаблоны — backend TimedDjangoTemplates, считаются только внешние
+  рендеры: include и шаблоны из тегов входят во время своего родителя;
+* кеш — TimedCacheMixin у backend кеша, с попаданиями и промахами;
+* миниатюры — QueuedThumbnailBackend и prefetch_thumbnails.
+
+Вложенные замеры одного вида не складываются: get_many, который
+зовет get на каждый ключ, — это один замер. Время разных видов
+пересекается: запросы, которые выполняет шаблон, входят и во время
+шаблона. Вне запроса (команды, фоновые потоки) track() ничего не делает.
+"""
+import contextlib
+import threading
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.backends.django import DjangoTemplates, Template
+
+
+_local = threading.local()
+
+_MISSING = object()
+
+
+class RequestTimings:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = {}
+        self.counts = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._active = set()
+
+    def add(self, kind, seconds, count=1):
+        self.durations[kind] = self.durations.get(kind, 0) + seconds
+        self.counts[kind] = self.counts.get(kind, 0) + count
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def current():
+    """Замеры текущего запроса или None."""
+    return getattr(_local, 'timings', None)
+
+
+@contextlib.contextmanager
+def collect():
+    """Заводит замеры на время блока и отдает их."""
+    previous, _local.timings = current(), RequestTimings()
+    try:
+        yield _local.timings
+    finally:
+        _local.timings = previous
+
+
+@contextlib.contextmanager
+def track(kind):
+    """Засчитывает время блока в вид kind, если блок не вложен в такой
+    же замер. Отдает замеры запроса или None, если считать не нужно."""
+    timings = current()
+    if timings is None or kind in timings._active:
+        yield None
+        return
+    timings._active.add(kind)
+    started = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        timings._active.discard(kind)
+        timings.add(kind, time.perf_counter() - started)
+
+
+def count_queries(execute, sql, params, many, context):
+    """Обертка для connection.execute_wrapper."""
+    with track('db'):
+        return execute(sql, params, many, context)
+
+
+class _TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with track('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """Шаблоны Django с учетом времени рендера."""
+
+    def from_string(self, template_code):
+        template = super().from_string(template_code)
+        return _TimedTemplate(template.template, self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return _TimedTemplate(template.template, self)
+
+
+class TimedCacheMixin:
+    """Учет времени, попаданий и промахов для backend кеша."""
+
+    def get(self, key, default=None, version=None):
+        with track('cache') as timings:
+            value = super().get(key, _MISSING, version)
+            if timings is not None:
+                if value is _MISSING:
+                    timings.cache_misses += 1
+                else:
+                    timings.cache_hits += 1
+        return default if value is _MISSING else value
+
+    def get_many(self, keys, version=None):
+        keys = list(keys)
+        with track('cache') as timings:
+            values = super().get_many(keys, version)
+            if timings is not None:
+                timings.cache_hits += len(values)
+                timings.cache_misses += len(keys) - len(values)
+        return values
+
+    def add(self, *args, **kwargs):
+        with track('cache'):
+            return super().add(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        with track('cache'):
+            return super().set(*args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        with track('cache'):
+            return super().set_many(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        with track('cache'):
+            return super().delete(*args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        with track('cache'):
+            return super().delete_many(*args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        with track('cache'):
+            return super().incr(*args, **kwargs)
+
+
+class TimedLocMemCache(TimedCacheMixin, LocMemCache):
+    pass
+
+
+class TimedFileBasedCache(TimedCacheMixin, FileBasedCache):
+    pass
@@ -1,5 +1,9 @@
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from . import metrics as site_metrics
+from .network import internal_request
+
 
 def page_not_found(request, exception):
     return render(
@@ -12,3 +16,13 @@ def page_not_found(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def metrics(request):
+    """Метрики для Prometheus; чужим адресам страницы как будто нет."""
+    if not internal_request(request):
+        raise Http404
+    return HttpResponse(
+        site_metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import search
 from .models import Group, Post, Comment
 
 
@@ -10,6 +11,18 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # Текст ищем по полнотекстовому индексу вместо LIKE '%...%'.
+        if not search.is_supported() or not search_term.strip():
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        if search.match_expression(search_term) is None:
+            return queryset.none(), False
+        return queryset.filter(
+            id__in=search.matching_ids(search_term)
+        ), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = ('title', 'description')
@@ -0,0 +1,174 @@
+"""Замеры всех страниц сайта на синтетическом наборе данных.
+
+Каждый адрес из posts.urls, users.urls и about.urls открывается
+тестовым клиентом Django несколько раз — анонимом и пользователем с
+подписками. Для каждого записываются число запросов к базе и задержка
+(p50 и p95). Результат сравнивается с сохраненным эталоном: другой
+статус или больше запросов — регрессия. Задержка зависит от машины,
+поэтому с эталоном она сравнивается только по просьбе (check_latency),
+когда эталон снят на той же машине.
+"""
+import contextlib
+import copy
+import math
+import os
+import tempfile
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Count
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .models import AuthorStats, Group, Post
+
+
+URLCONFS = ('posts.urls', 'users.urls', 'about.urls')
+
+# Адреса, которые меняют данные или сессию даже на GET.
+SKIPPED = {
+    'posts:profile_follow',
+    'posts:profile_unfollow',
+    'users:logout',
+}
+
+VIEWERS = ('anonymous', 'user')
+
+# При check_latency задержка может вырасти на эту долю и еще на столько
+# миллисекунд, прежде чем считаться регрессией: замеры шумят.
+DEFAULT_TOLERANCE = 0.5
+LATENCY_SLACK_MS = 2
+
+
+def url_names():
+    """Имена адресов и параметры, которые им нужны."""
+    for urlconf in URLCONFS:
+        module = import_module(urlconf)
+        for pattern in module.urlpatterns:
+            yield (
+                f'{module.app_name}:{pattern.name}',
+                list(pattern.pattern.converters),
+            )
+
+
+def sample_arguments():
+    """Самые тяжелые объекты набора: пост с наибольшим числом
+    комментариев, самый плодовитый автор, самая большая группа."""
+    arguments = {}
+    post_id = Post.objects.order_by('-comments_count', 'pk').values_list(
+        'pk', flat=True
+    ).first()
+    if post_id is not None:
+        arguments['post_id'] = post_id
+    username = AuthorStats.objects.order_by('-posts_count', 'pk').values_list(
+        'user__username', flat=True
+    ).first()
+    if username is not None:
+        arguments['username'] = username
+    slug = Group.objects.annotate(total=Count('posts')).order_by(
+        '-total', 'pk'
+    ).values_list('slug', flat=True).first()
+    if slug is not None:
+        arguments['slug'] = slug
+    return arguments
+
+
+def sample_viewer():
+    """Пользователь с самой длинной лентой подписок."""
+    stats = AuthorStats.objects.order_by(
+        '-following_count', 'pk'
+    ).select_related('user').first()
+    return stats.user if stats else None
+
+
+def targets(arguments):
+    """Пары (имя адреса, путь) для всех адресов, которые можно открыть."""
+    for name, params in url_names():
+        if name in SKIPPED or not set(params).issubset(arguments):
+            continue
+        kwargs = {param: arguments[param] for param in params}
+        yield name, reverse(name, kwargs=kwargs)
+
+
+def percentile(values, fraction):
+    """Перцентиль по ближайшему рангу."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0
+    index = max(math.ceil(fraction * len(ordered)) - 1, 0)
+    return ordered[index]
+
+
+@contextlib.contextmanager
+def separate_storage():
+    """Общий кеш и файлы метрик замеров — во временном каталоге.
+
+    Без warm кеши очищаются перед каждым запросом, а общий кеш (и версии
+    в нем) делит с замерами запущенный сайт.
+    """
+    with tempfile.TemporaryDirectory(prefix='yatube-benchmark-') as root:
+        cache_settings = copy.deepcopy(settings.CACHES)
+        cache_settings['shared']['LOCATION'] = os.path.join(root, 'cache')
+        with override_settings(
+            CACHES=cache_settings,
+            METRICS_ROOT=os.path.join(root, 'metrics'),
+        ):
+            yield
+
+
+def measure(client, path, repeat, warm=False):
+    """Открывает путь repeat раз; без warm — каждый раз с пустым кешем."""
+    timings = []
+    queries = 0
+    status = None
+    for _ in range(repeat):
+        if not warm:
+            for alias in settings.CACHES:
+                caches[alias].clear()
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = client.get(path)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = max(queries, len(context.captured_queries))
+        status = response.status_code
+    return {
+        'status': status,
+        'queries': queries,
+        'p50': round(percentile(timings, 0.5), 2),
+        'p95': round(percentile(timings, 0.95), 2),
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE,
+            check_latency=False):
+    """Регрессии относительно эталона, по строке на каждую."""
+    problems = []
+    for key, result in sorted(results.items()):
+        expected = baseline.get(key)
+        if expected is None:
+            continue
+        if result['status'] != expected['status']:
+            problems.append(
+                f'{key}: статус {result["status"]}, '
+                f'в эталоне {expected["status"]}'
+            )
+        if result['queries'] > expected['queries']:
+            problems.append(
+                f'{key}: запросов {result["queries"]}, '
+                f'в эталоне {expected["queries"]}'
+            )
+        if not check_latency:
+            continue
+        limit = expected['p95'] * (1 + tolerance) + LATENCY_SLACK_MS
+        if result['p95'] > limit:
+            problems.append(
+                f'{key}: p95 {result["p95"]} мс, '
+                f'в эталоне {expected["p95"]} мс'
+            )
+    return problems
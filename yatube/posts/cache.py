@@ -0,0 +1,129 @@
+"""Версии (поколения) кешируемых данных ленты.
+
+Ключ кеша включает текущую версию своей области: лента главной, группы,
+автора, подписок пользователя. Сигналы моделей «сдвигают» версию —
+удаляют ее из кеша, и все ключи со старой версией перестают читаться
+без явной очистки.
+
+Сами версии лежат в общем для всех процессов кеше VERSION_CACHE: сдвиг
+в одном процессе сайта или в команде виден всем остальным, а их кеши
+процесса со старыми ключами просто перестают читаться.
+
+Версия начинается с времени своего создания в миллисекундах: новая
+версия появляется при первом чтении после записи, и это время служит
+оценкой Last-Modified для условных запросов.
+"""
+import datetime as dt
+import hashlib
+import time
+import uuid
+
+from django.core.cache import caches
+
+
+VERSION_PREFIX = 'version'
+VERSION_CACHE = 'shared'
+
+
+def index_scope():
+    return 'feed:index'
+
+
+def group_scope(group_id):
+    return f'feed:group:{group_id}'
+
+
+def author_scope(author_id):
+    return f'feed:author:{author_id}'
+
+
+def follow_scope(user_id):
+    return f'feed:follow:{user_id}'
+
+
+def followers_scope(author_id):
+    """Посты автора в лентах подписок всех его подписчиков.
+
+    Лента подписок зависит от этой версии каждого автора, на которого
+    подписан пользователь, поэтому правка поста или имени автора
+    сдвигает одну версию, а не по версии на подписчика.
+    """
+    return f'feed:followers:{author_id}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def user_scope(user_id):
+    """Данные пользователя (имя), которые видны в карточках постов."""
+    return f'user:{user_id}'
+
+
+def stats_scope(user_id):
+    """Счетчики подписчиков и подписок пользователя на его странице."""
+    return f'stats:{user_id}'
+
+
+def groups_scope():
+    """Названия групп выводятся в карточках всех лент."""
+    return 'groups'
+
+
+def _version_key(scope):
+    return f'{VERSION_PREFIX}:{scope}'
+
+
+def new_version():
+    return '{:x}.{}'.format(int(time.time() * 1000), uuid.uuid4().hex[:6])
+
+
+def version_time(version):
+    """Время создания версии (aware datetime) или None."""
+    stamp, dot, _ = str(version).partition('.')
+    if not dot:
+        return None
+    try:
+        millis = int(stamp, 16)
+    except ValueError:
+        return None
+    return dt.datetime.fromtimestamp(millis / 1000, tz=dt.timezone.utc)
+
+
+def get_versions(*scopes):
+    """Текущие версии областей в том же порядке, одним походом в кеш."""
+    cache = caches[VERSION_CACHE]
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = new_version()
+            if not cache.add(key, version, None):
+                # Версию могли сдвинуть между add и get: тогда чтение
+                # совпало со сдвигом и годится своя новая версия.
+                version = cache.get(key) or version
+            versions[key] = version
+    return [versions[key] for key in keys]
+
+
+def get_version(scope):
+    return get_versions(scope)[0]
+
+
+def bump_versions(*scopes):
+    caches[VERSION_CACHE].delete_many(
+        [_version_key(scope) for scope in scopes if scope]
+    )
+
+
+def feed_version(scope, *scopes):
+    """Метка для ключа фрагмента ленты: область и ее текущая версия.
+
+    Включает и версию групп, которые видны в карточках постов. Если
+    лента зависит еще от областей ``scopes``, вместо версий в метку
+    идет их хеш.
+    """
+    versions = get_versions(scope, *scopes, groups_scope())
+    if scopes:
+        versions = [hashlib.md5(':'.join(versions).encode()).hexdigest()]
+    return ':'.join([scope, *versions])
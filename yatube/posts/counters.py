@@ -0,0 +1,175 @@
+from functools import reduce
+from itertools import chain
+from operator import or_
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .cache import author_scope, bump_versions, post_scope, stats_scope
+from .models import AuthorStats, Comment, Follow, ImageBlob, Post, User
+
+
+def compute_stats(user_id):
+    return {
+        'posts_count': Post.objects.filter(author_id=user_id).count(),
+        'followers_count': Follow.objects.filter(author_id=user_id).count(),
+        'following_count': Follow.objects.filter(user_id=user_id).count(),
+    }
+
+
+def stats_for(user):
+    """Счетчики пользователя; строка создается при первом обращении."""
+    try:
+        return user.stats
+    except AuthorStats.DoesNotExist:
+        stats, _ = AuthorStats.objects.get_or_create(
+            user_id=user.pk, defaults=compute_stats(user.pk)
+        )
+        return stats
+
+
+def increment_stats(user_id, *fields):
+    with transaction.atomic():
+        updated = AuthorStats.objects.filter(user_id=user_id).update(
+            **{field: F(field) + 1 for field in fields}
+        )
+        if not updated:
+            # Строки еще нет: считаем честно, запись уже в базе.
+            AuthorStats.objects.get_or_create(
+                user_id=user_id, defaults=compute_stats(user_id)
+            )
+
+
+def decrement_stats(user_id, *fields):
+    # Строку не создаем: при удалении пользователя каскадом
+    # его счетчики могут быть уже удалены.
+    AuthorStats.objects.filter(user_id=user_id).update(
+        **{field: Greatest(F(field) - 1, 0) for field in fields}
+    )
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=Greatest(F('comments_count') + delta, 0)
+    )
+
+
+def _add_image_references(name, count, reserved):
+    with transaction.atomic():
+        updated = ImageBlob.objects.filter(name=name).update(
+            ref_count=F('ref_count') + count
+        )
+        if updated:
+            return
+        # Строки еще нет: считаем честно, посты уже в базе.
+        _, created = ImageBlob.objects.get_or_create(
+            name=name,
+            defaults={
+                'ref_count': (
+                    Post.objects.filter(image=name).count() + reserved
+                )
+            },
+        )
+        if not created:
+            # Строку только что создал другой процесс.
+            ImageBlob.objects.filter(name=name).update(
+                ref_count=F('ref_count') + count
+            )
+
+
+def acquire_image(name, count=1):
+    """Добавляет файлу картинки ``count`` ссылок."""
+    _add_image_references(name, count, 0)
+
+
+def reserve_image(name):
+    """Ссылка на файл, который записан в хранилище, но еще не попал
+    ни в один пост. Ее забирает пост (см. signals) или снимает
+    release_image."""
+    _add_image_references(name, 1, 1)
+
+
+def release_image(name, count=1):
+    """Убирает у файла картинки ``count`` ссылок.
+
+    Возвращает True, если ссылок не осталось и файл можно удалить.
+    """
+    with transaction.atomic():
+        ImageBlob.objects.filter(name=name).update(
+            ref_count=Greatest(F('ref_count') - count, 0)
+        )
+        deleted, _ = ImageBlob.objects.filter(
+            name=name, ref_count=0
+        ).delete()
+    return bool(deleted)
+
+
+def _count_of(queryset, field, outer):
+    """COUNT(*) строк queryset, у которых field равно полю outer
+    внешней строки, — подзапросом для UPDATE."""
+    rows = queryset.filter(**{field: OuterRef(outer)}).order_by().values(
+        field
+    ).annotate(total=Count('pk')).values('total')
+    return Coalesce(Subquery(rows), 0)
+
+
+def _recount(queryset, counts, bump):
+    """Чинит строки queryset, у которых counts (поле -> подзапрос)
+    разошлись с базой, одним UPDATE с подзапросами. Разом сдвигает
+    версии кеша исправленных строк и возвращает их число.
+
+    Числа считаются в самом UPDATE, а не переносятся из Python:
+    параллельные F()-приращения между чтением и записью не теряются.
+    """
+    drifted = queryset.annotate(
+        **{f'actual_{field}': count for field, count in counts.items()}
+    ).filter(reduce(or_, (
+        ~Q(**{field: F(f'actual_{field}')}) for field in counts
+    )))
+    pks = list(drifted.values_list('pk', flat=True))
+    if pks:
+        queryset.filter(pk__in=pks).update(**counts)
+        bump_versions(*chain.from_iterable(map(bump, pks)))
+    return len(pks)
+
+
+def recount_stats_chunk(start, stop):
+    """Пересчитывает счетчики пользователей с id из [start, stop).
+
+    Возвращает число исправленных строк.
+    """
+    user_ids = User.objects.filter(
+        pk__gte=start, pk__lt=stop
+    ).values_list('pk', flat=True)
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    return _recount(
+        AuthorStats.objects.filter(user_id__gte=start, user_id__lt=stop),
+        {
+            'posts_count': _count_of(Post.objects, 'author_id', 'user_id'),
+            'followers_count': _count_of(
+                Follow.objects, 'author_id', 'user_id'
+            ),
+            'following_count': _count_of(
+                Follow.objects, 'user_id', 'user_id'
+            ),
+        },
+        lambda user_id: (stats_scope(user_id), author_scope(user_id)),
+    )
+
+
+def recount_comments_chunk(start, stop):
+    """Пересчитывает comments_count постов с id из [start, stop):
+    число их активных комментариев."""
+    return _recount(
+        Post.objects.filter(pk__gte=start, pk__lt=stop),
+        {
+            'comments_count': _count_of(
+                Comment.objects.filter(active=True), 'post_id', 'pk'
+            ),
+        },
+        lambda post_id: (post_scope(post_id),),
+    )
@@ -0,0 +1,125 @@
+"""Синтетический набор данных для проверки производительности.
+
+Записи генерируются Faker с фиксированным зерном, поэтому один и тот же
+набор параметров всегда дает одни и те же данные, и загружаются через
+posts.bulk_import. Авторы выбираются неравномерно, как в жизни:
+у немногих популярных авторов большая часть постов и подписчиков.
+"""
+import datetime as dt
+import random
+
+from django.db.models import Max
+from faker import Faker
+
+from .bulk_import import Importer
+from .models import Post
+
+
+DEFAULT_SIZES = {
+    'users': 200,
+    'groups': 10,
+    'posts': 5000,
+    'comments': 20000,
+    'follows': 2000,
+}
+
+# Даты постов отсчитываются от фиксированного момента, а не от now():
+# иначе набор менялся бы от запуска к запуску.
+START = dt.datetime(2022, 1, 1, tzinfo=dt.timezone.utc)
+PERIOD = dt.timedelta(days=365)
+
+FAKER_LOCALE = 'ru_RU'
+
+# Параметр распределения Парето для популярности авторов.
+POPULARITY_SHAPE = 1.2
+
+
+class _Dataset:
+    def __init__(self, sizes, seed):
+        self.sizes = {**DEFAULT_SIZES, **sizes}
+        self.random = random.Random(seed)
+        self.faker = Faker(FAKER_LOCALE)
+        self.faker.seed_instance(seed)
+        self.usernames = [
+            f'{self.faker.user_name()}{number}'
+            for number in range(max(self.sizes['users'], 2))
+        ]
+        self.slugs = [
+            f'group-{number}' for number in range(self.sizes['groups'])
+        ]
+
+    def skewed(self, items):
+        """Элемент из начала списка с большей вероятностью, чем из конца."""
+        index = int(self.random.paretovariate(POPULARITY_SHAPE)) - 1
+        return items[index % len(items)]
+
+    def popular(self):
+        return self.skewed(self.usernames)
+
+    def moment(self):
+        return (START + self.random.random() * PERIOD).isoformat()
+
+    def records(self, first_post_id):
+        faker = self.faker
+        for username in self.usernames:
+            yield {
+                'model': 'user',
+                'username': username,
+                'first_name': faker.first_name(),
+                'last_name': faker.last_name(),
+                'email': f'{username}@example.com',
+            }
+        for slug in self.slugs:
+            yield {
+                'model': 'group',
+                'slug': slug,
+                'title': faker.sentence(nb_words=2).rstrip('.'),
+                'description': faker.paragraph(),
+            }
+        post_ids = range(first_post_id, first_post_id + self.sizes['posts'])
+        for post_id in post_ids:
+            yield {
+                'model': 'post',
+                'id': post_id,
+                'text': faker.text(max_nb_chars=400),
+                'author': self.popular(),
+                'group': (
+                    self.random.choice(self.slugs)
+                    if self.slugs and self.random.random() < 0.7 else None
+                ),
+                'pub_date': self.moment(),
+            }
+        for _ in range(self.sizes['comments'] if post_ids else 0):
+            yield {
+                'model': 'comment',
+                # Обсуждают тоже в основном немногие посты.
+                'post': self.skewed(post_ids),
+                'author': self.random.choice(self.usernames),
+                'text': faker.sentence(),
+                'created': self.moment(),
+            }
+        follows = set()
+        attempts = self.sizes['follows'] * 3
+        while len(follows) < self.sizes['follows'] and attempts:
+            attempts -= 1
+            user, author = self.random.choice(self.usernames), self.popular()
+            if user != author:
+                follows.add((user, author))
+        for user, author in sorted(follows):
+            yield {'model': 'follow', 'user': user, 'author': author}
+
+
+def dataset_records(seed=0, first_post_id=1, **sizes):
+    """Записи набора в формате posts.bulk_import."""
+    return _Dataset(sizes, seed).records(first_post_id)
+
+
+def generate_dataset(seed=0, progress=None, **sizes):
+    """Загружает набор в базу. Id постов идут после уже существующих."""
+    first_post_id = (Post.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+    importer = Importer(progress=progress)
+    try:
+        importer.load(dataset_records(seed, first_post_id, **sizes))
+    finally:
+        importer.finish()
+    return importer
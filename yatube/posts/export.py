@@ -0,0 +1,157 @@
+"""Выгрузка пользователей, групп, постов, комментариев и подписок.
+
+Записи в том же формате, что читает posts.bulk_import: NDJSON с полем
+``model`` или CSV по одной модели. Таблица читается по ключу: порциями
+по EXPORT_BATCH_SIZE строк с id больше последнего выданного, а каждая
+порция — через iterator(chunk_size=EXPORT_CHUNK_SIZE). Ни выборка, ни
+ответ не собираются в памяти целиком, поэтому память не зависит от
+размера данных. Сжатие gzip — тоже потоковое.
+"""
+import csv
+import datetime as dt
+import json
+import zlib
+
+from yatube.settings import EXPORT_BATCH_SIZE, EXPORT_CHUNK_SIZE
+
+from .models import Comment, Follow, Group, Post, User
+
+
+# Поле записи и выражение ORM, из которого оно берется.
+EXPORTS = {
+    'user': (User, (
+        ('username', 'username'),
+        ('first_name', 'first_name'),
+        ('last_name', 'last_name'),
+        ('email', 'email'),
+    )),
+    'group': (Group, (
+        ('slug', 'slug'),
+        ('title', 'title'),
+        ('description', 'description'),
+    )),
+    'post': (Post, (
+        ('id', 'id'),
+        ('text', 'text'),
+        ('author', 'author__username'),
+        ('group', 'group__slug'),
+        ('pub_date', 'pub_date'),
+        ('image', 'image'),
+        ('image_placeholder', 'image_placeholder'),
+    )),
+    'comment': (Comment, (
+        ('id', 'id'),
+        ('post', 'post_id'),
+        ('author', 'author__username'),
+        ('text', 'text'),
+        ('created', 'created'),
+        ('active', 'active'),
+    )),
+    'follow': (Follow, (
+        ('user', 'user__username'),
+        ('author', 'author__username'),
+    )),
+}
+
+# Порядок, в котором их сможет загрузить import_data.
+EXPORT_MODELS = tuple(EXPORTS)
+
+# Сколько байтов отдавать клиенту за раз.
+BUFFER_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _value(value):
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+    return value
+
+
+def rows(model, batch_size=EXPORT_BATCH_SIZE):
+    """Строки модели как списки значений полей, по возрастанию id."""
+    model_class, fields = EXPORTS[model]
+    lookups = ['pk'] + [lookup for _, lookup in fields]
+    last_id = None
+    while True:
+        queryset = model_class.objects.order_by('pk')
+        if last_id is not None:
+            queryset = queryset.filter(pk__gt=last_id)
+        count = 0
+        for row in queryset.values_list(*lookups)[:batch_size].iterator(
+            chunk_size=EXPORT_CHUNK_SIZE
+        ):
+            count += 1
+            last_id = row[0]
+            yield [_value(value) for value in row[1:]]
+        if count < batch_size:
+            return
+
+
+def field_names(model):
+    return [name for name, _ in EXPORTS[model][1]]
+
+
+def ndjson_lines(models=EXPORT_MODELS, batch_size=EXPORT_BATCH_SIZE):
+    for model in models:
+        names = field_names(model)
+        for row in rows(model, batch_size):
+            record = {'model': model, **dict(zip(names, row))}
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    """Файл для csv.writer, который просто возвращает строку."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(model, batch_size=EXPORT_BATCH_SIZE):
+    writer = csv.writer(_Line())
+    yield writer.writerow(field_names(model))
+    for row in rows(model, batch_size):
+        yield writer.writerow(row)
+
+
+def lines(data_format, models=EXPORT_MODELS, batch_size=EXPORT_BATCH_SIZE):
+    """Строки выгрузки. CSV бывает только по одной модели."""
+    if data_format == 'csv':
+        model, = models
+        return csv_lines(model, batch_size)
+    return ndjson_lines(models, batch_size)
+
+
+def encoded(lines, size=BUFFER_SIZE):
+    """Байты строк кусками около size, а не по строке за раз."""
+    buffer = []
+    buffered = 0
+    for line in lines:
+        data = line.encode()
+        buffer.append(data)
+        buffered += len(data)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def gzipped(chunks, level=6):
+    """Сжимает поток байтов в формат gzip по мере чтения."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def file_name(data_format, models, compress=False):
+    stem = models[0] + 's' if len(models) == 1 else 'yatube'
+    extension = '.gz' if compress else ''
+    return f'{stem}.{data_format}{extension}'
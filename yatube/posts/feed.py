@@ -0,0 +1,203 @@
+import threading
+from itertools import islice
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+
+from yatube.settings import FEED_FANOUT_BATCH_SIZE, FEED_FANOUT_SYNC_LIMIT
+
+from .cache import bump_versions, follow_scope, followers_scope, get_version
+from .models import FeedEntry, Follow, PendingFanOut, Post
+
+
+FEED_ORDERING = ('-feed_pub_date', '-feed_post_id')
+
+
+def _entries(post, follower_ids):
+    return (
+        FeedEntry(
+            user_id=user_id,
+            post_id=post.pk,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in follower_ids
+    )
+
+
+def _insert(entries):
+    FeedEntry.objects.bulk_create(
+        entries, batch_size=FEED_FANOUT_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
+def fan_out_post(post):
+    """Раскладывает новый пост по лентам подписчиков автора.
+
+    Обычным авторам записи вставляются сразу, пачками. Если подписчиков
+    больше FEED_FANOUT_SYNC_LIMIT, рассылка записывается в PendingFanOut
+    и после коммита выполняется в фоновом потоке; если процесс умрет
+    раньше, ее дорассылает команда fan_out_pending.
+    """
+    follower_ids = list(
+        Follow.objects.filter(author_id=post.author_id).order_by(
+            'user_id'
+        ).values_list('user_id', flat=True)[:FEED_FANOUT_SYNC_LIMIT + 1]
+    )
+    if len(follower_ids) <= FEED_FANOUT_SYNC_LIMIT:
+        _insert(_entries(post, follower_ids))
+        bump_versions(followers_scope(post.author_id))
+        return
+    PendingFanOut.objects.create(post=post)
+    post_id = post.pk
+    transaction.on_commit(
+        lambda: threading.Thread(
+            target=_fan_out_in_background, args=(post_id,), daemon=True
+        ).start()
+    )
+
+
+def _fan_out_in_background(post_id):
+    try:
+        fan_out_post_in_batches(post_id)
+    finally:
+        connection.close()
+
+
+def fan_out_post_in_batches(post_id):
+    """Рассылка поста по всем подписчикам, порциями по ключу user_id.
+
+    Продолжает с места, сохраненного в PendingFanOut, и сдвигает его
+    после каждой порции; повторная рассылка тех же записей безвредна.
+    """
+    pending = PendingFanOut.objects.filter(post_id=post_id).select_related(
+        'post'
+    ).only('last_user_id', 'post__author_id', 'post__pub_date').first()
+    if pending is None:
+        return
+    post = pending.post
+    last_user_id = pending.last_user_id
+    while True:
+        follower_ids = list(
+            Follow.objects.filter(
+                author_id=post.author_id, user_id__gt=last_user_id
+            ).order_by('user_id').values_list(
+                'user_id', flat=True
+            )[:FEED_FANOUT_BATCH_SIZE]
+        )
+        if not follower_ids:
+            PendingFanOut.objects.filter(post_id=post_id).delete()
+            return
+        last_user_id = follower_ids[-1]
+        with transaction.atomic():
+            _insert(_entries(post, follower_ids))
+            PendingFanOut.objects.filter(post_id=post_id).update(
+                last_user_id=last_user_id
+            )
+        bump_versions(followers_scope(post.author_id))
+
+
+def fan_out_pending():
+    """Дорассылает все незаконченные рассылки. Возвращает их число."""
+    post_ids = list(
+        PendingFanOut.objects.order_by('created').values_list(
+            'post_id', flat=True
+        )
+    )
+    for post_id in post_ids:
+        fan_out_post_in_batches(post_id)
+    return len(post_ids)
+
+
+def following_ids(user_id):
+    """id авторов, на которых подписан пользователь. Кешируется под
+    версией его ленты: подписка и отписка ее сдвигают."""
+    key = f'feed:following:{user_id}:{get_version(follow_scope(user_id))}'
+    author_ids = cache.get(key)
+    if author_ids is None:
+        author_ids = list(
+            Follow.objects.filter(user_id=user_id).order_by(
+                'author_id'
+            ).values_list('author_id', flat=True)
+        )
+        cache.set(key, author_ids, None)
+    return author_ids
+
+
+def feed_scopes(user_id):
+    """Области, от которых зависит лента подписок пользователя: его
+    подписки и посты каждого автора, на которого он подписан."""
+    return [follow_scope(user_id)] + [
+        followers_scope(author_id) for author_id in following_ids(user_id)
+    ]
+
+
+def _author_posts(author_id):
+    """Все посты автора, порциями по ключу id: (id, pub_date)."""
+    last_id = 0
+    while True:
+        posts = list(
+            Post.objects.filter(
+                author_id=author_id, pk__gt=last_id
+            ).order_by('pk').values_list(
+                'id', 'pub_date'
+            )[:FEED_FANOUT_BATCH_SIZE]
+        )
+        if not posts:
+            return
+        yield posts
+        last_id = posts[-1][0]
+
+
+def backfill_follow(user_id, author_id):
+    """Добавляет в ленту подписчика все посты автора, порциями."""
+    for posts in _author_posts(author_id):
+        _insert(
+            FeedEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for post_id, pub_date in posts
+        )
+
+
+def backfill_followers(author_id):
+    """Раскладывает все посты автора по лентам всех его подписчиков.
+    Нужна после массовой загрузки, которая идет мимо сигналов."""
+    for posts in _author_posts(author_id):
+        follower_ids = Follow.objects.filter(
+            author_id=author_id
+        ).values_list('user_id', flat=True).iterator(
+            chunk_size=FEED_FANOUT_BATCH_SIZE
+        )
+        entries = (
+            FeedEntry(
+                user_id=user_id,
+                post_id=post_id,
+                author_id=author_id,
+                pub_date=pub_date,
+            )
+            for user_id in follower_ids
+            for post_id, pub_date in posts
+        )
+        while True:
+            batch = list(islice(entries, FEED_FANOUT_BATCH_SIZE))
+            if not batch:
+                break
+            _insert(batch)
+
+
+def prune_follow(user_id, author_id):
+    """Убирает посты автора из ленты отписавшегося пользователя."""
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def feed_for(user):
+    """Посты ленты подписок в порядке индекса (user, pub_date, post)."""
+    return Post.objects.filter(feed_entries__user=user).annotate(
+        feed_pub_date=F('feed_entries__pub_date'),
+        feed_post_id=F('feed_entries__post_id'),
+    )
@@ -1,12 +1,57 @@
+from django import forms
 from django.forms import ModelForm
+from django.template.defaultfilters import filesizeformat
+from PIL import Image
+
+from yatube.settings import POST_IMAGE_MAX_PIXELS, POST_IMAGE_MAX_UPLOAD_SIZE
 
 from .models import Post, Comment
 
 
+class BoundedImageField(forms.ImageField):
+    """Картинка, которая проверяется по размеру файла и по числу
+    пикселей из заголовка до того, как Pillow ее разберет целиком."""
+
+    default_error_messages = {
+        'too_large': 'Файл больше %(limit)s.',
+        'too_many_pixels': (
+            'Картинка слишком большая: не больше %(limit)s мегапикселей.'
+        ),
+    }
+
+    def to_python(self, data):
+        if data in self.empty_values:
+            return super().to_python(data)
+        if data.size > POST_IMAGE_MAX_UPLOAD_SIZE:
+            raise forms.ValidationError(
+                self.error_messages['too_large'],
+                code='too_large',
+                params={'limit': filesizeformat(POST_IMAGE_MAX_UPLOAD_SIZE)},
+            )
+        try:
+            # Image.open читает только заголовок.
+            with Image.open(data) as image:
+                width, height = image.size
+        except Image.DecompressionBombError:
+            width = height = POST_IMAGE_MAX_PIXELS
+        except Exception:
+            # Битый файл отклонит ImageField.
+            width = height = 0
+        if width * height > POST_IMAGE_MAX_PIXELS:
+            raise forms.ValidationError(
+                self.error_messages['too_many_pixels'],
+                code='too_many_pixels',
+                params={'limit': POST_IMAGE_MAX_PIXELS // 10 ** 6},
+            )
+        data.seek(0)
+        return super().to_python(data)
+
+
 class PostForm(ModelForm):
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
+        field_classes = {'image': BoundedImageField}
 
 
 class CommentForm(ModelForm):
@@ -0,0 +1,130 @@
+"""Хранилище ключей sorl-thumbnail с LRU-кешем процесса.
+
+Каждый тег ``{% thumbnail %}`` ищет миниатюру в хранилище ключей. Штатное
+хранилище (cached_db) ходит за каждой в кеш, а при промахе в базу. Здесь
+перед ним стоит ограниченный LRU-кеш процесса, а ключи всех миниатюр
+страницы можно получить заранее одним get_many (см. prefetch).
+
+Удаление ключей (например, когда у поста меняется картинка) увеличивает
+общее поколение в кеше. Остальные процессы замечают новое поколение
+при следующем prefetch или не позже чем через
+THUMBNAIL_LRU_CHECK_INTERVAL секунд и очищают свой LRU. Для этого кеш
+хранилища (THUMBNAIL_CACHE) должен быть общим для всех процессов, как
+shared в настройках: в кеше процесса ни поколение, ни удаление ключей
+до остальных не дойдут.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE, KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from yatube.settings import THUMBNAIL_LRU_CHECK_INTERVAL, THUMBNAIL_LRU_SIZE
+
+
+GENERATION_KEY = 'thumbnail:kvstore:generation'
+
+# В LRU попадают только записи о картинках; списки миниатюр
+# источника меняются при каждой новой миниатюре.
+IMAGE_IDENTITY = '||image||'
+
+
+class LRUKVStore(KVStore):
+    def __init__(self):
+        super().__init__()
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = ''
+        self._checked_at = 0
+
+    def _remember(self, key, value):
+        if IMAGE_IDENTITY not in key:
+            return
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > THUMBNAIL_LRU_SIZE:
+                self._lru.popitem(last=False)
+
+    def _recall(self, key):
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+            return value
+
+    def _sync_generation(self, generation=None):
+        """Очищает LRU, если другой процесс сменил поколение."""
+        now = time.monotonic()
+        if generation is None:
+            if now - self._checked_at < THUMBNAIL_LRU_CHECK_INTERVAL:
+                return
+            generation = self.cache.get(GENERATION_KEY, '')
+        self._checked_at = now
+        if generation != self._generation:
+            with self._lock:
+                self._lru.clear()
+                self._generation = generation
+
+    def invalidate(self):
+        """Сбрасывает LRU всех процессов."""
+        generation = uuid.uuid4().hex
+        self.cache.set(GENERATION_KEY, generation, None)
+        self._sync_generation(generation)
+
+    def prefetch(self, keys):
+        """Загружает записи миниатюр в LRU за один get_many и один запрос
+        к базе для тех, что не нашлись в кеше.
+
+        Поколение сверяется до LRU, даже если в нем уже есть все ключи.
+        """
+        keys = [add_prefix(key) for key in keys]
+        self._sync_generation(self.cache.get(GENERATION_KEY, ''))
+        missing = [key for key in keys if self._recall(key) is None]
+        if not missing:
+            return
+        found = self.cache.get_many(missing)
+        left = []
+        for key in missing:
+            value = found.get(key)
+            if value is None:
+                left.append(key)
+            elif value != EMPTY_VALUE:
+                self._remember(key, value)
+        if not left:
+            return
+        rows = dict(
+            KVStoreModel.objects.filter(key__in=left).values_list(
+                'key', 'value'
+            )
+        )
+        for key, value in rows.items():
+            self._remember(key, value)
+        # Как и cached_db, запоминаем в кеше и промахи.
+        rows.update((key, EMPTY_VALUE) for key in left if key not in rows)
+        self.cache.set_many(rows, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT)
+
+    def _get_raw(self, key):
+        self._sync_generation()
+        value = self._recall(key)
+        if value is not None:
+            return value
+        value = super()._get_raw(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self._remember(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+        self.invalidate()
@@ -0,0 +1,306 @@
+"""Нагрузочный прогон приложения в том же процессе.
+
+yatube.wsgi.application поднимается на свободном порту локального
+адреса: в потоках (ThreadedWSGIServer, как у runserver) или в
+нескольких процессах, которые делят один слушающий сокет, как
+синхронные воркеры gunicorn. Виртуальные пользователи — потоки со
+своим HTTP-соединением — до конца прогона шлют смешанный трафик:
+анонимы читают ленты, посты и комментарии, вошедшие пользователи еще
+смотрят ленту подписок, пишут посты и комментарии.
+
+По каждому имени адреса считаются запросы в секунду, перцентили
+задержки и доля ошибок (статус 4xx/5xx или обрыв соединения).
+
+Запросы пишут в базу настоящие посты и комментарии; данные берутся из
+базы как есть — наполнить ее можно командой generate_dataset.
+"""
+import contextlib
+import http.client
+import os
+import random
+import signal
+import threading
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.servers.basehttp import (ThreadedWSGIServer,
+                                          WSGIRequestHandler, WSGIServer)
+from django.db import connections
+from django.http import HttpRequest
+from django.middleware.csrf import get_token
+from django.test import Client
+from django.urls import reverse
+
+from core import metrics
+
+from .benchmark import percentile
+from .models import AuthorStats, Group, Post, User
+
+
+SERVERS = ('threads', 'processes')
+
+# Доли адресов в трафике анонимов и вошедших пользователей.
+ANONYMOUS_MIX = (
+    ('posts:index', 30),
+    ('posts:post_detail', 25),
+    ('posts:profile', 15),
+    ('posts:group_posts', 15),
+    ('posts:post_comments', 10),
+    ('posts:search', 5),
+)
+USER_MIX = (
+    ('posts:follow_index', 35),
+    ('posts:index', 20),
+    ('posts:post_detail', 25),
+    ('posts:add_comment', 12),
+    ('posts:post_create', 8),
+)
+
+# Из скольких постов, авторов и групп выбираются адреса.
+SAMPLE_SIZE = 1000
+# Сколько первых страниц лент открывается.
+PAGES = 3
+SEARCH_WORDS = ('пост', 'новости', 'привет', 'город', 'время')
+REQUEST_TIMEOUT = 30
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class _ClosingHandler(_QuietHandler):
+    # Процесс обслуживает одно соединение за раз: держать его открытым
+    # между запросами значит не пускать остальных клиентов.
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+
+
+@contextlib.contextmanager
+def serve(application, server='threads', workers=1):
+    """Запускает приложение на 127.0.0.1 и отдает (host, port)."""
+    if server not in SERVERS:
+        raise ValueError(f'неизвестный сервер: {server}')
+    if server == 'threads':
+        httpd = ThreadedWSGIServer(('127.0.0.1', 0), _QuietHandler)
+    else:
+        httpd = WSGIServer(('127.0.0.1', 0), _ClosingHandler)
+    httpd.set_app(application)
+    if server == 'threads':
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield httpd.server_address
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+        return
+    # Открытые соединения с базой нельзя делить между процессами.
+    connections.close_all()
+    pids = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                httpd.serve_forever()
+            finally:
+                os._exit(0)
+        pids.append(pid)
+    try:
+        yield httpd.server_address
+    finally:
+        for pid in pids:
+            os.kill(pid, signal.SIGTERM)
+        for pid in pids:
+            os.waitpid(pid, 0)
+            metrics.mark_process_dead(pid)
+        httpd.server_close()
+
+
+class Traffic:
+    """Запросы смешанного трафика по данным из базы."""
+
+    def __init__(self, seed=0, logged_in=0.3, users=20):
+        self.random = random.Random(seed)
+        self.logged_in = logged_in
+        self.post_ids = list(
+            Post.objects.order_by('-pub_date').values_list(
+                'pk', flat=True
+            )[:SAMPLE_SIZE]
+        )
+        self.usernames = list(
+            AuthorStats.objects.order_by('-posts_count').values_list(
+                'user__username', flat=True
+            )[:SAMPLE_SIZE]
+        )
+        self.slugs = list(Group.objects.values_list('slug', flat=True))
+        self.group_ids = list(Group.objects.values_list('pk', flat=True))
+        # У кого длиннее лента подписок, тот и заходит.
+        self.viewers = list(
+            User.objects.filter(
+                stats__following_count__gt=0
+            ).order_by('-stats__following_count')[:users]
+        ) or list(User.objects.all()[:users])
+
+    def session(self):
+        """Cookie нового виртуального пользователя и токен CSRF."""
+        request = HttpRequest()
+        token = get_token(request)
+        cookies = {settings.CSRF_COOKIE_NAME: request.META['CSRF_COOKIE']}
+        mix = ANONYMOUS_MIX
+        if self.viewers and self.random.random() < self.logged_in:
+            client = Client()
+            client.force_login(self.random.choice(self.viewers))
+            name = settings.SESSION_COOKIE_NAME
+            cookies[name] = client.cookies[name].value
+            mix = USER_MIX
+        return {
+            'cookie': '; '.join(f'{k}={v}' for k, v in cookies.items()),
+            'csrf': token,
+            'mix': mix,
+            'random': random.Random(self.random.random()),
+        }
+
+    def request(self, session):
+        """(имя адреса, метод, путь, тело) следующего запроса."""
+        rng = session['random']
+        names, weights = zip(*session['mix'])
+        name = rng.choices(names, weights)[0]
+        while not self._possible(name):
+            name = 'posts:index'
+        page = {'page': rng.randint(1, PAGES)}
+        if name == 'posts:index' or name == 'posts:follow_index':
+            return name, 'GET', f'{reverse(name)}?{urlencode(page)}', None
+        if name == 'posts:search':
+            query = {'q': rng.choice(SEARCH_WORDS)}
+            return name, 'GET', f'{reverse(name)}?{urlencode(query)}', None
+        if name == 'posts:profile':
+            path = reverse(name, args=[rng.choice(self.usernames)])
+            return name, 'GET', f'{path}?{urlencode(page)}', None
+        if name == 'posts:group_posts':
+            path = reverse(name, args=[rng.choice(self.slugs)])
+            return name, 'GET', f'{path}?{urlencode(page)}', None
+        if name == 'posts:post_create':
+            data = {
+                'text': f'Пост под нагрузкой {rng.random()}',
+                'group': rng.choice(self.group_ids + ['']),
+            }
+            return name, 'POST', reverse(name), self._form(session, data)
+        path = reverse(name, args=[rng.choice(self.post_ids)])
+        if name == 'posts:add_comment':
+            data = {'text': f'Комментарий под нагрузкой {rng.random()}'}
+            return name, 'POST', path, self._form(session, data)
+        return name, 'GET', path, None
+
+    def _possible(self, name):
+        if name in ('posts:post_detail', 'posts:post_comments',
+                    'posts:add_comment'):
+            return bool(self.post_ids)
+        if name == 'posts:profile':
+            return bool(self.usernames)
+        if name == 'posts:group_posts':
+            return bool(self.slugs)
+        return True
+
+    def _form(self, session, data):
+        return urlencode({**data, 'csrfmiddlewaretoken': session['csrf']})
+
+
+def _user_loop(address, session, requests, deadline, samples, keep_alive):
+    connection = http.client.HTTPConnection(*address, timeout=REQUEST_TIMEOUT)
+    try:
+        while time.monotonic() < deadline:
+            name, method, path, body = requests(session)
+            headers = {'Cookie': session['cookie']}
+            if body is not None:
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            started = time.perf_counter()
+            try:
+                connection.request(method, path, body, headers)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 400
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                failed = True
+            finished = time.perf_counter()
+            if not keep_alive:
+                connection.close()
+            samples.append((name, (finished - started) * 1000, failed))
+    finally:
+        connection.close()
+
+
+def run(address, traffic, concurrency=10, duration=10, warmup=0,
+        keep_alive=True):
+    """Гоняет concurrency виртуальных пользователей duration секунд.
+
+    Замеры первых warmup секунд отбрасываются. Без keep_alive каждый
+    запрос идет в новом соединении: так надо с сервером processes, который
+    закрывает соединение после ответа, не предупреждая клиента.
+    Возвращает сводку (см. summarize).
+    """
+    sessions = [traffic.session() for _ in range(concurrency)]
+    started = time.monotonic()
+    deadline = started + warmup + duration
+    samples = [[] for _ in sessions]
+    threads = [
+        threading.Thread(
+            target=_user_loop,
+            args=(
+                address, session, traffic.request, deadline, bucket,
+                keep_alive,
+            ),
+        )
+        for session, bucket in zip(sessions, samples)
+    ]
+    for thread in threads:
+        thread.start()
+    if warmup:
+        time.sleep(warmup)
+        for bucket in samples:
+            bucket.clear()
+    measured = time.monotonic()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - measured
+    return summarize(
+        [sample for bucket in samples for sample in bucket], elapsed
+    )
+
+
+def _stats(latencies, errors, elapsed):
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'error_rate': round(errors / len(latencies), 4) if latencies else 0,
+        'rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'mean': round(sum(latencies) / len(latencies), 2) if latencies else 0,
+        'p50': round(percentile(latencies, 0.5), 2),
+        'p95': round(percentile(latencies, 0.95), 2),
+        'p99': round(percentile(latencies, 0.99), 2),
+        'max': round(max(latencies, default=0), 2),
+    }
+
+
+def summarize(samples, elapsed):
+    """Сводка по именам адресов и итог из замеров (имя, мс, ошибка)."""
+    by_name = {}
+    for name, latency, failed in samples:
+        latencies, errors = by_name.setdefault(name, ([], [0]))
+        latencies.append(latency)
+        errors[0] += failed
+    return {
+        'elapsed': round(elapsed, 3),
+        'total': _stats(
+            [latency for _, latency, _ in samples],
+            sum(failed for _, _, failed in samples),
+            elapsed,
+        ),
+        'urls': {
+            name: _stats(latencies, errors[0], elapsed)
+            for name, (latencies, errors) in sorted(by_name.items())
+        },
+    }
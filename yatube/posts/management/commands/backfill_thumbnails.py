@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import image_processed, make_pool, process_post_image
+from yatube.settings import THUMBNAIL_POOL_WORKERS
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает все варианты миниатюр и размытые превью для картинок '
+        'постов, параллельно в пуле процессов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=THUMBNAIL_POOL_WORKERS or 1
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        names = list(
+            Post.objects.exclude(image='').values_list(
+                'image', flat=True
+            ).distinct().order_by()
+        )
+        batch_size = options['batch_size']
+        done = failed = 0
+        pool = None
+        if options['workers'] > 1:
+            pool = make_pool(options['workers'])
+        try:
+            for start in range(0, len(names), batch_size):
+                batch = names[start:start + batch_size]
+                if pool is None:
+                    results = [self._generate(name) for name in batch]
+                else:
+                    futures = [
+                        pool.submit(process_post_image, name)
+                        for name in batch
+                    ]
+                    results = [
+                        self._result(name, future)
+                        for name, future in zip(batch, futures)
+                    ]
+                ready = [result for result in results if result]
+                for result in ready:
+                    image_processed(result)
+                done += len(ready)
+                failed += len(batch) - len(ready)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(
+            f'Картинок обработано: {done}, с ошибкой: {failed}'
+        )
+
+    def _generate(self, name):
+        try:
+            return process_post_image(name)
+        except Exception as error:
+            self.stderr.write(f'{name}: {error}')
+            return None
+
+    def _result(self, name, future):
+        try:
+            return future.result()
+        except Exception as error:
+            self.stderr.write(f'{name}: {error}')
+            return None
@@ -0,0 +1,79 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.thumbnails import (POST_THUMBNAIL_GEOMETRY, generate_thumbnail,
+                              post_image_variants)
+from yatube.settings import NUMBER_OF_POSTS_PER_PAGE
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает, сколько байт картинок загружает страница ленты: одна '
+        'миниатюра 960px в исходном формате (как раньше) против варианта '
+        'из srcset, который браузер выберет для заданного экрана.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=5)
+        parser.add_argument(
+            '--viewport', type=int, default=360,
+            help='Ширина экрана в CSS-пикселях.',
+        )
+        parser.add_argument('--dpr', type=float, default=2)
+
+    def handle(self, *args, **options):
+        target = options['viewport'] * options['dpr']
+        per_page = NUMBER_OF_POSTS_PER_PAGE
+        posts = Post.objects.exclude(image='').order_by('-pub_date', '-id')
+        self.stdout.write(
+            f'{"page":>6} {"images":>7} {"before, KB":>11} '
+            f'{"after, KB":>10} {"saved":>7}'
+        )
+        total_before = total_after = 0
+        for number in range(1, options['pages'] + 1):
+            page = list(posts[(number - 1) * per_page:number * per_page])
+            if not page:
+                break
+            before = sum(self._before(post) for post in page)
+            after = sum(self._after(post, target) for post in page)
+            total_before += before
+            total_after += after
+            self.stdout.write(
+                f'{number:>6} {len(page):>7} {before / 1024:>11.1f} '
+                f'{after / 1024:>10.1f} {self._saved(before, after):>7}'
+            )
+        self.stdout.write(
+            f'{"total":>6} {"":>7} {total_before / 1024:>11.1f} '
+            f'{total_after / 1024:>10.1f} '
+            f'{self._saved(total_before, total_after):>7}'
+        )
+
+    def _size(self, name, geometry, options):
+        return default_storage.size(
+            generate_thumbnail(name, geometry, options)
+        )
+
+    def _before(self, post):
+        return self._size(post.image.name, POST_THUMBNAIL_GEOMETRY, None)
+
+    def _after(self, post, target):
+        """Вариант WebP, который браузер выберет по srcset и sizes, и
+        размытое превью, встроенное в HTML."""
+        webp = [
+            (width, geometry, options)
+            for width, geometry, options in post_image_variants()
+            if options.get('format') == 'WEBP'
+        ]
+        width, geometry, options = next(
+            (variant for variant in webp if variant[0] >= target), webp[-1]
+        )
+        return (
+            self._size(post.image.name, geometry, options)
+            + len(post.image_placeholder)
+        )
+
+    def _saved(self, before, after):
+        if not before:
+            return '-'
+        return f'{(1 - after / before) * 100:.0f}%'
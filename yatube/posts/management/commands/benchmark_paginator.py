@@ -0,0 +1,75 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+
+from posts.models import Post
+from posts.paginators import CursorPaginator
+from yatube.settings import NUMBER_OF_POSTS_PER_PAGE
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает время открытия дальних страниц ленты: '
+        'OFFSET/COUNT против курсора. Данные создаются во временной '
+        'транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--pages', default='1,10,100,1000')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        pages = [int(page) for page in options['pages'].split(',')]
+        per_page = NUMBER_OF_POSTS_PER_PAGE
+        with transaction.atomic():
+            self._fill(options['posts'])
+            queryset = Post.objects.all()
+            self.stdout.write(f'{"page":>6} {"offset, ms":>12} '
+                              f'{"cursor, ms":>12}')
+            for number in pages:
+                offset = self._measure(
+                    options['repeat'],
+                    lambda: list(Paginator(
+                        queryset.order_by('-pub_date', '-id'), per_page
+                    ).page(number))
+                )
+                paginator = CursorPaginator(queryset, per_page)
+                token = self._cursor_to(paginator, number)
+                cursor = self._measure(
+                    options['repeat'],
+                    lambda: list(paginator.page_for_request(cursor=token))
+                )
+                self.stdout.write(f'{number:>6} {offset:>12.2f} '
+                                  f'{cursor:>12.2f}')
+            transaction.set_rollback(True)
+
+    def _fill(self, total):
+        author = User.objects.create_user(username='benchmark_paginator')
+        batch = 5000
+        for start in range(0, total, batch):
+            Post.objects.bulk_create(
+                Post(author=author, text=f'Пост {number}')
+                for number in range(start, min(start + batch, total))
+            )
+
+    def _cursor_to(self, paginator, number):
+        """Токен страницы number, как если бы до нее долистали."""
+        if number == 1:
+            return None
+        last = paginator.object_list[(number - 1) * paginator.per_page - 1]
+        return paginator.cursor_for(last, number, 'next')
+
+    def _measure(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings) * 1000
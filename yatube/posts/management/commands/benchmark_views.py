@@ -0,0 +1,124 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+
+from posts import benchmark
+from posts.dataset import DEFAULT_SIZES, generate_dataset
+
+
+BASELINE = os.path.join(
+    os.path.dirname(benchmark.__file__), 'benchmarks', 'views.json'
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет все страницы posts, users и about на синтетическом наборе '
+        'данных: число запросов, p50 и p95. Падает, если статус или число '
+        'запросов хуже эталона (задержка — только с --check-latency). '
+        'Набор создается во временной транзакции и откатывается, кеш '
+        'и метрики пишутся во временный каталог.'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument(f'--{name}', type=int, default=default)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument(
+            '--warm', action='store_true',
+            help='Не очищать кеш перед каждым запросом.',
+        )
+        parser.add_argument(
+            '--existing', action='store_true',
+            help='Мерить на данных в базе, а не на синтетическом наборе.',
+        )
+        parser.add_argument('--baseline', default=BASELINE)
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Записать результат как новый эталон.',
+        )
+        parser.add_argument(
+            '--check-latency', action='store_true',
+            help='Сравнивать и p95 (эталон должен быть снят на этой же '
+                 'машине).',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=benchmark.DEFAULT_TOLERANCE,
+            help='Допустимый рост p95 (доля) при --check-latency.',
+        )
+
+    def handle(self, *args, **options):
+        dataset = None
+        if not options['existing']:
+            dataset = {name: options[name] for name in DEFAULT_SIZES}
+            dataset['seed'] = options['seed']
+        with benchmark.separate_storage(), transaction.atomic():
+            if dataset is not None:
+                generate_dataset(**dataset)
+            results = self._run(options['repeat'], options['warm'])
+            transaction.set_rollback(True)
+        self._report(results)
+        current = {
+            'dataset': dataset,
+            'repeat': options['repeat'],
+            'warm': options['warm'],
+            'results': results,
+        }
+        if options['save_baseline']:
+            with open(options['baseline'], 'w', encoding='utf-8') as file:
+                json.dump(current, file, ensure_ascii=False, indent=2)
+                file.write('\n')
+            self.stdout.write(f'Эталон записан: {options["baseline"]}')
+            return
+        self._check(current, options)
+
+    def _run(self, repeat, warm):
+        clients = {'anonymous': Client()}
+        viewer = benchmark.sample_viewer()
+        if viewer is not None:
+            clients['user'] = Client()
+            clients['user'].force_login(viewer)
+        results = {}
+        for name, path in benchmark.targets(benchmark.sample_arguments()):
+            for who, client in clients.items():
+                results[f'{name} {who}'] = benchmark.measure(
+                    client, path, repeat, warm
+                )
+        return results
+
+    def _report(self, results):
+        self.stdout.write(
+            f'{"url":<40} {"status":>6} {"queries":>7} '
+            f'{"p50, ms":>8} {"p95, ms":>8}'
+        )
+        for key, result in results.items():
+            self.stdout.write(
+                f'{key:<40} {result["status"]:>6} {result["queries"]:>7} '
+                f'{result["p50"]:>8.2f} {result["p95"]:>8.2f}'
+            )
+
+    def _check(self, current, options):
+        if not os.path.exists(options['baseline']):
+            self.stdout.write('Эталона нет, сравнивать не с чем.')
+            return
+        with open(options['baseline'], encoding='utf-8') as file:
+            baseline = json.load(file)
+        for field in ('dataset', 'repeat', 'warm'):
+            if baseline.get(field) != current[field]:
+                raise CommandError(
+                    f'Эталон снят с другими параметрами ({field}): '
+                    f'{baseline.get(field)}'
+                )
+        problems = benchmark.compare(
+            current['results'], baseline['results'], options['tolerance'],
+            options['check_latency'],
+        )
+        if problems:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(problems)
+            )
+        self.stdout.write('Регрессий нет.')
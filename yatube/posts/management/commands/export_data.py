@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.export import EXPORT_MODELS, encoded, gzipped, lines
+from yatube.settings import EXPORT_BATCH_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает пользователей, группы, посты, комментарии и подписки '
+        'в NDJSON или CSV потоком, не загружая таблицы в память.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', action='append', choices=EXPORT_MODELS,
+            help='Что выгружать (можно несколько раз); по умолчанию все.',
+        )
+        parser.add_argument(
+            '--format', choices=('ndjson', 'csv'), default='ndjson'
+        )
+        parser.add_argument(
+            '--output', default='-',
+            help='Файл (.gz — со сжатием) или - для stdout.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=EXPORT_BATCH_SIZE
+        )
+
+    def handle(self, *args, **options):
+        models = options['model'] or EXPORT_MODELS
+        if options['format'] == 'csv' and len(models) != 1:
+            raise CommandError('CSV выгружается по одной модели: --model.')
+        export = lines(options['format'], models, options['batch_size'])
+        output = options['output']
+        if output == '-':
+            for line in export:
+                self.stdout.write(line, ending='')
+            return
+        chunks = encoded(export)
+        if output.endswith('.gz'):
+            chunks = gzipped(chunks)
+        with open(output, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.feed import fan_out_pending
+
+
+class Command(BaseCommand):
+    help = (
+        'Дорассылает по лентам подписчиков посты, фоновая рассылка '
+        'которых не закончилась (например, процесс сайта перезапустили).'
+    )
+
+    def handle(self, *args, **options):
+        count = fan_out_pending()
+        self.stdout.write(f'Дорассылок выполнено: {count}')
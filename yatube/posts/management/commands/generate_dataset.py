@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts.dataset import DEFAULT_SIZES, generate_dataset
+
+
+class Command(BaseCommand):
+    help = (
+        'Создает воспроизводимый синтетический набор пользователей, групп, '
+        'постов, комментариев и подписок (Faker с заданным зерном).'
+    )
+
+    def add_arguments(self, parser):
+        for name, default in DEFAULT_SIZES.items():
+            parser.add_argument(f'--{name}', type=int, default=default)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        importer = generate_dataset(
+            seed=options['seed'],
+            progress=self._progress,
+            **{name: options[name] for name in DEFAULT_SIZES},
+        )
+        self.stdout.write(
+            'Создано: ' + ', '.join(
+                f'{model} {count}' for model, count in importer.created.items()
+            )
+        )
+
+    def _progress(self, total, rate):
+        self.stderr.write(f'Записей: {total} ({rate:.0f} в секунду)')
@@ -0,0 +1,78 @@
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.bulk_import import (MODELS, Importer, InvalidRecord,
+                               deferred_indexes, guess_format, guess_model,
+                               open_input, read_records)
+from yatube.settings import BULK_IMPORT_BATCH_SIZE, BULK_IMPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает пользователей, группы, посты, комментарии и подписки '
+        'из NDJSON или CSV пачками bulk_create. Счетчики, ленты и кеш '
+        'обновляются один раз в конце.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths', nargs='+',
+            help='Файлы .ndjson, .csv (можно .gz) или - для stdin.',
+        )
+        parser.add_argument('--format', choices=('ndjson', 'csv'))
+        parser.add_argument(
+            '--model', choices=MODELS,
+            help=(
+                'Модель записей без поля model; для CSV по умолчанию '
+                'берется из имени файла.'
+            ),
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=BULK_IMPORT_BATCH_SIZE
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=BULK_IMPORT_CHUNK_SIZE
+        )
+        parser.add_argument(
+            '--defer-indexes', action='store_true',
+            help='Снять индексы постов и комментариев на время загрузки.',
+        )
+
+    def handle(self, *args, **options):
+        importer = Importer(
+            batch_size=options['batch_size'],
+            chunk_size=options['chunk_size'],
+            progress=self._progress,
+        )
+        defer = deferred_indexes if options['defer_indexes'] else nullcontext
+        try:
+            with defer():
+                for path in options['paths']:
+                    data_format = options['format'] or guess_format(path)
+                    model = options['model'] or guess_model(path)
+                    if data_format == 'csv' and not model:
+                        raise CommandError(
+                            f'{path}: модель не ясна из имени, нужен --model.'
+                        )
+                    with open_input(path) as stream:
+                        importer.load(
+                            read_records(stream, data_format, model)
+                        )
+        except InvalidRecord as error:
+            raise CommandError(f'Ошибка в данных: {error}')
+        finally:
+            importer.finish()
+        for model in MODELS:
+            if importer.created[model] or importer.skipped[model]:
+                self.stdout.write(
+                    f'{model}: загружено {importer.created[model]}, '
+                    f'пропущено {importer.skipped[model]}'
+                )
+        self.stdout.write(
+            f'Всего записей: {importer.total}, '
+            f'{importer.rate:.0f} в секунду'
+        )
+
+    def _progress(self, total, rate):
+        self.stderr.write(f'Записей: {total} ({rate:.0f} в секунду)')
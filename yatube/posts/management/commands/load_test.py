@@ -0,0 +1,96 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import load
+from posts.models import Post
+from yatube.wsgi import application
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон: поднимает yatube.wsgi.application в потоках '
+        'или процессах и гоняет смешанный трафик анонимов и вошедших '
+        'пользователей. Пишет в базу посты и комментарии.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--server', choices=load.SERVERS, default='threads',
+            help='processes — несколько процессов с общим сокетом '
+                 '(только Unix).',
+        )
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--concurrency', type=int, default=10,
+            help='Число виртуальных пользователей.',
+        )
+        parser.add_argument('--duration', type=float, default=30)
+        parser.add_argument('--warmup', type=float, default=3)
+        parser.add_argument(
+            '--logged-in', type=float, default=0.3,
+            help='Доля вошедших пользователей.',
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Записать результат в JSON.')
+        parser.add_argument(
+            '--compare', help='Сравнить с результатом прошлого прогона.'
+        )
+
+    def handle(self, *args, **options):
+        if not Post.objects.exists():
+            raise CommandError(
+                'В базе нет постов: наполните ее командой generate_dataset.'
+            )
+        traffic = load.Traffic(options['seed'], options['logged_in'])
+        with load.serve(
+            application, options['server'], options['workers']
+        ) as address:
+            summary = load.run(
+                address, traffic, options['concurrency'],
+                options['duration'], options['warmup'],
+                keep_alive=options['server'] == 'threads',
+            )
+        summary['config'] = {
+            field: options[field] for field in (
+                'server', 'workers', 'concurrency', 'duration', 'warmup',
+                'logged_in', 'seed',
+            )
+        }
+        previous = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = json.load(file)
+        self._report(summary, previous)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(summary, file, ensure_ascii=False, indent=2)
+                file.write('\n')
+            self.stdout.write(f'Результат записан: {options["output"]}')
+
+    def _report(self, summary, previous):
+        self.stdout.write(
+            f'{"url":<22} {"requests":>8} {"rps":>8} {"errors":>7} '
+            f'{"p50, ms":>8} {"p95, ms":>8} {"p99, ms":>8}'
+        )
+        rows = list(summary['urls'].items()) + [('total', summary['total'])]
+        for name, stats in rows:
+            line = (
+                f'{name:<22} {stats["requests"]:>8} {stats["rps"]:>8.1f} '
+                f'{stats["error_rate"]:>7.1%} {stats["p50"]:>8.1f} '
+                f'{stats["p95"]:>8.1f} {stats["p99"]:>8.1f}'
+            )
+            if previous is not None:
+                line += self._delta(name, stats, previous)
+            self.stdout.write(line)
+
+    def _delta(self, name, stats, previous):
+        before = (
+            previous['total'] if name == 'total'
+            else previous['urls'].get(name)
+        )
+        if not before or not before['rps'] or not before['p95']:
+            return ''
+        rps = stats['rps'] / before['rps'] - 1
+        p95 = stats['p95'] / before['p95'] - 1
+        return f'  rps {rps:+.0%}, p95 {p95:+.0%}'
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = 'Строит полнотекстовый индекс постов заново по всем данным.'
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError('Полнотекстовый индекс есть только на SQLite.')
+        search.rebuild()
+        self.stdout.write('Поисковый индекс перестроен.')
@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Max
+
+from posts.counters import recount_comments_chunk, recount_stats_chunk
+from posts.models import Post, User
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает денормализованные счетчики постов, комментариев '
+        'и подписок и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        jobs = [
+            (recount_stats_chunk, start, start + chunk_size)
+            for start in self._starts(User, chunk_size)
+        ] + [
+            (recount_comments_chunk, start, start + chunk_size)
+            for start in self._starts(Post, chunk_size)
+        ]
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(options['workers']) as executor:
+                fixed = sum(executor.map(self._run_in_thread, jobs))
+        else:
+            fixed = sum(func(start, stop) for func, start, stop in jobs)
+        self.stdout.write(
+            f'Проверено частей: {len(jobs)}, исправлено строк: {fixed}'
+        )
+
+    def _starts(self, model, chunk_size):
+        last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        return range(0, last + 1, chunk_size)
+
+    @staticmethod
+    def _run_in_thread(job):
+        func, start, stop = job
+        try:
+            return func(start, stop)
+        finally:
+            # У каждого потока свое соединение с базой.
+            connection.close()
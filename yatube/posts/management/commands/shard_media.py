@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.storage import is_sharded
+from posts.thumbnails import image_processed, make_pool, shard_image
+from yatube.settings import THUMBNAIL_POOL_WORKERS
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит картинки постов в каталоги по хешу содержимого. '
+        'Сайт при этом работает: файл сначала копируется, затем посты '
+        'переключаются на копию, и только потом старый файл удаляется. '
+        'Прерванный перенос продолжается повторным запуском.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=THUMBNAIL_POOL_WORKERS or 1
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        moved = failed = 0
+        pool = None
+        if options['workers'] > 1:
+            pool = make_pool(options['workers'])
+        try:
+            for batch in self._batches(options['batch_size']):
+                if pool is None:
+                    results = [self._move(name) for name in batch]
+                else:
+                    futures = [
+                        pool.submit(shard_image, name) for name in batch
+                    ]
+                    results = [
+                        self._result(name, future)
+                        for name, future in zip(batch, futures)
+                    ]
+                ready = [result for result in results if result]
+                for result in ready:
+                    image_processed(result)
+                moved += len(ready)
+                failed += len(batch) - len(ready)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        self.stdout.write(
+            f'Картинок перенесено: {moved}, с ошибкой: {failed}'
+        )
+
+    def _batches(self, batch_size):
+        """Имена еще не перенесенных картинок, по постам в порядке id."""
+        last_id = 0
+        seen = set()
+        while True:
+            rows = list(
+                Post.objects.filter(pk__gt=last_id).exclude(image='')
+                .order_by('pk').values_list('pk', 'image')[:batch_size]
+            )
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            batch = []
+            for _, name in rows:
+                if name not in seen and not is_sharded(name):
+                    seen.add(name)
+                    batch.append(name)
+            if batch:
+                yield batch
+
+    def _move(self, name):
+        try:
+            return shard_image(name)
+        except Exception as error:
+            self.stderr.write(f'{name}: {error}')
+            return None
+
+    def _result(self, name, future):
+        try:
+            return future.result()
+        except Exception as error:
+            self.stderr.write(f'{name}: {error}')
+            return None
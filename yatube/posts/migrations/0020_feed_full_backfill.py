@@ -0,0 +1,49 @@
+# Generated by Django 2.2.16 on 2026-10-18 07:10
+
+from django.db import migrations
+
+
+BATCH_SIZE = 500
+
+
+def backfill_older_posts(apps, schema_editor):
+    """0011 положила в ленты только 1000 последних постов на подписку;
+    дописываем остальные порциями по id."""
+    Follow = apps.get_model('posts', 'Follow')
+    Post = apps.get_model('posts', 'Post')
+    FeedEntry = apps.get_model('posts', 'FeedEntry')
+    for follow in Follow.objects.iterator():
+        last_id = 0
+        while True:
+            posts = list(
+                Post.objects.filter(
+                    author_id=follow.author_id, pk__gt=last_id
+                ).order_by('pk').values_list('id', 'pub_date')[:BATCH_SIZE]
+            )
+            if not posts:
+                break
+            FeedEntry.objects.bulk_create(
+                (
+                    FeedEntry(
+                        user_id=follow.user_id,
+                        author_id=follow.author_id,
+                        post_id=post_id,
+                        pub_date=pub_date,
+                    )
+                    for post_id, pub_date in posts
+                ),
+                batch_size=BATCH_SIZE,
+                ignore_conflicts=True,
+            )
+            last_id = posts[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0019_comment_index_id'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_older_posts, migrations.RunPython.noop),
+    ]
@@ -2,6 +2,8 @@ from django.contrib.auth import get_user_model
 from django.db import models
 from django.db.models.constraints import UniqueConstraint
 
+from .storage import post_image_storage
+
 User = get_user_model()
 
 
@@ -33,11 +35,36 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=post_image_storage,
         blank=True
     )
+    image_placeholder = models.TextField(
+        'Размытое превью картинки',
+        blank=True,
+        editable=False,
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество комментариев'
+    )
 
     class Meta:
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'{self.text[:15]}'
@@ -93,10 +120,17 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(
+                fields=['post', 'active', '-created', '-id'],
+                name='comment_post_active_idx'
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'Комментарий от {self.author} к {self.post}'
 
+
 class Follow(models.Model):
     user = models.ForeignKey(
         User,
@@ -115,7 +149,143 @@ class Follow(models.Model):
     )
 
     class Meta:
-        UniqueConstraint(fields=['user', 'aythor'], name='unique_following')
+        # Уникальный индекс (user, author) заодно обслуживает проверку
+        # подписки и отписку.
+        constraints = [
+            UniqueConstraint(
+                fields=['user', 'author'], name='unique_following'
+            ),
+        ]
 
     def __str__(self) -> str:
         return f'Подписка {self.user} на посты {self.author}'
+
+
+class AuthorStats(models.Model):
+    """Счетчики пользователя, которые иначе пришлось бы считать COUNT(*).
+
+    Обновляются F-выражениями из сигналов, расхождения после массовых
+    операций исправляет команда recount_counters.
+    """
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество постов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписчиков'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество подписок'
+    )
+
+    def __str__(self) -> str:
+        return f'Счетчики {self.user}'
+
+
+class FeedEntry(models.Model):
+    """Запись ленты подписок: пост автора во «входящих» подписчика.
+
+    Заполняется при публикации поста (fan-out on write), поэтому лента
+    читается одним диапазоном индекса (user, pub_date) без JOIN с Follow.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+        help_text='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пост',
+        help_text='Пост'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор поста',
+        help_text='Автор поста'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации'
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_feed_entry'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='feed_user_pub_date_idx'
+            ),
+            models.Index(
+                fields=['user', 'author'],
+                name='feed_user_author_idx'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.post} в ленте {self.user}'
+
+
+class PendingFanOut(models.Model):
+    """Рассылка поста автора с большим числом подписчиков, которая еще
+    не дошла до всех лент.
+
+    Пишется в одной транзакции с постом, поэтому рассылка не теряется,
+    если процесс умрет посреди фонового потока: ее дорассылает команда
+    fan_out_pending, начиная с подписчика после last_user_id.
+    """
+    post = models.OneToOneField(
+        Post,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='+',
+        verbose_name='Пост'
+    )
+    last_user_id = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Последний подписчик с записью'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    def __str__(self) -> str:
+        return f'Рассылка {self.post_id} после {self.last_user_id}'
+
+
+class ImageBlob(models.Model):
+    """Файл картинки в хранилище по содержимому и число постов с ним."""
+    name = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='Файл'
+    )
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество ссылок'
+    )
+
+    class Meta:
+        verbose_name = 'Файл картинки'
+        verbose_name_plural = 'Файлы картинок'
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,170 @@
+"""Кеш готовых страниц для анонимных посетителей.
+
+Страница хранится целиком, байтами ответа (при PAGE_CACHE_GZIP — сжатыми
+gzip), под ключом из пути, параметров выдачи и версий областей, от которых
+она зависит (см. posts.cache). Сигналы сдвигают эти версии при записи,
+поэтому после создания поста, правки, комментария или подписки следующий
+запрос получает свежую страницу. Авторизованные пользователи кеш
+не используют и всегда видят собственные изменения.
+
+Те же версии служат валидаторами условных запросов (ETag и
+Last-Modified): неизменившаяся страница получает 304 до выполнения view.
+"""
+import functools
+import gzip
+import hashlib
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+
+from yatube.settings import (PAGE_CACHE_ENABLED, PAGE_CACHE_GZIP,
+                             PAGE_CACHE_MIN_GZIP_LENGTH, PAGE_CACHE_TIMEOUT)
+
+from .cache import follow_scope, get_versions, user_scope, version_time
+
+
+PAGE_PARAMS = ('page', 'cursor')
+
+
+def page_versions(request, get_scopes, kwargs):
+    """Версии областей страницы; считаются один раз на запрос."""
+    if not hasattr(request, '_page_versions'):
+        scopes = get_scopes(request, **kwargs)
+        request._page_versions = (
+            None if scopes is None else get_versions(*scopes)
+        )
+    return request._page_versions
+
+
+def _accepts_gzip(request):
+    return 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+
+
+def _is_cacheable_request(request, params):
+    if not PAGE_CACHE_ENABLED or request.method not in ('GET', 'HEAD'):
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Посторонние параметры не размножают записи в кеше.
+    return set(request.GET).issubset(params)
+
+
+def _is_cacheable_response(request, response):
+    return (
+        response.status_code == 200
+        and not response.streaming
+        and not response.cookies
+        # Страница с CSRF-токеном у каждого посетителя своя.
+        and not request.META.get('CSRF_COOKIE_USED')
+    )
+
+
+def page_key(request, params, versions):
+    query = urlencode(sorted(
+        (name, request.GET[name]) for name in params if name in request.GET
+    ))
+    digest = hashlib.md5(
+        f'{request.path}?{query}'.encode()
+    ).hexdigest()
+    return 'page:{}:{}'.format(digest, ':'.join(versions))
+
+
+def _pack(response):
+    body = response.content
+    compressed = (
+        PAGE_CACHE_GZIP and len(body) >= PAGE_CACHE_MIN_GZIP_LENGTH
+    )
+    if compressed:
+        body = gzip.compress(body)
+    return response['Content-Type'], body, compressed
+
+
+def _unpack(request, entry):
+    content_type, body, compressed = entry
+    if compressed and not _accepts_gzip(request):
+        body = gzip.decompress(body)
+        compressed = False
+    response = HttpResponse(body, content_type=content_type)
+    if compressed:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+def anonymous_page_cache(get_scopes, params=PAGE_PARAMS):
+    """Кеширует страницу view для анонимных GET-запросов.
+
+    ``get_scopes(request, **kwargs)`` возвращает области, от которых
+    зависит страница, или None, если кешировать нечего (например,
+    объекта нет и view ответит 404).
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _is_cacheable_request(request, params):
+                return view(request, *args, **kwargs)
+            versions = page_versions(request, get_scopes, kwargs)
+            if versions is None:
+                return view(request, *args, **kwargs)
+            key = page_key(request, params, versions)
+            entry = cache.get(key)
+            if entry is not None:
+                response = _unpack(request, entry)
+                response['X-Page-Cache'] = 'hit'
+                return response
+            response = view(request, *args, **kwargs)
+            if _is_cacheable_response(request, response):
+                cache.set(key, _pack(response), PAGE_CACHE_TIMEOUT)
+                response['X-Page-Cache'] = 'miss'
+            return response
+        return wrapper
+    return decorator
+
+
+def _viewer_versions(request, get_scopes, kwargs):
+    """Версии страницы вместе с версиями того, что видит пользователь.
+
+    Авторизованному пользователю страница показывает его подписки
+    и имя в шапке, поэтому к версиям добавляются его области.
+    """
+    if not hasattr(request, '_viewer_versions'):
+        versions = page_versions(request, get_scopes, kwargs)
+        if versions is not None and request.user.is_authenticated:
+            user_id = request.user.pk
+            versions = versions + get_versions(
+                follow_scope(user_id), user_scope(user_id)
+            )
+        request._viewer_versions = versions
+    return request._viewer_versions
+
+
+def conditional_page(get_scopes):
+    """Отвечает 304 Not Modified, если версии страницы не менялись.
+
+    ETag — хеш версий (а для авторизованных еще и пользователя с его
+    CSRF-токеном из формы на странице), Last-Modified — время самой
+    свежей версии. Ни один из них не требует запросов ленты.
+    """
+    def etag(request, *args, **kwargs):
+        versions = _viewer_versions(request, get_scopes, kwargs)
+        if versions is None:
+            return None
+        parts = list(versions)
+        if request.user.is_authenticated:
+            parts += [
+                str(request.user.pk), request.META.get('CSRF_COOKIE', '')
+            ]
+        return hashlib.md5(':'.join(parts).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        versions = _viewer_versions(request, get_scopes, kwargs)
+        times = [
+            moment for moment in map(version_time, versions or ())
+            if moment is not None
+        ]
+        return max(times, default=None)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
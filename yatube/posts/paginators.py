@@ -0,0 +1,347 @@
+import datetime as dt
+import hashlib
+from collections import namedtuple
+from urllib.parse import urlencode
+
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from yatube.settings import (PAGINATOR_COUNT_CACHE_TIMEOUT,
+                             PAGINATOR_COUNT_LIMIT, PAGINATOR_OFFSET_PAGES,
+                             PAGINATOR_WINDOW)
+
+from .cache import get_versions
+
+
+CURSOR_SALT = 'posts.paginators.cursor'
+
+
+PageLink = namedtuple('PageLink', 'number query')
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, dt.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return parse_datetime(value['dt'])
+    return value
+
+
+def encode_cursor(values, number, direction):
+    """Упаковывает позицию в выдаче в непрозрачный подписанный токен."""
+    return signing.dumps(
+        {
+            'v': [_encode_value(value) for value in values],
+            'n': number,
+            'd': direction,
+        },
+        salt=CURSOR_SALT,
+        compress=True,
+    )
+
+
+def decode_cursor(token):
+    try:
+        data = signing.loads(token, salt=CURSOR_SALT)
+        values = [_decode_value(value) for value in data['v']]
+        return values, int(data['n']), data['d']
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        raise InvalidCursor(token)
+
+
+class CursorPage(Page):
+    """Страница выдачи, которая знает своих соседей без COUNT(*)."""
+
+    def __init__(self, object_list, number, paginator,
+                 has_next, has_previous):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1
+
+    @cached_property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        if self.number + 1 <= self.paginator.offset_pages:
+            # Первые страницы доступны по ?page=N, токен не нужен.
+            return None
+        return self.paginator.cursor_for(
+            self.object_list[-1], self.number + 1, 'next'
+        )
+
+    @cached_property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        if self.number - 1 <= self.paginator.offset_pages:
+            return None
+        return self.paginator.cursor_for(
+            self.object_list[0], self.number - 1, 'previous'
+        )
+
+    @property
+    def first_query(self):
+        return self.paginator.query(page=1)
+
+    @property
+    def next_query(self):
+        if self.next_cursor:
+            return self.paginator.query(cursor=self.next_cursor)
+        return self.paginator.query(page=self.number + 1)
+
+    @property
+    def previous_query(self):
+        if self.previous_cursor:
+            return self.paginator.query(cursor=self.previous_cursor)
+        return self.paginator.query(page=self.number - 1)
+
+    @cached_property
+    def last_query(self):
+        """Ссылка на последнюю страницу, если ее номер известен точно."""
+        paginator = self.paginator
+        if not self._has_next or paginator.count_is_approximate:
+            return None
+        if paginator.num_pages <= paginator.offset_pages:
+            return paginator.query(page=paginator.num_pages)
+        return paginator.query(
+            cursor=encode_cursor([], paginator.num_pages, 'last')
+        )
+
+    def _query_for(self, number):
+        if number <= self.paginator.offset_pages:
+            return self.paginator.query(page=number)
+        if number == self.number + 1:
+            return self.next_query
+        if number == self.number - 1:
+            return self.previous_query
+        if number == self.paginator.num_pages:
+            return self.last_query
+        return None
+
+    @property
+    def window(self):
+        """Ссылки на страницы вокруг текущей, не больше 2 * W + 1 штук.
+
+        Дальние страницы за пределами OFFSET-зоны открываются только
+        курсором, поэтому в окно попадают лишь соседние с текущей.
+        """
+        paginator = self.paginator
+        lower = max(1, self.number - PAGINATOR_WINDOW)
+        upper = self.number + PAGINATOR_WINDOW
+        if not self._has_next:
+            upper = self.number
+        elif not paginator.count_is_approximate:
+            upper = max(self.number, min(upper, paginator.num_pages))
+        links = []
+        for number in range(lower, upper + 1):
+            if number == self.number:
+                links.append(PageLink(number, None))
+                continue
+            query = self._query_for(number)
+            if query is not None:
+                links.append(PageLink(number, query))
+        return links
+
+
+class CursorPaginator(Paginator):
+    """Паджинатор по ключу (pub_date, id) вместо OFFSET.
+
+    Первые ``offset_pages`` страниц открываются по ``?page=N`` как раньше,
+    дальше выдача листается токенами ``?cursor=...``. Ни тот, ни другой
+    путь не делает COUNT(*): признак следующей страницы берется из
+    лишней строки выборки.
+
+    ``count`` нужен только для окна ссылок и ссылки на последнюю страницу.
+    Он кешируется под версией области ``count_scope`` (см. posts.cache;
+    можно передать и список областей),
+    а выше PAGINATOR_COUNT_LIMIT считается приблизительно: COUNT(*)
+    останавливается на пороге. Если число уже известно (например, из
+    счетчиков автора), его можно передать в ``known_count``.
+    """
+
+    def __init__(self, object_list, per_page,
+                 ordering=('-pub_date', '-id'),
+                 offset_pages=PAGINATOR_OFFSET_PAGES,
+                 count_scope=None, known_count=None, params=None,
+                 **kwargs):
+        self.ordering = tuple(ordering)
+        self.params = params or {}
+        self.offset_pages = offset_pages
+        self.count_scope = count_scope
+        self.known_count = known_count
+        self._count_is_approximate = False
+        super().__init__(
+            object_list.order_by(*self.ordering), per_page, **kwargs
+        )
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        if self.count_scope is None:
+            return self._bounded_count()
+        scopes = self.count_scope
+        if isinstance(scopes, str):
+            scopes = [scopes]
+        sql = str(self.object_list.order_by().query)
+        key = 'paginator:count:{}'.format(
+            hashlib.md5(
+                ':'.join(get_versions(*scopes) + [sql]).encode()
+            ).hexdigest(),
+        )
+        cached = cache.get(key)
+        if cached is None:
+            cached = (self._bounded_count(), self._count_is_approximate)
+            cache.set(key, cached, PAGINATOR_COUNT_CACHE_TIMEOUT)
+        count, self._count_is_approximate = cached
+        return count
+
+    @property
+    def count_is_approximate(self):
+        """Приблизительно ли count; узнать это можно, только посчитав."""
+        self.count
+        return self._count_is_approximate
+
+    def _bounded_count(self):
+        """COUNT(*), который не читает больше PAGINATOR_COUNT_LIMIT строк."""
+        count = self.object_list.order_by()[:PAGINATOR_COUNT_LIMIT + 1].count()
+        self._count_is_approximate = count > PAGINATOR_COUNT_LIMIT
+        return min(count, PAGINATOR_COUNT_LIMIT)
+
+    def query(self, **params):
+        """Строка запроса ссылки на страницу с сохранением params."""
+        return urlencode({**self.params, **params})
+
+    def _get_page(self, object_list, number, paginator):
+        return CursorPage(
+            list(object_list), number, paginator,
+            has_next=number < self.num_pages,
+            has_previous=number > 1,
+        )
+
+    def _field_names(self):
+        return [name.lstrip('-') for name in self.ordering]
+
+    def cursor_for(self, obj, number, direction):
+        values = [getattr(obj, name) for name in self._field_names()]
+        return encode_cursor(values, number, direction)
+
+    def _keyset_filter(self, values, direction):
+        """Условие «строго после» (или «строго до») позиции values.
+
+        Перед цепочкой OR идет диапазон по первому полю сортировки
+        (``pub_date <= v AND (pub_date < v OR ...)``): по одному OR
+        SQLite не ищет в индексе, а читает его с начала, и глубокие
+        страницы становились бы все медленнее.
+        """
+        condition = Q()
+        equal = {}
+        bound = None
+        for ordering, value in zip(self.ordering, values):
+            name = ordering.lstrip('-')
+            descending = ordering.startswith('-')
+            if direction == 'previous':
+                descending = not descending
+            lookup = 'lt' if descending else 'gt'
+            if bound is None:
+                bound = Q(**{f'{name}__{lookup}e': value})
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return bound & condition
+
+    def _reversed_ordering(self):
+        return [
+            name[1:] if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        ]
+
+    def page_by_number(self, number):
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        number = min(number, self.offset_pages)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            # Номер страницы за концом выдачи: ведем себя как get_page.
+            return self.get_page(number)
+        return CursorPage(
+            rows[:self.per_page], number, self,
+            has_next=len(rows) > self.per_page,
+            has_previous=number > 1,
+        )
+
+    def last_page(self, number):
+        remainder = self.count - (number - 1) * self.per_page
+        if not 0 < remainder <= self.per_page:
+            remainder = self.per_page
+        queryset = self.object_list.order_by(*self._reversed_ordering())
+        rows = list(queryset[:remainder + 1])
+        more = len(rows) > remainder
+        rows = rows[:remainder]
+        rows.reverse()
+        return CursorPage(
+            rows, number, self, has_next=False, has_previous=more
+        )
+
+    def page_by_cursor(self, token):
+        values, number, direction = decode_cursor(token)
+        if direction == 'last':
+            return self.last_page(number)
+        queryset = self.object_list.filter(
+            self._keyset_filter(values, direction)
+        )
+        if direction == 'previous':
+            queryset = queryset.order_by(*self._reversed_ordering())
+        rows = list(queryset[:self.per_page + 1])
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'previous':
+            rows.reverse()
+            return CursorPage(
+                rows, number, self, has_next=True, has_previous=more
+            )
+        return CursorPage(
+            rows, number, self, has_next=more, has_previous=number > 1
+        )
+
+    def page_for_request(self, page_number=None, cursor=None):
+        if cursor:
+            try:
+                return self.page_by_cursor(cursor)
+            except InvalidCursor:
+                pass
+        return self.page_by_number(page_number)
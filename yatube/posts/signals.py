@@ -0,0 +1,160 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, feed, thumbnails
+from .cache import (author_scope, bump_versions, follow_scope,
+                    followers_scope, group_scope, groups_scope, index_scope,
+                    post_scope, stats_scope, user_scope)
+from .models import Comment, Follow, Group, Post, User
+
+
+def bump_post_scopes(post, *group_ids):
+    bump_versions(
+        index_scope(),
+        author_scope(post.author_id),
+        followers_scope(post.author_id),
+        post_scope(post.pk),
+        *(group_scope(group_id) for group_id in group_ids if group_id),
+    )
+
+
+def release_image(name):
+    """Снимает ссылку поста с файла картинки; файл без ссылок
+    удаляется вместе с миниатюрами после коммита."""
+    if counters.release_image(name):
+        transaction.on_commit(lambda: thumbnails.drop_image(name))
+
+
+@receiver(pre_save, sender=Post)
+def post_saving(sender, instance, raw=False, **kwargs):
+    # Запоминаем прежние группу, чтобы сбросить и ее ленту,
+    # и картинку, чтобы не резать миниатюру заново.
+    instance._old_group_id = instance._old_image = None
+    if instance.pk and not raw:
+        instance._old_group_id, instance._old_image = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', 'image').first() or (None, None)
+    # Имя новой загрузки станет известно только после записи файла
+    # (оно по содержимому) — такую картинку сравнивает post_saved.
+    committed = getattr(instance.image, '_committed', True)
+    # Хранилище само берет ссылку на загруженный файл (см. posts.storage).
+    instance._image_reserved = not committed
+    if committed and instance._old_image != instance.image.name:
+        # Превью прежней картинки новой не подходит.
+        instance.image_placeholder = ''
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    bump_post_scopes(
+        instance, instance.group_id, getattr(instance, '_old_group_id', None)
+    )
+    if created:
+        counters.increment_stats(instance.author_id, 'posts_count')
+        feed.fan_out_post(instance)
+    old_image = getattr(instance, '_old_image', None) or None
+    new_image = instance.image.name or None
+    reserved = new_image and getattr(instance, '_image_reserved', False)
+    if new_image == old_image:
+        if reserved:
+            # Загружена та же картинка: ссылка поста на нее уже есть.
+            counters.release_image(new_image)
+        return
+    if instance.image_placeholder:
+        instance.image_placeholder = ''
+        Post.objects.filter(pk=instance.pk).update(image_placeholder='')
+    if new_image:
+        if not reserved:
+            counters.acquire_image(new_image)
+        thumbnails.queue_post_image(new_image)
+    if old_image:
+        release_image(old_image)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_post_scopes(instance, instance.group_id)
+    counters.decrement_stats(instance.author_id, 'posts_count')
+    if instance.image:
+        release_image(instance.image.name)
+
+
+@receiver(pre_save, sender=Comment)
+def comment_saving(sender, instance, raw=False, **kwargs):
+    # comments_count считает только активные комментарии: запоминаем,
+    # был ли комментарий активен до сохранения.
+    instance._was_active = False
+    if instance.pk and not raw:
+        instance._was_active = Comment.objects.filter(
+            pk=instance.pk, active=True
+        ).exists()
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    bump_versions(post_scope(instance.post_id))
+    delta = instance.active - getattr(instance, '_was_active', False)
+    if delta:
+        counters.change_comments_count(instance.post_id, delta)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    bump_versions(post_scope(instance.post_id))
+    if instance.active:
+        counters.change_comments_count(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    bump_versions(groups_scope(), group_scope(instance.pk))
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, raw=False, update_fields=None,
+               **kwargs):
+    # Имя автора выводится во всех лентах с его постами; вход
+    # пользователя (обновление last_login) ленты не меняет.
+    if created or raw or update_fields == frozenset(['last_login']):
+        return
+    group_ids = Post.objects.filter(author_id=instance.pk).values_list(
+        'group_id', flat=True
+    ).distinct().order_by()
+    bump_versions(
+        author_scope(instance.pk),
+        followers_scope(instance.pk),
+        user_scope(instance.pk),
+        index_scope(),
+        *(group_scope(group_id) for group_id in group_ids if group_id),
+    )
+
+
+def bump_follow_scopes(follow):
+    bump_versions(
+        follow_scope(follow.user_id),
+        stats_scope(follow.user_id),
+        stats_scope(follow.author_id),
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.increment_stats(instance.author_id, 'followers_count')
+        counters.increment_stats(instance.user_id, 'following_count')
+        feed.backfill_follow(instance.user_id, instance.author_id)
+        bump_follow_scopes(instance)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.decrement_stats(instance.author_id, 'followers_count')
+    counters.decrement_stats(instance.user_id, 'following_count')
+    feed.prune_follow(instance.user_id, instance.author_id)
+    bump_follow_scopes(instance)
@@ -0,0 +1,112 @@
+"""Хранилище картинок постов, адресуемое содержимым.
+
+Файл называется по SHA-256 своего содержимого: одинаковая картинка,
+загруженная в разные посты, хранится один раз, и миниатюры sorl,
+которые строятся по имени источника, у таких постов тоже общие.
+Хеш считается тем же проходом, которым файл пишется на диск.
+
+Файлы раскладываются по двум уровням каталогов из первых символов хеша
+(posts/ab/cd/abcd….jpg), чтобы ни в одном каталоге не копились сотни
+тысяч файлов. Миниатюры sorl раскладываются так же сами. Старые файлы
+переносит команда shard_media.
+
+Сколько постов ссылается на файл, хранит ImageBlob (см. counters);
+файл удаляется, когда ссылок не остается. Сохранение берет ссылку на
+файл раньше, чем решает, что такой файл уже есть, а удаление проверяет
+ссылки еще раз после того, как убрало файл из-под его имени (см.
+delete_unreferenced). Так загрузка файла, который одновременно
+удаляется, не остается без файла.
+"""
+import hashlib
+import os
+import re
+import tempfile
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+
+SHARDED_NAME = re.compile(
+    r'(?:^|/)(?P<first>[0-9a-f]{2})/(?P<second>[0-9a-f]{2})/'
+    r'(?P=first)(?P=second)[0-9a-f]{60}(?:\.[^/]*)?$'
+)
+
+
+def is_sharded(name):
+    """Лежит ли файл уже по пути из своего хеша."""
+    return bool(SHARDED_NAME.search(name))
+
+
+def sharded_name(directory, digest, extension):
+    return os.path.join(
+        directory, digest[:2], digest[2:4], digest + extension
+    )
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Имя выбирает _save по содержимому; одинаковые имена
+        # означают одинаковые файлы.
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        if is_sharded(name):
+            # Новая версия файла из того же хранилища: шарды от нового
+            # хеша, а не вложенные в прежние.
+            directory = os.path.dirname(os.path.dirname(directory))
+        extension = os.path.splitext(name)[1].lower()
+        full_directory = self.path(directory)
+        os.makedirs(full_directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(
+            dir=full_directory, prefix='.upload-', delete=False
+        ) as temporary:
+            try:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary.write(chunk)
+            except BaseException:
+                os.unlink(temporary.name)
+                raise
+        name = sharded_name(
+            directory, digest.hexdigest(), extension
+        ).replace('\\', '/')
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        self.reserve(name)
+        if os.path.exists(full_path):
+            os.unlink(temporary.name)
+        else:
+            # Атомарно: параллельная загрузка того же файла
+            # просто заменит его таким же.
+            os.replace(temporary.name, full_path)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        return name
+
+    def reserve(self, name):
+        # Импорт здесь: счетчики зависят от моделей, модели — от хранилища.
+        from .counters import reserve_image
+        reserve_image(name)
+
+    def delete_unreferenced(self, name, referenced):
+        """Удаляет файл, если ``referenced()`` ложно и после того, как файл
+        убран из-под своего имени. Возвращает True, если файла больше нет.
+        """
+        path = self.path(name)
+        aside = os.path.join(
+            os.path.dirname(path), f'.delete-{uuid.uuid4().hex}'
+        )
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return True
+        if referenced():
+            os.replace(aside, path)
+            return False
+        os.unlink(aside)
+        return True
+
+
+post_image_storage = ContentAddressedStorage()
@@ -0,0 +1,70 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from yatube.settings import POST_CARD_CACHE_TIMEOUT
+
+from ..cache import get_versions, groups_scope, post_scope, user_scope
+from ..thumbnails import prefetch_thumbnails
+
+
+register = template.Library()
+
+CARD_TEMPLATE = 'posts/includes/post_card.html'
+
+# Какие части карточки выводит каждая лента: (автор, группа).
+VARIANTS = {
+    'feed': (True, True),
+    'group': (True, False),
+    'profile': (False, True),
+}
+
+
+def _card_keys(posts, variant):
+    """Ключи карточек: пост, его автор и группы со своими версиями."""
+    scopes = [groups_scope()]
+    for post in posts:
+        scopes += [post_scope(post.pk), user_scope(post.author_id)]
+    versions = get_versions(*scopes)
+    groups_version = versions[0]
+    return [
+        'post_card:{}:{}:{}:{}:{}'.format(
+            variant, post.pk, post_version, user_version, groups_version
+        )
+        for post, post_version, user_version in zip(
+            posts, versions[1::2], versions[2::2]
+        )
+    ]
+
+
+@register.simple_tag
+def post_cards(posts, variant='feed'):
+    """Список HTML карточек постов страницы, собранный из кеша.
+
+    Все карточки страницы читаются одним get_many, отрисовываются
+    только отсутствующие в кеше, и те сохраняются одним set_many.
+    """
+    posts = list(posts)
+    show_author, show_group = VARIANTS[variant]
+    keys = _card_keys(posts, variant)
+    cached = cache.get_many(keys)
+    prefetch_thumbnails(
+        post.image.name for post, key in zip(posts, keys)
+        if key not in cached
+    )
+    missing = {}
+    cards = []
+    for post, key in zip(posts, keys):
+        card = cached.get(key)
+        if card is None:
+            card = render_to_string(CARD_TEMPLATE, {
+                'post': post,
+                'show_author': show_author,
+                'show_group': show_group,
+            })
+            missing[key] = card
+        cards.append(mark_safe(card))
+    if missing:
+        cache.set_many(missing, POST_CARD_CACHE_TIMEOUT)
+    return cards
@@ -0,0 +1,49 @@
+from django import template
+from sorl.thumbnail import get_thumbnail
+
+from yatube.settings import POST_IMAGE_WIDTHS
+
+from ..thumbnails import (PlaceholderImage, post_image_geometry,
+                          post_image_variants, prefetch_thumbnails)
+
+
+register = template.Library()
+
+# Ширина картинки в карточке: во весь экран на телефонах,
+# не шире колонки ленты на остальных.
+SIZES = '(max-width: 768px) 100vw, 960px'
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_image(post):
+    """Картинка поста с srcset по ширинам, WebP и размытым превью.
+
+    Еще не готовые варианты пропускаются (и ставятся в очередь);
+    если не готов ни один, показывается превью или заглушка.
+    """
+    prefetch_thumbnails([post.image.name])
+    srcset = {}
+    largest = None
+    for width, geometry, options in post_image_variants():
+        image = get_thumbnail(post.image, geometry, **options)
+        if isinstance(image, PlaceholderImage):
+            continue
+        image_format = options.get('format')
+        srcset.setdefault(image_format, []).append(f'{image.url} {width}w')
+        if image_format is None:
+            largest = image
+    geometry = post_image_geometry(max(POST_IMAGE_WIDTHS))
+    if largest is not None:
+        src = largest.url
+    else:
+        src = post.image_placeholder or PlaceholderImage(geometry).url
+    width, height = geometry.split('x')
+    return {
+        'src': src,
+        'srcset': ', '.join(srcset.get(None, ())),
+        'webp_srcset': ', '.join(srcset.get('WEBP', ())),
+        'sizes': SIZES,
+        'width': width,
+        'height': height,
+        'placeholder': post.image_placeholder,
+    }
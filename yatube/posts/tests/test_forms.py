@@ -1,13 +1,19 @@
+import io
 import shutil
 import tempfile
 from http import HTTPStatus
+from unittest import mock
 
 from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image, ImageFile
 
+from .. import forms, uploads
 from ..models import Group, Post, Comment
 
 
@@ -175,3 +181,66 @@ class PostFormTests(TestCase):
             active=True
         ).first()
         self.assertEqual(new_comment.text, form_data['text'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageUploadTests(TestCase):
+    """Загрузка картинки ограничена по размеру, а оригинал нормализуется."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='noname')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def jpeg(self, size, **options):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, 'JPEG', **options)
+        return buffer.getvalue()
+
+    def post_image(self, content):
+        return self.authorized_client.post(reverse('posts:post_create'), {
+            'text': 'Пост с картинкой',
+            'image': SimpleUploadedFile('photo.jpg', content, 'image/jpeg'),
+        })
+
+    def test_oversized_upload_rejected(self):
+        content = self.jpeg((64, 64))
+        with mock.patch.object(uploads, 'POST_IMAGE_MAX_UPLOAD_SIZE', 100), \
+                mock.patch.object(forms, 'POST_IMAGE_MAX_UPLOAD_SIZE', 100):
+            response = self.post_image(content)
+        self.assertFormError(
+            response, 'form', 'image', 'Файл больше 100\xa0байт.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    def test_too_many_pixels_rejected_before_decoding(self):
+        with mock.patch.object(forms, 'POST_IMAGE_MAX_PIXELS', 1000), \
+                mock.patch.object(ImageFile.ImageFile, 'load') as load:
+            response = self.post_image(self.jpeg((64, 64)))
+        load.assert_not_called()
+        self.assertEqual(
+            response.context['form'].errors['image'][0],
+            'Картинка слишком большая: не больше 0 мегапикселей.',
+        )
+
+    def test_original_downscaled_without_exif(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Phone'
+        name = default_storage.save(
+            'posts/photo.jpg',
+            ContentFile(self.jpeg((200, 100), exif=exif.tobytes())),
+        )
+        with mock.patch.object(uploads, 'POST_IMAGE_MAX_SIDE', 50):
+            new_name = uploads.normalize_image(name)
+        self.assertNotEqual(new_name, name)
+        with default_storage.open(new_name) as file:
+            image = Image.open(file)
+            self.assertEqual(image.size, (50, 25))
+            self.assertFalse(image.getexif())
+        # нормализованный файл второй раз не трогается
+        self.assertEqual(uploads.normalize_image(new_name), new_name)
@@ -1,7 +1,23 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.utils import timezone
 
-from ..models import Group, Post
+from ..benchmark import compare
+from ..cache import author_scope, get_versions, post_scope, stats_scope
+from ..counters import (recount_comments_chunk, recount_stats_chunk,
+                        stats_for)
+from ..dataset import dataset_records
+from ..models import (AuthorStats, Comment, FeedEntry, Follow, Group,
+                      ImageBlob, Post)
+from ..search import search_posts
 
 User = get_user_model()
 
@@ -78,3 +94,327 @@ class PostModelTest(TestCase):
                 self.assertEqual(
                     group._meta.get_field(field).help_text, expected_value
                 )
+
+
+class CountersTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.author = User.objects.create_user(username='writer')
+
+    def test_counters_follow_writes(self):
+        """Счетчики меняются при создании и удалении записей."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(stats_for(self.author).posts_count, 1)
+        self.assertEqual(stats_for(self.author).followers_count, 1)
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.user).following_count, 1
+        )
+        comment.delete()
+        follow.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        stats = AuthorStats.objects.get(user=self.author)
+        self.assertEqual((stats.posts_count, stats.followers_count), (1, 0))
+
+    def test_comments_count_ignores_inactive_comments(self):
+        """Скрытые комментарии не входят в comments_count."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Комментарий'
+        )
+        Comment.objects.create(
+            post=post, author=self.user, text='Скрытый', active=False
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        comment.active = False
+        comment.save()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        Comment.objects.filter(active=False).update(active=True)
+        call_command('recount_counters', workers=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+
+    def test_follow_is_unique(self):
+        """Повторная подписка на того же автора не сохраняется."""
+        Follow.objects.create(user=self.user, author=self.author)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.user, author=self.author)
+
+    def test_recount_counters_repairs_drift(self):
+        """Команда recount_counters исправляет счетчики
+        после массовых операций."""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Пост {number}')
+            for number in range(3)
+        )
+        post = Post.objects.first()
+        Comment.objects.bulk_create([
+            Comment(post=post, author=self.user, text='Комментарий'),
+        ])
+        call_command('recount_counters', workers=1, stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(
+            AuthorStats.objects.get(user=self.author).posts_count, 3
+        )
+
+    def test_recount_bumps_versions_of_fixed_rows(self):
+        """Исправленные счетчики сдвигают версии кеша своих страниц."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Comment.objects.bulk_create([
+            Comment(post=post, author=self.user, text='Комментарий'),
+        ])
+        Follow.objects.bulk_create([
+            Follow(user=self.user, author=self.author),
+        ])
+        scopes = [
+            stats_scope(self.author.pk), author_scope(self.author.pk),
+            stats_scope(self.user.pk), post_scope(post.pk),
+        ]
+        before = get_versions(*scopes)
+        recount_stats_chunk(self.author.pk, self.author.pk + 1)
+        recount_comments_chunk(post.pk, post.pk + 1)
+        after = get_versions(*scopes)
+        self.assertNotEqual(after[:2], before[:2])
+        self.assertEqual(after[2], before[2])
+        self.assertNotEqual(after[3], before[3])
+
+    def test_recount_keeps_concurrent_increments(self):
+        """Подписка между выборкой расхождений и UPDATE не теряется."""
+        Post.objects.bulk_create([Post(author=self.author, text='Пост')])
+        other = User.objects.create_user(username='other')
+        injected = []
+
+        def follow_before_update(execute, sql, params, many, context):
+            if sql.startswith('UPDATE "posts_authorstats"') and not injected:
+                injected.append(True)
+                Follow.objects.create(user=other, author=self.author)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(follow_before_update):
+            recount_stats_chunk(self.author.pk, self.author.pk + 1)
+        self.assertTrue(injected)
+        stats = AuthorStats.objects.get(user=self.author)
+        self.assertEqual((stats.posts_count, stats.followers_count), (1, 1))
+
+
+class ImportDataTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        return path
+
+    def test_import_data_loads_and_updates_derived_data(self):
+        """Загрузка создает записи пачками и в конце пересчитывает
+        счетчики и ленты, которые обычно ведут сигналы."""
+        reader = User.objects.create_user(username='reader')
+        records = [
+            {'model': 'user', 'username': 'leo', 'first_name': 'Лев'},
+            {'model': 'user', 'username': 'reader'},
+            {'model': 'group', 'slug': 'cats', 'title': 'Коты'},
+            {'model': 'post', 'id': 500, 'text': 'Старый пост',
+             'author': 'leo', 'group': 'cats',
+             'pub_date': '2020-01-02T03:04:05+00:00'},
+            {'model': 'post', 'id': 501, 'text': 'Пост без группы',
+             'author': 'leo'},
+            {'model': 'post', 'id': 502, 'text': 'Чужой пост',
+             'author': 'nobody'},
+            {'model': 'post', 'text': 'Пост без id', 'author': 'leo'},
+            {'model': 'comment', 'post': 500, 'author': 'reader',
+             'text': 'Комментарий'},
+            {'model': 'follow', 'user': 'reader', 'author': 'leo'},
+        ]
+        path = self.write('data.ndjson', '\n'.join(map(json.dumps, records)))
+        out = StringIO()
+        call_command(
+            'import_data', path, batch_size=2, chunk_size=3,
+            defer_indexes=True, stdout=out, stderr=StringIO(),
+        )
+        self.assertIn('post: загружено 2, пропущено 2', out.getvalue())
+        leo = User.objects.get(username='leo')
+        self.assertFalse(leo.has_usable_password())
+        post = Post.objects.get(pk=500)
+        self.assertEqual(post.group.slug, 'cats')
+        self.assertEqual(post.pub_date.year, 2020)
+        self.assertEqual(post.comments_count, 1)
+        stats = stats_for(leo)
+        self.assertEqual((stats.posts_count, stats.followers_count), (2, 1))
+        self.assertEqual(
+            FeedEntry.objects.filter(user=reader, author=leo).count(), 2
+        )
+        self.assertEqual(list(search_posts('старый')), [post])
+        # auto_now_add вернулся на место
+        self.assertEqual(
+            Post.objects.create(author=leo, text='Новый').pub_date.year,
+            timezone.now().year,
+        )
+
+    def test_import_data_again_skips_existing_records(self):
+        """Повторная загрузка того же файла ничего не дублирует и не
+        считает уже существующие записи загруженными."""
+        records = [
+            {'model': 'user', 'username': 'leo'},
+            {'model': 'user', 'username': 'reader'},
+            {'model': 'post', 'id': 500, 'text': 'Пост', 'author': 'leo'},
+            {'model': 'follow', 'user': 'reader', 'author': 'leo'},
+        ]
+        path = self.write('data.ndjson', '\n'.join(map(json.dumps, records)))
+        call_command('import_data', path, stdout=StringIO(), stderr=StringIO())
+        out = StringIO()
+        call_command('import_data', path, stdout=out, stderr=StringIO())
+        for model in ('user', 'post', 'follow'):
+            self.assertIn(f'{model}: загружено 0', out.getvalue())
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Follow.objects.count(), 1)
+        leo = User.objects.get(username='leo')
+        self.assertEqual(
+            (stats_for(leo).posts_count, stats_for(leo).followers_count),
+            (1, 1),
+        )
+
+    def test_import_data_reads_csv(self):
+        """Модель CSV-файла берется из его имени."""
+        User.objects.create_user(username='leo')
+        paths = [
+            self.write('users.csv', 'username,email\ntom,tom@example.com\n'),
+            self.write('follows.csv', 'user,author\nleo,tom\n'),
+        ]
+        call_command(
+            'import_data', *paths, stdout=StringIO(), stderr=StringIO()
+        )
+        tom = User.objects.get(email='tom@example.com')
+        self.assertTrue(
+            Follow.objects.filter(user__username='leo', author=tom).exists()
+        )
+
+    def test_export_import_round_trip(self):
+        """Выгрузка читается загрузкой обратно без потерь."""
+        author = User.objects.create_user(username='leo')
+        reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(title='Коты', slug='cats')
+        post = Post.objects.create(
+            author=author, text='Пост', group=group, image='posts/cat.gif'
+        )
+        Post.objects.filter(pk=post.pk).update(
+            image_placeholder='data:image/jpeg;base64,AAAA'
+        )
+        Comment.objects.create(post=post, author=reader, text='Мяу')
+        Comment.objects.create(
+            post=post, author=reader, text='Скрытый', active=False
+        )
+        Follow.objects.create(user=reader, author=author)
+        path = os.path.join(self.directory.name, 'dump.ndjson.gz')
+        call_command('export_data', output=path, batch_size=1)
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        call_command(
+            'import_data', path, stdout=StringIO(), stderr=StringIO()
+        )
+        post = Post.objects.get(pk=post.pk)
+        self.assertEqual(
+            (post.author.username, post.group.slug, post.comments_count),
+            ('leo', 'cats', 1),
+        )
+        self.assertEqual(
+            (post.image.name, post.image_placeholder),
+            ('posts/cat.gif', 'data:image/jpeg;base64,AAAA'),
+        )
+        self.assertEqual(
+            ImageBlob.objects.get(name='posts/cat.gif').ref_count, 1
+        )
+        self.assertFalse(Comment.objects.get(text='Скрытый').active)
+        call_command(
+            'import_data', path, stdout=StringIO(), stderr=StringIO()
+        )
+        self.assertEqual(Comment.objects.count(), 2)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 1)
+        self.assertTrue(
+            Follow.objects.filter(
+                user__username='reader', author__username='leo'
+            ).exists()
+        )
+
+
+class BenchmarkTests(TestCase):
+    SIZES = {
+        'users': 5, 'groups': 2, 'posts': 20, 'comments': 30, 'follows': 6,
+    }
+
+    def test_dataset_is_reproducible(self):
+        """Одно зерно — один и тот же набор, другое — другой."""
+        first = list(dataset_records(seed=1, **self.SIZES))
+        self.assertEqual(first, list(dataset_records(seed=1, **self.SIZES)))
+        self.assertNotEqual(
+            first, list(dataset_records(seed=2, **self.SIZES))
+        )
+        counts = {}
+        for record in first:
+            counts[record['model']] = counts.get(record['model'], 0) + 1
+        self.assertEqual(counts['post'], 20)
+        self.assertEqual(counts['comment'], 30)
+
+    def test_benchmark_views_compares_with_baseline(self):
+        """Второй прогон сравнивается с эталоном первого, набор
+        откатывается после замеров."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        baseline = os.path.join(directory.name, 'views.json')
+        options = dict(self.SIZES, repeat=1, baseline=baseline)
+        caches['shared'].set('site', 'kept')
+        out = StringIO()
+        call_command(
+            'benchmark_views', save_baseline=True, stdout=out, **options
+        )
+        self.assertIn('posts:index anonymous', out.getvalue())
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(caches['shared'].get('site'), 'kept')
+        with open(baseline, encoding='utf-8') as file:
+            saved = json.load(file)
+        self.assertEqual(saved['results']['posts:post_detail user']['status'],
+                         200)
+        call_command(
+            'benchmark_views', check_latency=True, tolerance=100,
+            stdout=StringIO(), **options
+        )
+        with self.assertRaisesMessage(CommandError, 'другими параметрами'):
+            call_command(
+                'benchmark_views', stdout=StringIO(),
+                **dict(options, repeat=2),
+            )
+
+    def test_compare_reports_extra_queries(self):
+        baseline = {'page': {'status': 200, 'queries': 2, 'p95': 10}}
+        self.assertEqual(compare(
+            {'page': {'status': 200, 'queries': 2, 'p95': 12}}, baseline
+        ), [])
+        self.assertEqual(compare(
+            {'page': {'status': 200, 'queries': 3, 'p95': 10}}, baseline
+        ), ['page: запросов 3, в эталоне 2'])
+
+    def test_compare_checks_latency_only_on_request(self):
+        """Задержка с другой машины не регрессия, пока ее не просят
+        сравнить."""
+        baseline = {'page': {'status': 200, 'queries': 2, 'p95': 10}}
+        slow = {'page': {'status': 200, 'queries': 2, 'p95': 100}}
+        self.assertEqual(compare(slow, baseline), [])
+        self.assertEqual(
+            compare(slow, baseline, check_latency=True),
+            ['page: p95 100 мс, в эталоне 10 мс'],
+        )
@@ -1,18 +1,47 @@
+import contextlib
+import gzip
+import io
+import json
 import math
+import os
 import shutil
 import tempfile
+from unittest import mock
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import QueryDict
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
 
-from yatube.settings import NUMBER_OF_POSTS_PER_PAGE
+from yatube.settings import (COMMENTS_PER_PAGE, NUMBER_OF_POSTS_PER_PAGE,
+                             THUMBNAIL_LRU_CHECK_INTERVAL)
 
-from ..models import Group, Post
+from .. import feed, load, paginators, thumbnails
+from ..cache import (VERSION_CACHE, bump_versions, get_version, index_scope,
+                     post_scope, version_time)
+from ..feed import FEED_ORDERING, feed_for
+from ..kvstore import LRUKVStore
+from ..models import (Comment, FeedEntry, Follow, Group, ImageBlob,
+                      PendingFanOut, Post)
+from ..paginators import CursorPaginator
+from ..search import SEARCH_ORDERING, search_posts
+from ..storage import is_sharded, post_image_storage
+from ..templatetags.post_cards import post_cards
+from .utils import assert_max_queries
 
 
 User = get_user_model()
@@ -201,6 +230,7 @@ class PostPagesTests(TestCase):
 
 class PaginatorViewsTests(TestCase):
     def setUp(self):
+        cache.clear()
         self.number_posts = 15
         self.user = User.objects.create_user(username='noname')
         self.group = Group.objects.create(
@@ -253,6 +283,91 @@ class PaginatorViewsTests(TestCase):
                     list
                 )
 
+    def test_cursor_paginator_walks_all_posts(self):
+        """Курсор проходит выдачу без пропусков и повторов
+        в обе стороны."""
+        paginator = CursorPaginator(Post.objects.all(), 4, offset_pages=1)
+        page = paginator.page_for_request()
+        pages = [page]
+        while page.has_next():
+            page = paginator.page_for_request(cursor=page.next_cursor)
+            pages.append(page)
+        seen = [post.pk for page in pages for post in page]
+        expected = list(
+            Post.objects.order_by('-pub_date', '-id').values_list(
+                'pk', flat=True
+            )
+        )
+        self.assertEqual(seen, expected)
+        self.assertEqual([page.number for page in pages], [1, 2, 3, 4])
+        back = paginator.page_for_request(cursor=pages[-1].previous_cursor)
+        self.assertEqual(list(back), list(pages[-2]))
+        self.assertEqual(back.number, 3)
+
+    def test_window_is_bounded_and_reaches_last_page(self):
+        """Окно ссылок не растет с числом страниц, последняя страница
+        открывается курсором."""
+        paginator = CursorPaginator(Post.objects.all(), 2, offset_pages=3)
+
+        def follow(query):
+            params = QueryDict(query)
+            return paginator.page_for_request(
+                params.get('page'), params.get('cursor')
+            )
+
+        page = paginator.page_for_request()
+        self.assertEqual([link.number for link in page.window], [1, 2, 3])
+        while page.number < 5:
+            page = follow(page.next_query)
+        self.assertEqual(
+            [link.number for link in page.window], [3, 4, 5, 6]
+        )
+        last = follow(page.last_query)
+        self.assertEqual(last.number, 8)
+        self.assertFalse(last.has_next())
+        self.assertEqual([post.text for post in last], [self.posts[0].text])
+
+    def test_count_is_cached_until_feed_changes(self):
+        """Число постов кешируется и сбрасывается новым постом."""
+        def count():
+            return CursorPaginator(
+                Post.objects.all(), 10, count_scope=index_scope()
+            ).count
+
+        self.assertEqual(count(), self.number_posts)
+        with self.assertNumQueries(0):
+            self.assertEqual(count(), self.number_posts)
+        Post.objects.create(author=self.user, text='Еще пост')
+        self.assertEqual(count(), self.number_posts + 1)
+
+    def test_count_is_approximate_past_limit(self):
+        """Выше порога COUNT(*) не дочитывает таблицу."""
+        with mock.patch.object(paginators, 'PAGINATOR_COUNT_LIMIT', 10):
+            paginator = CursorPaginator(Post.objects.all(), 2)
+            self.assertEqual(paginator.count, 10)
+            self.assertTrue(paginator.count_is_approximate)
+            page = paginator.page_for_request()
+            self.assertIsNone(page.last_query)
+
+    def test_approximate_count_hides_last_page_link(self):
+        """Ссылки на последнюю страницу нет, даже если count еще
+        не считали до обращения к ней."""
+        with mock.patch.object(paginators, 'PAGINATOR_COUNT_LIMIT', 10):
+            page = CursorPaginator(
+                Post.objects.all(), 2, offset_pages=3
+            ).page_for_request()
+            self.assertIsNone(page.last_query)
+            self.assertEqual(
+                [link.number for link in page.window], [1, 2, 3]
+            )
+
+    def test_broken_cursor_opens_first_page(self):
+        """Битый курсор не ломает страницу, а открывает первую."""
+        response = self.client.get(
+            reverse('posts:index') + '?cursor=broken'
+        )
+        self.assertEqual(response.context['page_obj'].number, 1)
+
 
 class CacheViewsTest(TestCase):
     def setUp(self):
@@ -266,7 +381,7 @@ class CacheViewsTest(TestCase):
         )
 
     def test_cache_index_page(self):
-        """На странице index работает кеширование данных."""
+        """На странице index кеш живет до изменения ленты."""
         # кеш очищен
         cache.clear()
         # пост создан
@@ -279,19 +394,947 @@ class CacheViewsTest(TestCase):
         response = self.authorized_client.get(reverse('posts:index'))
         # получен контент
         objects = response.content
-        # удален пост
-        post.delete()
-        # второй запрос
+        # текст изменен в обход сигналов: лента об этом не знает
+        Post.objects.filter(pk=post.pk).update(text='Тихая правка')
         response1 = self.authorized_client.get(reverse('posts:index'))
-        # получен контент
-        objects1 = response1.content
-        # проверка наличия поста
-        self.assertEqual(objects, objects1)
-        # кеш очищен
-        cache.clear()
-        # третий запрос
+        # проверка, что отдан кеш
+        self.assertEqual(objects, response1.content)
+        # удален пост: версия ленты сдвинута сигналом
+        post.delete()
         response2 = self.authorized_client.get(reverse('posts:index'))
-        # получен контент
-        objects2 = response2.content
-        # проверка отсутствия поста
-        self.assertNotEqual(objects, objects2)
+        # проверка отсутствия поста без очистки кеша
+        self.assertNotEqual(objects, response2.content)
+        self.assertNotContains(response2, 'Тестовый пост')
+
+    def test_version_bump_reaches_other_processes(self):
+        """Сдвиг версии в другом процессе (воркере сайта или команде)
+        сбрасывает кеш ленты и в этом."""
+        cache.clear()
+        post = Post.objects.create(author=self.user, text='Тестовый пост')
+        self.authorized_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=post.pk).update(text='Правка из команды')
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                bump_versions(index_scope(), post_scope(post.pk))
+                os.write(write, get_version(index_scope()).encode())
+                code = 0
+            finally:
+                os._exit(code)
+        os.close(write)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(status, 0)
+        with os.fdopen(read) as pipe:
+            self.assertEqual(pipe.read(), get_version(index_scope()))
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Правка из команды')
+
+    def test_version_bumped_between_add_and_get(self):
+        """Версия, которую другой поток создал и тут же сдвинул, не
+        превращается в None."""
+        versions = caches[VERSION_CACHE]
+        bump_versions(index_scope())
+        with mock.patch.object(versions, 'add', return_value=False):
+            version = get_version(index_scope())
+        self.assertIsNotNone(version_time(version))
+
+    def test_post_cards_reused_until_post_or_author_changes(self):
+        """Карточка поста берется из кеша, пока не изменятся пост,
+        автор или группы."""
+        cache.clear()
+        post = Post.objects.create(
+            author=self.user, text='Исходный текст', group=self.group
+        )
+        self.assertIn('Исходный текст', ''.join(post_cards([post])))
+        Post.objects.filter(pk=post.pk).update(text='Тихая правка')
+        post.refresh_from_db()
+        self.assertIn('Исходный текст', ''.join(post_cards([post])))
+        post.text = 'Правка автора'
+        post.save()
+        self.assertIn('Правка автора', ''.join(post_cards([post])))
+        self.user.first_name = 'Иван'
+        self.user.save()
+        post.refresh_from_db()
+        self.assertIn('Иван', ''.join(post_cards([post])))
+        self.group.title = 'Новое название'
+        self.group.save()
+        post.refresh_from_db()
+        self.assertIn('Новое название', ''.join(post_cards([post])))
+
+    def test_feed_pages_invalidated_by_writes(self):
+        """Ленты группы, автора и подписок сбрасываются своими событиями."""
+        cache.clear()
+        reader = User.objects.create_user(username='reader')
+        reader_client = Client()
+        reader_client.force_login(reader)
+        Follow.objects.create(user=reader, author=self.user)
+        urls = (
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username}),
+            reverse('posts:follow_index'),
+        )
+        post = Post.objects.create(
+            author=self.user, text='Первый пост', group=self.group
+        )
+        for url in urls:
+            reader_client.get(url)
+        Post.objects.filter(pk=post.pk).update(text='Тихая правка')
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertContains(reader_client.get(url), 'Первый пост')
+        Post.objects.create(
+            author=self.user, text='Второй пост', group=self.group
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = reader_client.get(url)
+                self.assertContains(response, 'Второй пост')
+                # карточка первого поста переиспользована из кеша
+                self.assertContains(response, 'Первый пост')
+
+
+class PageCacheTests(TestCase):
+    """Анонимные страницы отдаются из кеша до записи, которая их меняет."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        self.post = Post.objects.create(
+            author=self.author, text='Тестовый пост', group=self.group
+        )
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+
+    def test_anonymous_pages_served_from_cache(self):
+        """Повторный анонимный запрос не выполняет view: остается только
+        поиск объекта страницы для ее версий."""
+        for url, queries in zip(self.urls, (0, 1, 1, 1)):
+            with self.subTest(url=url):
+                first = self.client.get(url)
+                self.assertEqual(first['X-Page-Cache'], 'miss')
+                with self.assertNumQueries(queries):
+                    second = self.client.get(url)
+                self.assertEqual(second['X-Page-Cache'], 'hit')
+                self.assertEqual(first.content, second.content)
+
+    def test_cached_page_is_gzipped_for_capable_clients(self):
+        url = self.urls[0]
+        content = self.client.get(url).content
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), content)
+        self.assertEqual(self.client.get(url).content, content)
+
+    def test_authorized_users_bypass_cache(self):
+        self.client.get(self.urls[0])
+        response = self.author_client.get(self.urls[0])
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertContains(response, 'Новая запись')
+
+    def test_foreign_params_bypass_cache(self):
+        response = self.client.get(self.urls[0], {'utm': 'x'})
+        self.assertFalse(response.has_header('X-Page-Cache'))
+
+    def test_writes_purge_cached_pages(self):
+        """Пост, правка, комментарий и подписка сбрасывают свои страницы."""
+        for url in self.urls:
+            self.client.get(url)
+        self.author_client.post(
+            reverse('posts:post_create'),
+            {'text': 'Новый пост', 'group': self.group.pk},
+        )
+        for url in self.urls[:3]:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Новый пост')
+        self.author_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': self.post.pk}),
+            {'text': 'Исправленный пост', 'group': self.group.pk},
+        )
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertContains(self.client.get(url), 'Исправленный пост')
+        self.reader_client.post(
+            reverse('posts:add_comment', kwargs={'post_id': self.post.pk}),
+            {'text': 'Новый комментарий'},
+        )
+        self.assertContains(self.client.get(self.urls[3]), 'Новый комментарий')
+        profile = self.client.get(self.urls[2])
+        self.reader_client.get(
+            reverse('posts:profile_follow', kwargs={'username': 'author'})
+        )
+        self.assertNotEqual(self.client.get(self.urls[2]).content,
+                            profile.content)
+
+
+class ConditionalGetTests(TestCase):
+    """Неизменившиеся страницы отдаются ответом 304."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.post = Post.objects.create(author=self.author, text='Пост')
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+
+    def test_unchanged_pages_are_not_modified(self):
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for client in (self.client, self.author_client):
+            for url in urls:
+                with self.subTest(url=url):
+                    # первый ответ выдает CSRF-cookie, она входит в ETag
+                    client.get(url)
+                    response = client.get(url)
+                    self.assertTrue(response.has_header('Last-Modified'))
+                    not_modified = client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                    self.assertEqual(not_modified.status_code, 304)
+                    not_modified = client.get(
+                        url,
+                        HTTP_IF_MODIFIED_SINCE=response['Last-Modified'],
+                    )
+                    self.assertEqual(not_modified.status_code, 304)
+
+    def test_writes_change_validators(self):
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий'
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Комментарий')
+
+    def test_validators_differ_between_users(self):
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        response = self.author_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTests(TestCase):
+    """Миниатюры создаются в фоне, до этого карточка показывает заглушку."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Картинки с одинаковым содержимым в разных тестах получают одно
+        # имя: записи sorl и очередь процесса не должны пережить откат.
+        cache.clear()
+        default.kvstore.cache.clear()
+        default.kvstore.invalidate()
+        thumbnails._pending.clear()
+        self.author = User.objects.create_user(username='author')
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        small_gif = (
+            b'\x47\x49\x46\x38\x39\x61\x02\x00'
+            b'\x01\x00\x80\x00\x00\x00\x00\x00'
+            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+            b'\x0A\x00\x3B'
+        )
+        self.uploaded = SimpleUploadedFile(
+            name='thumb.gif', content=small_gif, content_type='image/gif'
+        )
+
+    def test_upload_queues_thumbnail_and_shows_placeholder(self):
+        with mock.patch.object(thumbnails, '_submit') as submit:
+            with self.capture_on_commit() as callbacks:
+                self.author_client.post(
+                    reverse('posts:post_create'),
+                    {'text': 'Пост с картинкой', 'image': self.uploaded},
+                )
+            for callback in callbacks:
+                callback()
+        post = Post.objects.get(text='Пост с картинкой')
+        submit.assert_called_once()
+        self.assertEqual(submit.call_args[0][0][0], post.image.name)
+        response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnails.PLACEHOLDER)
+        # миниатюра готова: версии лент сдвинуты, заглушки больше нет
+        thumbnail_name = thumbnails.generate_thumbnail(post.image.name)
+        thumbnails.forget_missing(thumbnail_name)
+        thumbnails.thumbnails_ready([post.image.name])
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, thumbnails.PLACEHOLDER)
+        self.assertContains(response, thumbnail_name)
+
+    def test_rolled_back_upload_leaves_no_pending_task(self):
+        """Задача из откаченной транзакции не висит в очереди и не
+        мешает поставить такую же позже."""
+        with mock.patch.object(thumbnails, '_submit') as submit:
+            with contextlib.suppress(IntegrityError), transaction.atomic():
+                thumbnails.queue_post_image('posts/rolled-back.gif')
+                raise IntegrityError
+            self.assertEqual(thumbnails._pending, set())
+            with self.capture_on_commit() as callbacks:
+                thumbnails.queue_post_image('posts/rolled-back.gif')
+                thumbnails.queue_post_image('posts/rolled-back.gif')
+            for callback in callbacks:
+                callback()
+        submit.assert_called_once()
+        self.assertEqual(
+            thumbnails._pending, {('posts/rolled-back.gif', 'post_image')}
+        )
+
+    def test_backfill_command_generates_thumbnails(self):
+        with mock.patch.object(thumbnails, 'queue_thumbnail'):
+            post = Post.objects.create(
+                author=self.author, text='Пост', image=self.uploaded
+            )
+        out = io.StringIO()
+        call_command('backfill_thumbnails', workers=1, stdout=out)
+        self.assertIn('Картинок обработано: 1', out.getvalue())
+        post.refresh_from_db()
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,')
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        )
+        self.assertNotContains(response, thumbnails.PLACEHOLDER)
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, '320w')
+        self.assertContains(response, 'loading="lazy"')
+        self.assertContains(response, post.image_placeholder)
+
+    def test_page_thumbnails_prefetched_in_one_query(self):
+        """Записи миниатюр страницы читаются из базы одним запросом,
+        повторно — из LRU процесса."""
+        with mock.patch.object(thumbnails, 'queue_thumbnail'):
+            for number in range(3):
+                post = Post.objects.create(
+                    author=self.author, text=f'Пост {number}',
+                    image=self.uploaded,
+                )
+                thumbnails.generate_thumbnail(post.image.name)
+        cache.clear()
+        default.kvstore.cache.clear()
+        default.kvstore.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, thumbnails.PLACEHOLDER)
+        kv_queries = [
+            query for query in queries
+            if 'thumbnail_kvstore' in query['sql']
+        ]
+        self.assertEqual(len(kv_queries), 1)
+        posts = list(Post.objects.select_related('author', 'group'))
+        with CaptureQueriesContext(connection) as queries:
+            # другой вид карточек: отрисовываются заново
+            post_cards(posts, 'group')
+        self.assertFalse(
+            any('thumbnail_kvstore' in query['sql'] for query in queries)
+        )
+
+    def test_deleted_keys_invalidate_other_processes(self):
+        """Удаление записи в одном процессе сбрасывает LRU другого."""
+        with mock.patch.object(thumbnails, 'queue_thumbnail'):
+            post = Post.objects.create(
+                author=self.author, text='Пост', image=self.uploaded
+            )
+        thumbnail = thumbnails.generate_thumbnail(post.image.name)
+        key = ImageFile(thumbnail, default.storage).key
+        worker, other = LRUKVStore(), LRUKVStore()
+        other.prefetch([key])
+        self.assertIsNotNone(other._recall(add_prefix(key)))
+        worker.delete(ImageFile(post.image))
+        other.prefetch([])
+        other.prefetch([key])
+        self.assertIsNone(other._recall(add_prefix(key)))
+
+    def test_generation_is_shared_between_processes(self):
+        """Новое поколение из другого процесса сбрасывает LRU этого."""
+        with mock.patch.object(thumbnails, 'queue_thumbnail'):
+            post = Post.objects.create(
+                author=self.author, text='Пост', image=self.uploaded
+            )
+        thumbnail = thumbnails.generate_thumbnail(post.image.name)
+        key = ImageFile(thumbnail, default.storage).key
+        store = LRUKVStore()
+        store.prefetch([key])
+        self.assertIsNotNone(store._recall(add_prefix(key)))
+        pid = os.fork()
+        if pid == 0:
+            try:
+                LRUKVStore().invalidate()
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        store._checked_at -= THUMBNAIL_LRU_CHECK_INTERVAL
+        store._sync_generation()
+        self.assertIsNone(store._recall(add_prefix(key)))
+
+    def test_same_image_stored_once(self):
+        """Одинаковые картинки делят файл и миниатюры; файл удаляется
+        вместе с последним постом."""
+        content = self.uploaded.read()
+        first, second = [
+            Post.objects.create(
+                author=self.author, text=f'Пост {number}',
+                image=SimpleUploadedFile(
+                    name=f'copy{number}.GIF',
+                    content=content,
+                    content_type='image/gif',
+                ),
+            )
+            for number in range(2)
+        ]
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.endswith('.gif'))
+        self.assertEqual(
+            ImageBlob.objects.get(name=first.image.name).ref_count, 2
+        )
+        thumbnail = thumbnails.generate_thumbnail(first.image.name)
+        self.assertEqual(
+            thumbnails.QueuedThumbnailBackend().get_thumbnail(
+                second.image, thumbnails.POST_THUMBNAIL_GEOMETRY,
+                **thumbnails.POST_THUMBNAIL_OPTIONS
+            ).name,
+            thumbnail,
+        )
+        name = first.image.name
+        with self.capture_on_commit() as callbacks:
+            first.delete()
+        self.assertEqual(callbacks, [])
+        self.assertTrue(post_image_storage.exists(name))
+        with self.capture_on_commit() as callbacks:
+            second.delete()
+        for callback in callbacks:
+            callback()
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+        self.assertFalse(post_image_storage.exists(name))
+        self.assertFalse(default.storage.exists(thumbnail))
+
+    def test_upload_survives_concurrent_drop(self):
+        """Файл, который удаляется, пока ту же картинку загружают снова,
+        остается на месте."""
+        content = self.uploaded.read()
+        first = Post.objects.create(
+            author=self.author, text='Пост', image=self.uploaded
+        )
+        name = first.image.name
+        with self.capture_on_commit() as drops:
+            first.delete()
+        second = Post.objects.create(
+            author=self.author, text='Снова',
+            image=SimpleUploadedFile('again.gif', content, 'image/gif'),
+        )
+        self.assertEqual(second.image.name, name)
+        for drop in drops:
+            drop()
+        self.assertTrue(post_image_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+        def upload_meanwhile():
+            # Та же картинка загружается, пока файл убран из-под имени.
+            post_image_storage.save('posts/again.gif', ContentFile(content))
+            return ImageBlob.objects.filter(name=name).exists()
+
+        second.delete()
+        self.assertFalse(
+            post_image_storage.delete_unreferenced(name, upload_meanwhile)
+        )
+        self.assertTrue(post_image_storage.exists(name))
+        # Ссылка, которую взяла новая загрузка.
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+    def test_shard_media_moves_flat_images(self):
+        """Картинки из общего каталога переносятся в каталоги по хешу;
+        повторный запуск ничего не делает."""
+        self.uploaded.seek(0)
+        legacy = default_storage.save('posts/legacy.gif', self.uploaded)
+        posts = [
+            Post.objects.create(
+                author=self.author, text=f'Пост {number}', image=legacy
+            )
+            for number in range(2)
+        ]
+        out = io.StringIO()
+        call_command('shard_media', workers=1, stdout=out)
+        self.assertIn('Картинок перенесено: 1', out.getvalue())
+        for post in posts:
+            post.refresh_from_db()
+        name = posts[0].image.name
+        self.assertEqual(posts[1].image.name, name)
+        self.assertTrue(is_sharded(name))
+        self.assertRegex(name, r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/')
+        self.assertTrue(post_image_storage.exists(name))
+        self.assertFalse(default_storage.exists(legacy))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 2)
+        self.assertFalse(ImageBlob.objects.filter(name=legacy).exists())
+        out = io.StringIO()
+        call_command('shard_media', workers=1, stdout=out)
+        self.assertIn('Картинок перенесено: 0', out.getvalue())
+
+    @contextlib.contextmanager
+    def capture_on_commit(self):
+        callbacks = []
+        with mock.patch.object(
+            transaction, 'on_commit', side_effect=callbacks.append
+        ):
+            yield callbacks
+
+
+class FollowFeedTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='follower')
+        self.author = User.objects.create_user(username='author')
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.old_post = Post.objects.create(
+            author=self.author,
+            text='Пост до подписки',
+        )
+
+    def feed_posts(self):
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        return list(response.context['page_obj'])
+
+    def test_follow_backfills_and_unfollow_prunes_feed(self):
+        """Подписка добавляет посты автора в ленту, отписка убирает."""
+        self.authorized_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author.username}
+        ))
+        self.assertEqual(self.feed_posts(), [self.old_post])
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertEqual(self.feed_posts(), [new_post, self.old_post])
+        self.authorized_client.get(reverse(
+            'posts:profile_unfollow',
+            kwargs={'username': self.author.username}
+        ))
+        self.assertEqual(self.feed_posts(), [])
+        self.assertFalse(FeedEntry.objects.filter(user=self.user).exists())
+
+    def test_follow_backfills_every_post_in_batches(self):
+        """При подписке в ленту попадают все посты автора, а не только
+        последние."""
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'Пост {number}')
+            for number in range(5)
+        )
+        with mock.patch.object(feed, 'FEED_FANOUT_BATCH_SIZE', 2):
+            Follow.objects.create(user=self.user, author=self.author)
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.user).count(),
+            Post.objects.filter(author=self.author).count(),
+        )
+        FeedEntry.objects.all().delete()
+        with mock.patch.object(feed, 'FEED_FANOUT_BATCH_SIZE', 2):
+            feed.backfill_followers(self.author.pk)
+        self.assertEqual(FeedEntry.objects.filter(user=self.user).count(), 6)
+
+    def test_author_changes_reach_follower_feed(self):
+        """Правка имени автора и удаление его поста видны в ленте
+        подписчика, хотя лента закеширована."""
+        Follow.objects.create(user=self.user, author=self.author)
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertContains(response, self.author.username)
+        self.author.first_name = 'Переименованный'
+        self.author.save()
+        response = self.authorized_client.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'Переименованный')
+        self.old_post.delete()
+        self.assertEqual(self.feed_posts(), [])
+
+    def test_heavy_author_fans_out_after_commit(self):
+        """Пост автора с большим числом подписчиков
+        не раскладывается синхронно."""
+        Follow.objects.create(user=self.user, author=self.author)
+        with mock.patch.object(feed, 'FEED_FANOUT_SYNC_LIMIT', 0):
+            post = Post.objects.create(author=self.author, text='Пост')
+        self.assertNotIn(post, self.feed_posts())
+        feed.fan_out_post_in_batches(post.pk)
+        self.assertEqual(self.feed_posts(), [post, self.old_post])
+        self.assertFalse(PendingFanOut.objects.exists())
+
+    def test_pending_fan_out_survives_lost_thread(self):
+        """Рассылку, которую не закончил фоновый поток, дорассылает
+        команда fan_out_pending с сохраненного места."""
+        second = User.objects.create_user(username='second')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=second, author=self.author)
+        with mock.patch.object(feed, 'FEED_FANOUT_SYNC_LIMIT', 0), \
+                mock.patch.object(transaction, 'on_commit'):
+            post = Post.objects.create(author=self.author, text='Пост')
+        PendingFanOut.objects.filter(post=post).update(
+            last_user_id=self.user.pk
+        )
+        out = io.StringIO()
+        call_command('fan_out_pending', stdout=out)
+        self.assertIn('Дорассылок выполнено: 1', out.getvalue())
+        self.assertEqual(
+            list(FeedEntry.objects.filter(post=post).values_list(
+                'user_id', flat=True
+            )),
+            [second.pk],
+        )
+        self.assertFalse(PendingFanOut.objects.exists())
+
+
+class CommentPaginationTests(TestCase):
+    """Пост показывает первую страницу комментариев, остальные
+    догружаются по курсору."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.post = Post.objects.create(author=self.author, text='Пост')
+        for number in range(COMMENTS_PER_PAGE + 5):
+            Comment.objects.create(
+                post=self.post, author=self.author, text=f'Коммент {number}'
+            )
+        self.url = reverse(
+            'posts:post_comments', kwargs={'post_id': self.post.pk}
+        )
+
+    def test_post_detail_renders_first_page(self):
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        page = response.context['comments_page']
+        self.assertEqual(len(page), COMMENTS_PER_PAGE)
+        self.assertEqual(page[0].text, f'Коммент {COMMENTS_PER_PAGE + 4}')
+        self.assertTrue(page.has_next())
+        self.assertContains(response, f'{self.url}?cursor=')
+
+    def test_load_more_fragment_and_json(self):
+        first = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        ).context['comments_page']
+        with assert_max_queries(self, 2):
+            response = self.client.get(
+                self.url, {'cursor': first.next_cursor}
+            )
+        page = response.context['comments_page']
+        self.assertEqual(
+            [comment.text for comment in page],
+            [f'Коммент {number}' for number in range(4, -1, -1)],
+        )
+        self.assertNotContains(response, 'data-comments-more')
+        data = self.client.get(self.url, {'format': 'json'}).json()
+        self.assertEqual(len(data['comments']), COMMENTS_PER_PAGE)
+        self.assertEqual(data['comments'][0]['author'], 'author')
+        self.assertIn('format=json', data['next'])
+        data = self.client.get(data['next']).json()
+        self.assertEqual(len(data['comments']), 5)
+        self.assertIsNone(data['next'])
+
+    def test_missing_post_returns_404(self):
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0})
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ExportViewTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='staff', is_staff=True)
+        self.author = User.objects.create_user(username='author')
+        Post.objects.create(author=self.author, text='Пост, с запятой')
+        self.client.force_login(self.staff)
+        self.url = reverse('posts:export_data')
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_only_staff_can_export(self):
+        client = Client()
+        client.force_login(self.author)
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_export_streams_ndjson_csv_and_gzip(self):
+        response = self.client.get(self.url, {'model': 'post'})
+        self.assertTrue(response.streaming)
+        record = json.loads(self.content(response))
+        self.assertEqual(
+            (record['model'], record['author'], record['text']),
+            ('post', 'author', 'Пост, с запятой'),
+        )
+        response = self.client.get(
+            self.url, {'model': 'post', 'format': 'csv'}
+        )
+        self.assertEqual(
+            self.content(response).decode().splitlines()[1].split(',')[1:3],
+            ['"Пост', ' с запятой"'],
+        )
+        response = self.client.get(self.url, {'compress': 'gzip'})
+        self.assertIn('yatube.ndjson.gz', response['Content-Disposition'])
+        models = [
+            json.loads(line)['model']
+            for line in gzip.decompress(self.content(response)).splitlines()
+        ]
+        self.assertEqual(models, ['user', 'user', 'post'])
+        response = self.client.get(self.url, {'format': 'csv'})
+        self.assertEqual(response.status_code, 400)
+
+
+class QueryBudgetTests(TestCase):
+    """Число запросов списков постов не зависит от размера страницы."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.reader = User.objects.create_user(username='reader')
+        self.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.client.force_login(self.reader)
+
+    def add_posts(self, number):
+        for post_number in range(number):
+            Post.objects.create(
+                author=self.author,
+                group=self.group,
+                text=f'Пост {post_number}',
+            )
+
+    def test_list_views_fit_query_budget(self):
+        """Сессия, пользователь, страница постов, COUNT и запросы
+        самой страницы — без запроса на каждый пост. Группе и профилю
+        нужен еще id объекта для версий страницы (ETag), ленте подписок —
+        список авторов, на которых подписан пользователь."""
+        budgets = {
+            reverse('posts:index'): 4,
+            reverse('posts:group_posts', kwargs={'slug': self.group.slug}): 6,
+            reverse(
+                'posts:profile', kwargs={'username': self.author.username}
+            ): 6,
+            reverse('posts:follow_index'): 5,
+        }
+        for number in (1, NUMBER_OF_POSTS_PER_PAGE * 2):
+            self.add_posts(number)
+            for url, budget in budgets.items():
+                with self.subTest(url=url, posts=number):
+                    cache.clear()
+                    with assert_max_queries(self, budget):
+                        self.client.get(url)
+
+
+class QueryPlanTests(TestCase):
+    """Запросы лент читают индекс, а не сортируют всю таблицу."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader')
+        self.paginators = {
+            'post_pub_date_idx': CursorPaginator(
+                Post.objects.select_related('author', 'group'), 10
+            ),
+            'post_group_pub_date_idx': CursorPaginator(
+                Post.objects.filter(group_id=1).select_related('author'), 10
+            ),
+            'post_author_pub_date_idx': CursorPaginator(
+                Post.objects.filter(author_id=1).select_related('group'), 10
+            ),
+            'feed_user_pub_date_idx': CursorPaginator(
+                feed_for(self.user).select_related('author', 'group'), 10,
+                ordering=FEED_ORDERING,
+            ),
+        }
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_feed_pages_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Планы запросов проверяются на SQLite')
+        for index, paginator in self.paginators.items():
+            with self.subTest(index=index):
+                self.assertUsesIndex(
+                    paginator.object_list[:paginator.per_page + 1], index
+                )
+
+    def test_cursor_pages_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Планы запросов проверяются на SQLite')
+        post = Post.objects.create(author=self.user, text='Пост')
+        for index, paginator in self.paginators.items():
+            with self.subTest(index=index):
+                keyset = paginator._keyset_filter(
+                    [post.pub_date, post.pk], 'next'
+                )
+                self.assertUsesIndex(
+                    paginator.object_list.filter(keyset)[:11], index
+                )
+
+    def test_deep_cursor_page_costs_as_much_as_shallow(self):
+        """Страница по курсору в конце ленты читает индекс не дольше,
+        чем в начале: SQLite ищет позицию, а не идет к ней с начала."""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Работа запроса считается на SQLite')
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пост {number}')
+            for number in range(2000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "UPDATE posts_post SET pub_date = "
+                "datetime('2020-01-01', '+' || id || ' minutes')"
+            )
+        paginator = self.paginators['post_pub_date_idx']
+        posts = list(Post.objects.order_by(*paginator.ordering))
+        shallow, deep = (
+            self.vm_steps(paginator.object_list.filter(
+                paginator._keyset_filter([post.pub_date, post.pk], 'next')
+            )[:11])
+            for post in (posts[10], posts[-20])
+        )
+        self.assertLess(deep, shallow * 2 + 10)
+
+    def vm_steps(self, queryset):
+        """Сколько сотен шагов виртуальной машины SQLite занял запрос."""
+        steps = []
+        sqlite = connection.connection
+        sqlite.set_progress_handler(lambda: steps.append(1), 100)
+        try:
+            list(queryset)
+        finally:
+            sqlite.set_progress_handler(None, 100)
+        return len(steps)
+
+    def test_comments_use_index(self):
+        """Первая страница комментариев и страница по курсору, как их
+        читает post_comments, идут по индексу без сортировки."""
+        if connection.vendor != 'sqlite':
+            self.skipTest('Планы запросов проверяются на SQLite')
+        post = Post.objects.create(author=self.user, text='Пост')
+        Comment.objects.bulk_create(
+            Comment(post=post, author=self.user, text=f'Комментарий {number}')
+            for number in range(COMMENTS_PER_PAGE + 1)
+        )
+        url = reverse('posts:post_comments', args=[post.pk])
+        with CaptureQueriesContext(connection) as queries:
+            page = self.client.get(url, {'format': 'json'}).json()
+            self.client.get(page['next'])
+        selects = [
+            query['sql'] for query in queries.captured_queries
+            if query['sql'].startswith('SELECT')
+            and 'FROM "posts_comment"' in query['sql']
+        ]
+        self.assertEqual(len(selects), 2)
+        for sql in selects:
+            with self.subTest(sql=sql), connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = '\n'.join(str(row) for row in cursor.fetchall())
+                self.assertIn('comment_post_active_idx', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+
+class SearchViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='author')
+        self.match = Post.objects.create(
+            author=self.user, text='Котики захватили интернет'
+        )
+        self.other = Post.objects.create(
+            author=self.user, text='Собаки против'
+        )
+
+    def search(self, query):
+        response = self.client.get(reverse('posts:search'), {'q': query})
+        return list(response.context['page_obj'])
+
+    def test_search_finds_posts_and_follows_edits(self):
+        """Поиск находит посты, индекс следит за правкой и удалением."""
+        self.assertEqual(self.search('котики'), [self.match])
+        self.assertEqual(self.search('кот'), [self.match])
+        self.other.text = 'Котики и собаки'
+        self.other.save()
+        self.assertCountEqual(self.search('котики'), [self.match, self.other])
+        self.match.delete()
+        self.assertEqual(self.search('котики'), [self.other])
+        self.assertEqual(self.search('" OR NEAR('), [])
+        self.assertEqual(self.search(''), [])
+
+    def test_empty_search_opens_empty_page(self):
+        """Страница поиска без запроса открывается с пустой выдачей."""
+        response = self.client.get(reverse('posts:search'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context['page_obj']), [])
+
+    def test_search_is_ranked_and_paginated(self):
+        """Более релевантный пост выше, курсор сохраняет запрос."""
+        best = Post.objects.create(
+            author=self.user, text='котики котики котики'
+        )
+        paginator = CursorPaginator(
+            search_posts('котики'), 1,
+            ordering=SEARCH_ORDERING, offset_pages=1, params={'q': 'котики'}
+        )
+        first = paginator.page_for_request()
+        self.assertEqual(list(first), [best])
+        self.assertIn('q=', first.next_query)
+        second = paginator.page_for_request(cursor=first.next_cursor)
+        self.assertEqual(list(second), [self.match])
+
+
+class LoadTests(TransactionTestCase):
+    def test_load_run_serves_mixed_traffic(self):
+        """Вошедшие пользователи проходят CSRF и пишут посты и
+        комментарии, сводка разложена по именам адресов."""
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Group.objects.create(title='Коты', slug='cats')
+        Post.objects.create(author=author, text='Пост')
+        Follow.objects.create(user=reader, author=author)
+        traffic = load.Traffic(logged_in=1)
+        mix = dict(load.USER_MIX, **{'posts:add_comment': 50,
+                                     'posts:post_create': 50})
+        with mock.patch.object(load, 'USER_MIX', tuple(mix.items())):
+            with load.serve(WSGIHandler()) as address:
+                summary = load.run(address, traffic, concurrency=4,
+                                   duration=1)
+        self.assertGreater(summary['total']['requests'], 0)
+        self.assertEqual(summary['total']['errors'], 0)
+        self.assertIn('posts:follow_index', summary['urls'])
+        self.assertTrue(
+            Post.objects.filter(text__startswith='Пост под нагрузкой')
+            .exists()
+        )
+        self.assertTrue(Comment.objects.filter(author=reader).exists())
+
+    def test_summarize_counts_errors_per_url(self):
+        summary = load.summarize([
+            ('posts:index', 10, False),
+            ('posts:index', 30, True),
+            ('posts:search', 20, False),
+        ], elapsed=2)
+        index = summary['urls']['posts:index']
+        self.assertEqual(
+            (index['requests'], index['errors'], index['rps'], index['p95']),
+            (2, 1, 1, 30),
+        )
+        self.assertEqual(summary['total']['error_rate'], round(1 / 3, 4))
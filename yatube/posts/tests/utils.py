@@ -0,0 +1,19 @@
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+@contextmanager
+def assert_max_queries(testcase, budget):
+    """Падает, если блок выполнил больше budget запросов к базе."""
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    executed = len(context.captured_queries)
+    testcase.assertLessEqual(
+        executed, budget,
+        'Превышен бюджет запросов: {} > {}\n{}'.format(
+            executed, budget,
+            '\n'.join(query['sql'] for query in context.captured_queries)
+        )
+    )
@@ -0,0 +1,361 @@
+"""Миниатюры картинок постов в фоновом пуле процессов.
+
+Тег ``{% thumbnail %}`` работает через QueuedThumbnailBackend: если
+миниатюры еще нет в хранилище ключей sorl, он не режет картинку в запросе,
+а ставит задачу в локальный пул процессов и отдает заглушку. Когда
+миниатюра готова, версии лент с этим постом сдвигаются, и карточки
+перерисовываются уже с ней.
+
+Загруженная картинка поста сразу режется в пуле на все ширины
+POST_IMAGE_WIDTHS в исходном формате и в WebP, а в пост сохраняется
+крошечное размытое превью, которое шаблон показывает, пока грузится
+сама картинка.
+
+Исходники лежат в хранилище по содержимому (posts.storage), поэтому
+одинаковые картинки разных постов делят и файл, и миниатюры.
+"""
+import base64
+import io
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.db import connection, transaction
+from django.templatetags.static import static
+from PIL import Image, ImageFilter, ImageOps
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import DummyImageFile, ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+
+from core import metrics
+from core.timing import track
+from yatube.settings import POST_IMAGE_WIDTHS, THUMBNAIL_POOL_WORKERS
+
+from . import counters
+from .cache import (author_scope, bump_versions, followers_scope, group_scope,
+                    index_scope, post_scope)
+from .models import ImageBlob, Post
+from .storage import post_image_storage
+from .uploads import normalize_image
+
+
+# Самая крупная миниатюра карточки поста; остальные ширины —
+# POST_IMAGE_WIDTHS с тем же соотношением сторон.
+POST_THUMBNAIL_GEOMETRY = '960x339'
+POST_THUMBNAIL_OPTIONS = {'crop': 'center', 'upscale': True}
+POST_IMAGE_FORMATS = (None, 'WEBP')
+
+# Размытое превью: столько пикселей в ширину, качество JPEG.
+BLUR_WIDTH = 16
+BLUR_QUALITY = 40
+
+PLACEHOLDER = 'img/thumbnail-placeholder.svg'
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+class PlaceholderImage(DummyImageFile):
+    """Заглушка размера миниатюры, пока та готовится."""
+
+    @property
+    def url(self):
+        return static(PLACEHOLDER)
+
+
+def post_image_geometry(width):
+    full_width, full_height = map(int, POST_THUMBNAIL_GEOMETRY.split('x'))
+    return f'{width}x{round(width * full_height / full_width)}'
+
+
+def post_image_variants():
+    """Варианты картинки поста: (ширина, геометрия, опции sorl).
+
+    Формат None сохраняет формат исходника, WEBP — его копия в WebP.
+    """
+    for width in POST_IMAGE_WIDTHS:
+        for image_format in POST_IMAGE_FORMATS:
+            options = dict(POST_THUMBNAIL_OPTIONS)
+            if image_format:
+                options['format'] = image_format
+            yield width, post_image_geometry(width), options
+
+
+def source_image(file_):
+    """Исходник для sorl: имя картинки поста — в ее хранилище.
+
+    От хранилища зависят ключи sorl, поэтому строки и поля модели
+    должны давать один и тот же исходник.
+    """
+    if isinstance(file_, str):
+        return ImageFile(file_, post_image_storage)
+    return ImageFile(file_)
+
+
+def generate_thumbnail(name, geometry=POST_THUMBNAIL_GEOMETRY, options=None):
+    """Создает миниатюру сразу, в текущем процессе. Возвращает ее имя."""
+    options = dict(POST_THUMBNAIL_OPTIONS if options is None else options)
+    return ThumbnailBackend().get_thumbnail(
+        source_image(name), geometry, **options
+    ).name
+
+
+def blur_placeholder(name):
+    """Крошечная размытая копия картинки как data URI для CSS-фона."""
+    with post_image_storage.open(name) as file:
+        image = Image.open(file)
+        image.draft('RGB', (BLUR_WIDTH * 4, BLUR_WIDTH * 4))
+        image = ImageOps.fit(
+            image.convert('RGB'),
+            tuple(map(int, post_image_geometry(BLUR_WIDTH).split('x'))),
+        ).filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=BLUR_QUALITY)
+    encoded = base64.b64encode(buffer.getvalue()).decode()
+    return f'data:image/jpeg;base64,{encoded}'
+
+
+def make_thumbnail(name, geometry, options):
+    """Задача пула: одна миниатюра, запрошенная шаблоном."""
+    return name, name, [generate_thumbnail(name, geometry, options)], None
+
+
+def process_post_image(name):
+    """Задача пула: нормализованный оригинал, все варианты картинки
+    поста и размытое превью."""
+    new_name = normalize_image(name)
+    thumbnail_names = [
+        generate_thumbnail(new_name, geometry, options)
+        for _, geometry, options in post_image_variants()
+    ]
+    return name, new_name, thumbnail_names, blur_placeholder(new_name)
+
+
+def shard_image(name):
+    """Задача пула: копия картинки по пути с шардами (см. posts.storage)
+    и ее варианты, чтобы посты сразу показывались с миниатюрами."""
+    with post_image_storage.open(name) as file:
+        new_name = post_image_storage.save(name, file)
+    thumbnail_names = [
+        generate_thumbnail(new_name, geometry, options)
+        for _, geometry, options in post_image_variants()
+    ]
+    return name, new_name, thumbnail_names, None
+
+
+def image_processed(result):
+    """Публикует результат задачи пула в этом процессе."""
+    name, new_name, thumbnail_names, placeholder = result
+    if new_name != name:
+        # Ссылки всех постов с этим файлом переходят на новый.
+        moved = Post.objects.filter(image=name).update(image=new_name)
+        if moved:
+            counters.acquire_image(new_name, moved)
+            counters.release_image(name, moved)
+        # Ссылку, которую взяло сохранение нового файла, заменили
+        # ссылки постов.
+        counters.release_image(new_name)
+        drop_image(name)
+        drop_image(new_name)
+    for thumbnail_name in thumbnail_names:
+        forget_missing(thumbnail_name)
+    if placeholder:
+        Post.objects.filter(image=new_name).update(
+            image_placeholder=placeholder
+        )
+    thumbnails_ready([new_name])
+
+
+def make_pool(workers):
+    # spawn, а не fork: дочерним процессам не достаются
+    # соединения с базой и потоки родителя.
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup,
+    )
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = make_pool(THUMBNAIL_POOL_WORKERS)
+        return _executor
+
+
+def _submit(task, func, *args):
+    global _executor
+    try:
+        future = _get_executor().submit(func, *args)
+    except BrokenProcessPool:
+        # Пул упал (например, процесс убит): следующая задача
+        # поднимет новый, а эта повторится при следующем показе.
+        with _lock:
+            _executor = None
+            _pending.discard(task)
+            metrics.set_gauge('thumbnail_queue_depth', len(_pending))
+        return
+    future.add_done_callback(lambda future: _task_done(task, future))
+
+
+def _task_done(task, future):
+    with _lock:
+        _pending.discard(task)
+        metrics.set_gauge('thumbnail_queue_depth', len(_pending))
+    if future.exception() is None:
+        threading.Thread(
+            target=_publish_in_background,
+            args=(future.result(),),
+            daemon=True,
+        ).start()
+
+
+def _publish_in_background(result):
+    try:
+        image_processed(result)
+    finally:
+        connection.close()
+
+
+def _queue(task, func, *args):
+    """Ставит задачу в пул после коммита текущей транзакции.
+
+    Повторные задачи, пока такая же в работе, не дублируются. В работу
+    задача записывается только при коммите: после отката ее нет.
+    """
+    if not THUMBNAIL_POOL_WORKERS:
+        return
+    transaction.on_commit(lambda: _claim(task, func, *args))
+
+
+def _claim(task, func, *args):
+    with _lock:
+        if task in _pending:
+            return
+        _pending.add(task)
+        metrics.set_gauge('thumbnail_queue_depth', len(_pending))
+    _submit(task, func, *args)
+
+
+def queue_thumbnail(name, geometry=POST_THUMBNAIL_GEOMETRY, options=None):
+    options = dict(POST_THUMBNAIL_OPTIONS if options is None else options)
+    task = (name, geometry, tuple(sorted(options.items())))
+    _queue(task, make_thumbnail, name, geometry, options)
+
+
+def queue_post_image(name):
+    _queue((name, 'post_image'), process_post_image, name)
+
+
+def forget_missing(thumbnail_name):
+    """Убирает из кеша sorl отметку «миниатюры нет».
+
+    Хранилище ключей запоминает промах в кеше процесса; миниатюра,
+    созданная другим процессом, иначе так и не была бы найдена.
+    """
+    kv_cache = getattr(default.kvstore, 'cache', None)
+    if kv_cache is not None:
+        thumbnail = ImageFile(thumbnail_name, default.storage)
+        kv_cache.delete(add_prefix(thumbnail.key))
+
+
+def thumbnails_ready(names):
+    """Сдвигает версии лент постов, у которых готовы миниатюры."""
+    posts = Post.objects.filter(image__in=names).values_list(
+        'pk', 'author_id', 'group_id'
+    )
+    scopes = {index_scope()}
+    for post_id, author_id, group_id in posts:
+        scopes.update((
+            post_scope(post_id),
+            author_scope(author_id),
+            followers_scope(author_id),
+        ))
+        if group_id:
+            scopes.add(group_scope(group_id))
+    bump_versions(*scopes)
+
+
+def forget_image(name):
+    """Удаляет записи и файлы миниатюр прежней картинки поста."""
+    default.kvstore.delete(source_image(name))
+
+
+def drop_image(name):
+    """Удаляет файл картинки и ее миниатюры, если на него никто
+    не ссылается."""
+    def referenced():
+        return ImageBlob.objects.filter(name=name).exists()
+
+    if referenced() or not post_image_storage.delete_unreferenced(
+        name, referenced
+    ):
+        return
+    forget_image(name)
+
+
+def prefetch_thumbnails(names):
+    """Загружает записи всех вариантов картинок страницы в хранилище
+    ключей разом, чтобы шаблон не ходил за каждой по отдельности."""
+    prefetch = getattr(default.kvstore, 'prefetch', None)
+    if prefetch is None:
+        return
+    backend = QueuedThumbnailBackend()
+    keys = [
+        backend.thumbnail(name, geometry, options).key
+        for name in names if name
+        for _, geometry, options in post_image_variants()
+    ]
+    if keys:
+        with track('thumbnail'):
+            prefetch(keys)
+
+
+class QueuedThumbnailBackend(ThumbnailBackend):
+    """Backend sorl, который не создает миниатюры во время запроса."""
+
+    def _options(self, source, options):
+        # Те же умолчания, что у ThumbnailBackend.get_thumbnail: от них
+        # зависит имя файла миниатюры.
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail(self, file_, geometry_string, options):
+        """Файл миниатюры, которую создал бы get_thumbnail."""
+        source = source_image(file_)
+        name = self._get_thumbnail_filename(
+            source, geometry_string, self._options(source, options)
+        )
+        return ImageFile(name, default.storage)
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        with track('thumbnail'):
+            return self._get_thumbnail(file_, geometry_string, options)
+
+    def _get_thumbnail(self, file_, geometry_string, options):
+        if not THUMBNAIL_POOL_WORKERS:
+            return super().get_thumbnail(file_, geometry_string, **options)
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        cached = default.kvstore.get(
+            self.thumbnail(file_, geometry_string, options)
+        )
+        if cached:
+            return cached
+        queue_thumbnail(source_image(file_).name, geometry_string, options)
+        return PlaceholderImage(geometry_string)
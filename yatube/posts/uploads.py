@@ -0,0 +1,78 @@
+"""Загрузка картинок постов с ограниченной памятью.
+
+Файл всегда пишется на диск частями (в памяти процесса не копится), а
+после POST_IMAGE_MAX_UPLOAD_SIZE байт остаток тела только считается:
+размер файла остается настоящим, и форма отклонит его по размеру, не
+пытаясь разбирать обрезанную картинку.
+
+Сам оригинал нормализуется уже в пуле миниатюр (normalize_image): поворот
+по EXIF, удаление метаданных, уменьшение до POST_IMAGE_MAX_SIDE.
+"""
+import io
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image, ImageOps
+
+from yatube.settings import (POST_IMAGE_MAX_SIDE, POST_IMAGE_MAX_UPLOAD_SIZE,
+                             POST_IMAGE_QUALITY)
+
+from .storage import post_image_storage
+
+
+# Форматы, которые пережимаются; остальные (например, анимированный
+# GIF) хранятся как загружены.
+SAVE_OPTIONS = {
+    'JPEG': {'quality': POST_IMAGE_QUALITY, 'optimize': True,
+             'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': POST_IMAGE_QUALITY},
+}
+
+
+class BoundedUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > POST_IMAGE_MAX_UPLOAD_SIZE:
+            return None
+        return super().receive_data_chunk(raw_data, start)
+
+
+def _needs_normalizing(image):
+    return (
+        image.format in SAVE_OPTIONS
+        and not getattr(image, 'is_animated', False)
+        and (
+            max(image.size) > POST_IMAGE_MAX_SIDE
+            or 'exif' in image.info
+            or bool(image.getexif())
+        )
+    )
+
+
+def normalize_image(name):
+    """Поворачивает по EXIF, уменьшает и пережимает оригинал без
+    метаданных. Возвращает имя нового файла (или прежнее, если
+    менять нечего); старый файл удаляет вызывающий."""
+    with post_image_storage.open(name) as file:
+        image = Image.open(file)
+        if not _needs_normalizing(image):
+            return name
+        image_format = image.format
+        icc_profile = image.info.get('icc_profile')
+        # JPEG декодируется сразу в уменьшенном масштабе.
+        image.draft(image.mode, (POST_IMAGE_MAX_SIDE, POST_IMAGE_MAX_SIDE))
+        image = ImageOps.exif_transpose(image)
+    image.thumbnail((POST_IMAGE_MAX_SIDE, POST_IMAGE_MAX_SIDE), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    options = dict(SAVE_OPTIONS[image_format])
+    if icc_profile:
+        options['icc_profile'] = icc_profile
+    image.save(buffer, image_format, **options)
+    return post_image_storage.save(name, ContentFile(buffer.getvalue()))
@@ -12,6 +12,11 @@ urlpatterns = [
         views.index,
         name='index'
     ),
+    path(
+        'search/',
+        views.search,
+        name='search'
+    ),
     path(
         'group/<slug:slug>/',
         views.group_posts,
@@ -37,11 +42,21 @@ urlpatterns = [
         views.post_edit,
         name='post_edit'
     ),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     path(
         'posts/<int:post_id>/comment/',
         views.add_comment,
         name='add_comment'
     ),
+    path(
+        'export/',
+        views.export_data,
+        name='export_data'
+    ),
     path(
         'follow/',
         views.follow_index,
@@ -1,81 +1,229 @@
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.http import (Http404, HttpResponseBadRequest, JsonResponse,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 
-from yatube.settings import NUMBER_OF_POSTS_PER_PAGE
+from yatube.settings import COMMENTS_PER_PAGE, NUMBER_OF_POSTS_PER_PAGE
 
+from .cache import (author_scope, feed_version, group_scope, groups_scope,
+                    index_scope, post_scope, stats_scope)
+from . import export
+from .counters import stats_for
+from .feed import FEED_ORDERING, feed_for, feed_scopes
 from .forms import PostForm, CommentForm
-from .models import Group, Post, User, Follow
+from .models import Comment, Group, Post, User, Follow
+from .page_cache import anonymous_page_cache, conditional_page
+from .paginators import CursorPaginator
+from .search import SEARCH_ORDERING, search_posts
 
 
 User = get_user_model()
 
+COMMENT_ORDERING = ('-created', '-id')
 
-def method_paginator(queriset, request):
-    paginator = Paginator(queriset, NUMBER_OF_POSTS_PER_PAGE)
+
+def method_paginator(queriset, request, **kwargs):
+    paginator = CursorPaginator(queriset, NUMBER_OF_POSTS_PER_PAGE, **kwargs)
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    cursor = request.GET.get('cursor')
+    page_obj = paginator.page_for_request(page_number, cursor)
     return {
         'paginator': paginator,
         'page_number': page_number,
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        # Ключ страницы для кеша фрагментов.
+        'page_key': f'{page_obj.number}:{cursor or ""}',
     }
 
 
+def index_page_scopes(request):
+    return [index_scope(), groups_scope()]
+
+
+@conditional_page(index_page_scopes)
+@anonymous_page_cache(index_page_scopes)
 def index(request):
     template = 'posts/index.html'
-    posts = Post.objects.all()
-    context = method_paginator(posts, request)
+    posts = Post.objects.select_related('author', 'group')
+    context = method_paginator(posts, request, count_scope=index_scope())
+    context['feed_version'] = feed_version(index_scope())
+    return render(request, template, context)
+
+
+def search(request):
+    template = 'posts/search.html'
+    query = request.GET.get('q', '').strip()
+    posts = search_posts(query).select_related('author', 'group')
+    context = {
+        'query': query,
+    }
+    context.update(method_paginator(
+        posts, request,
+        ordering=SEARCH_ORDERING,
+        count_scope=index_scope(),
+        params={'q': query},
+    ))
     return render(request, template, context)
 
 
+def group_page_scopes(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    if group_id is None:
+        return None
+    return [group_scope(group_id), groups_scope()]
+
+
+@conditional_page(group_page_scopes)
+@anonymous_page_cache(group_page_scopes)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
+    posts = group.posts.select_related('author')
     context = {
         'group': group,
         'posts': posts,
+        'feed_version': feed_version(group_scope(group.pk)),
     }
-    context.update(method_paginator(posts, request))
+    context.update(
+        method_paginator(posts, request, count_scope=group_scope(group.pk))
+    )
     return render(request, template, context)
 
 
+def profile_page_scopes(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    return [author_scope(author_id), stats_scope(author_id), groups_scope()]
+
+
+@conditional_page(profile_page_scopes)
+@anonymous_page_cache(profile_page_scopes)
 def profile(request, username):
     template = 'posts/profile.html'
-    author = get_object_or_404(User, username=username)
-    posts = author.author_posts.all()
-    count = posts.count()
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    posts = author.author_posts.select_related('group')
+    stats = stats_for(author)
     following = request.user.is_authenticated and author.following.exists()
     context = {
         'author': author,
         'posts': posts,
-        'count': count,
+        'count': stats.posts_count,
+        'stats': stats,
         'following': following,
+        'feed_version': feed_version(author_scope(author.pk)),
     }
-    context.update(method_paginator(posts, request))
+    context.update(method_paginator(
+        posts, request,
+        count_scope=author_scope(author.pk),
+        known_count=stats.posts_count,
+    ))
     return render(request, template, context)
 
 
+def post_detail_page_scopes(request, post_id):
+    # Число постов автора на странице меняется вместе с его лентой.
+    author_id = Post.objects.filter(pk=post_id).values_list(
+        'author_id', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    return [post_scope(post_id), author_scope(author_id), groups_scope()]
+
+
+@conditional_page(post_detail_page_scopes)
+@anonymous_page_cache(post_detail_page_scopes, params=())
 def post_detail(request, post_id):
     form = CommentForm(
         request.POST or None,
         files=request.FILES or None
     )
     template = 'posts/post_detail.html'
-    post = get_object_or_404(Post, id=post_id)
-    count = post.author.author_posts.count()
-    comments = post.comments.filter(active=True)
+    post = get_object_or_404(
+        Post.objects.select_related('author__stats', 'group'), id=post_id
+    )
+    count = stats_for(post.author).posts_count
     context = {
         'post': post,
         'count': count,
         'form': form,
-        'comments': comments,
+        'post_id': post.pk,
+        'comments_page': comments_page(
+            post.pk, comments_count=post.comments_count
+        ),
     }
     return render(request, template, context)
 
 
+def comments_page(post_id, cursor=None, params=None, comments_count=None):
+    """Страница комментариев поста: первая или следующая по курсору.
+
+    Авторы приходят тем же запросом, что и комментарии.
+    """
+    paginator = CursorPaginator(
+        Comment.objects.filter(
+            post_id=post_id, active=True
+        ).select_related('author'),
+        COMMENTS_PER_PAGE,
+        ordering=COMMENT_ORDERING,
+        # Дальше первой страницы комментарии листаются только курсором.
+        offset_pages=1,
+        known_count=comments_count,
+        params=params,
+    )
+    return paginator.page_for_request(cursor=cursor)
+
+
+def comments_page_scopes(request, post_id):
+    if not Post.objects.filter(pk=post_id).exists():
+        return None
+    return [post_scope(post_id)]
+
+
+@conditional_page(comments_page_scopes)
+@anonymous_page_cache(comments_page_scopes, params=('cursor', 'format'))
+def post_comments(request, post_id):
+    """Следующая страница комментариев для «Показать еще»: фрагмент
+    HTML или, с ?format=json, JSON."""
+    as_json = request.GET.get('format') == 'json'
+    page = comments_page(
+        post_id, cursor=request.GET.get('cursor'),
+        params={'format': 'json'} if as_json else None,
+    )
+    if not page and not Post.objects.filter(pk=post_id).exists():
+        raise Http404
+    if not as_json:
+        return render(request, 'posts/includes/comment_list.html', {
+            'post_id': post_id,
+            'comments_page': page,
+        })
+    url = reverse('posts:post_comments', args=[post_id])
+    return JsonResponse({
+        'comments': [
+            {
+                'id': comment.pk,
+                'author': comment.author.username,
+                'author_url': reverse(
+                    'posts:profile', args=[comment.author.username]
+                ),
+                'text': comment.text,
+                'created': comment.created.isoformat(),
+            }
+            for comment in page
+        ],
+        'next': f'{url}?{page.next_query}' if page.has_next() else None,
+    })
+
+
 @login_required
 def post_create(request):
     form = PostForm(
@@ -123,16 +271,27 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+def follow_page_scopes(request):
+    return feed_scopes(request.user.pk) + [groups_scope()]
+
+
 @login_required
+@conditional_page(follow_page_scopes)
 def follow_index(request):
     template = 'posts/follow.html'
-    posts =  Post.objects.filter(
-        author__following__user=request.user
-    )
+    posts = feed_for(request.user).select_related('author', 'group')
+    scopes = feed_scopes(request.user.pk)
     context = {
         'posts': posts,
+        'feed_version': feed_version(*scopes),
     }
-    context.update(method_paginator(posts, request))
+    context.update(
+        method_paginator(
+            posts, request,
+            ordering=FEED_ORDERING,
+            count_scope=scopes,
+        )
+    )
     return render(request, template, context)
 
 
@@ -141,13 +300,7 @@ def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if author == request.user:
         return redirect('posts:profile', request.user.username)
-    follower = Follow.objects.filter(
-        user=request.user,
-        author=author
-    ).exists()
-    if follower is True:
-        return redirect('posts:profile', request.user.username)
-    Follow.objects.create(user=request.user, author=author)
+    Follow.objects.get_or_create(user=request.user, author=author)
     return redirect('posts:profile', request.user.username)
 
 
@@ -159,3 +312,30 @@ def profile_unfollow(request, username):
     following = get_object_or_404(Follow, user=request.user, author=author)
     following.delete()
     return redirect('posts:profile', request.user.username)
+
+
+@staff_member_required
+def export_data(request):
+    """Выгрузка данных потоком: ?model=post&model=comment, ?format=csv,
+    ?compress=gzip. По умолчанию — все модели в NDJSON."""
+    models = request.GET.getlist('model') or list(export.EXPORT_MODELS)
+    data_format = request.GET.get('format', 'ndjson')
+    compress = request.GET.get('compress') == 'gzip'
+    if (
+        data_format not in export.CONTENT_TYPES
+        or not set(models).issubset(export.EXPORT_MODELS)
+        or (data_format == 'csv' and len(models) != 1)
+    ):
+        return HttpResponseBadRequest(
+            'Неверные параметры выгрузки: CSV — по одной модели.'
+        )
+    chunks = export.encoded(export.lines(data_format, models))
+    content_type = export.CONTENT_TYPES[data_format]
+    if compress:
+        chunks = export.gzipped(chunks)
+        content_type = 'application/gzip'
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{}"'.format(
+        export.file_name(data_format, models, compress)
+    )
+    return response
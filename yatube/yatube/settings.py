@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -50,11 +51,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.RequestTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -63,7 +66,7 @@ ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.timing.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -80,6 +83,27 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
 
+TEST_RUNNER = 'core.runner.TestRunner'
+
+
+# default — кеш процесса: фрагменты, страницы и прочее, что лежит под
+# версиями областей (posts.cache). Сами версии должны видеть все процессы
+# сайта и команды, поэтому они в общем кеше shared. Файловый кеш общий
+# для процессов одной машины; на нескольких машинах shared стоит
+# перенести в memcached.
+CACHES = {
+    'default': {
+        'BACKEND': 'core.timing.TimedLocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'core.timing.TimedFileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'yatube-cache'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -88,6 +112,11 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Сколько секунд запись ждет, пока базу держит другая запись
+        # (busy timeout SQLite), прежде чем упасть с «database is locked».
+        'OPTIONS': {
+            'timeout': 20,
+        },
     }
 }
 
@@ -143,6 +172,122 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 
 NUMBER_OF_POSTS_PER_PAGE = 10
+# Сколько первых страниц ленты открываются по ?page=N (OFFSET),
+# дальше паджинатор листает по курсору.
+PAGINATOR_OFFSET_PAGES = 5
+# Сколько ссылок на страницы показывать по обе стороны от текущей.
+PAGINATOR_WINDOW = 2
+# Выше этого порога число постов в ленте считается приблизительно.
+PAGINATOR_COUNT_LIMIT = 10000
+# Сколько хранится закешированное число постов ленты (секунды).
+PAGINATOR_COUNT_CACHE_TIMEOUT = 60 * 60
+# Сколько комментариев на странице поста и в каждой догрузке.
+COMMENTS_PER_PAGE = 20
+# Карточки постов сбрасываются сменой версии, срок нужен только
+# чтобы осиротевшие версии не занимали кеш вечно.
+POST_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+# Кеш целых страниц для анонимных посетителей. Страницы сбрасываются
+# сменой версий; срок ограничивает устаревание того, что версии
+# не отслеживают (например, год в подвале).
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_TIMEOUT = 60 * 10
+# Хранить страницы сжатыми gzip, если они не короче порога (байты).
+PAGE_CACHE_GZIP = True
+PAGE_CACHE_MIN_GZIP_LENGTH = 512
+
+# Лента подписок заполняется при публикации поста. Если у автора больше
+# подписчиков, чем FEED_FANOUT_SYNC_LIMIT, рассылка уходит в фоновый поток
+# и не задерживает ответ автору. При подписке в ленту попадают все посты
+# автора; и рассылка, и подписка пишут порциями по FEED_FANOUT_BATCH_SIZE.
+FEED_FANOUT_SYNC_LIMIT = 1000
+FEED_FANOUT_BATCH_SIZE = 500
+
+
+# Миниатюры картинок создаются в фоне, в пуле из стольких процессов.
+# 0 — создавать прямо во время запроса, как делает sorl по умолчанию.
+THUMBNAIL_POOL_WORKERS = 2
+THUMBNAIL_BACKEND = 'posts.thumbnails.QueuedThumbnailBackend'
+# Ширины, на которые режется картинка поста для srcset (пиксели).
+POST_IMAGE_WIDTHS = (320, 640, 960)
+# Загрузки картинок: предел размера файла и числа пикселей. Оригинал
+# в фоне уменьшается до POST_IMAGE_MAX_SIDE по большей стороне,
+# теряет EXIF и пережимается с качеством POST_IMAGE_QUALITY.
+POST_IMAGE_MAX_UPLOAD_SIZE = 20 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40 * 10 ** 6
+POST_IMAGE_MAX_SIDE = 2560
+POST_IMAGE_QUALITY = 85
+FILE_UPLOAD_HANDLERS = ['posts.uploads.BoundedUploadHandler']
+# Записи о миниатюрах держатся в LRU каждого процесса: не больше
+# THUMBNAIL_LRU_SIZE штук, чужие удаления замечаются не позже чем
+# через THUMBNAIL_LRU_CHECK_INTERVAL секунд. Кеш за LRU (и поколение,
+# по которому LRU сбрасываются) общий для всех процессов.
+THUMBNAIL_KVSTORE = 'posts.kvstore.LRUKVStore'
+THUMBNAIL_CACHE = 'shared'
+THUMBNAIL_LRU_SIZE = 10000
+THUMBNAIL_LRU_CHECK_INTERVAL = 5
+
+# Массовая загрузка данных (команда import_data): строк в одном
+# bulk_create и записей в одной транзакции.
+BULK_IMPORT_BATCH_SIZE = 1000
+BULK_IMPORT_CHUNK_SIZE = 50000
+
+# Выгрузка данных (команда export_data и /export/): строк в одном
+# запросе по ключу и строк, которые драйвер базы отдает за раз.
+EXPORT_BATCH_SIZE = 10000
+EXPORT_CHUNK_SIZE = 2000
+
+# Время запросов к базе, шаблонов, кеша и миниатюр (core.middleware)
+# пишется в лог core.timing (см. LOGGING) и в заголовок Server-Timing:
+# 'internal' — только сотрудникам и адресам INTERNAL_IPS, True — всем,
+# False — никому.
+SERVER_TIMING_HEADER = 'internal'
+# Профили запросов (core.profiling): куда писать, сколько живет токен
+# сотрудника (секунды), какую долю всех запросов снимать сэмплером
+# (0 — ни одного) и как часто он снимает стек (секунды).
+PROFILER_ROOT = os.path.join(BASE_DIR, 'profiles')
+PROFILER_TOKEN_MAX_AGE = 60 * 60
+PROFILER_SAMPLE_RATE = 0
+PROFILER_SAMPLE_INTERVAL = 0.005
+
+# Строка на каждый запрос: представление, статус и замеры core.timing.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'timing': {
+            'format': '{asctime} {name} {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'timing': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'timing',
+        },
+    },
+    'loggers': {
+        'core.timing': {
+            'handlers': ['timing'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Метрики для Prometheus (core.metrics) на /metrics: доступны только
+# с адресов INTERNAL_IPS (можно подсети). За обратным прокси в
+# INTERNAL_IPS должны быть и его адрес, и адреса, которые он пишет в
+# X-Forwarded-For: внутренним считается запрос, у которого внутренние
+# REMOTE_ADDR и все адреса этого заголовка (core.network).
+# Процессы сайта пишут значения в свои файлы в METRICS_ROOT, страница
+# складывает их, а файлы умерших процессов сливает в архив. Гистограммы
+# времени ответа — по адресам из METRICS_URLCONFS, границы в секундах.
+INTERNAL_IPS = ['127.0.0.1', '::1']
+METRICS_ROOT = os.path.join(tempfile.gettempdir(), 'yatube-metrics')
+METRICS_URLCONFS = ('posts.urls', 'users.urls', 'about.urls')
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
 
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'